@@ -18,7 +18,9 @@ from warnings import warn
 import numpy as np
 
 from .model import Model
-from ..io.hdf_utils import getH5DsetRefs, getAuxData
+from .utils.be_loop import fitLoopBatch, generateGuessBatch, projectLoopBatch
+from ..io.be_hdf_utils import maxReadPixels
+from ..io.hdf_utils import getH5DsetRefs, getAuxData, buildReducedSpec, linkRefs, linkRefAsAlias, markModified
 from ..io.io_hdf5 import ioHDF5
 from ..io.microdata import MicroDataset, MicroDataGroup
 
@@ -37,16 +39,21 @@ loop_fit32 = np.dtype([('a_0', np.float32),
                        ('b_2', np.float32),
                        ('b_3', np.float32)])
 
+loop_metrics32 = np.dtype([('Area', np.float32),
+                           ('Centroid x', np.float32),
+                           ('Centroid y', np.float32),
+                           ('Rotation Angle [rad]', np.float32),
+                           ('Offset', np.float32)])
+
 class BELoopmodel(Model):
+    """
+    Analysis of Band excitation loops using functional fits
+    """
 
-    def __init__(self, h5_main):
-        if super.__isLegal(h5_main,variables=['DC Bias (V)']):
-            self.hdf = ioHDF5(self.h5_main.file)
-            self.h5_main = h5_main
-            self.h5_guess = None
-            self.h5_fit = None
-        else:
-            warn('Provided dataset is not "Main" dataset or lacks necessary ancillary datasets!')
+    def __init__(self, h5_main, variables=['DC_Offset']):
+        super(BELoopmodel, self).__init__(h5_main, variables)
+        self.h5_criteria = None
+        self.h5_fitted_loops = None
 
     def _createGuessDatasets(self):
         """
@@ -89,14 +96,14 @@ class BELoopmodel(Model):
         # do linking here
         # first the positions
         for dset in [self.h5_fitted_loops, self.h5_criteria, self.h5_guess]:
-            self.hdf.linkRefs(dset, h5_pos_dsets)
+            linkRefs(dset, h5_pos_dsets)
 
         # then the spectroscopic 
         h5_anc_sp_ind = getAuxData(h5_loop_metrics, auxDataName=['Spectroscopic_Indices'])[0]
         h5_anc_sp_val = getAuxData(h5_loop_metrics, auxDataName=['Spectroscopic_Values'])[0]
-        for dset in [self.h5_criteria, self.h5_guess, self.h5_fit]:
-            self.hdf.linkRefAsAlias(dset, h5_anc_sp_ind, 'Spectroscopic_Indices')
-            self.hdf.linkRefAsAlias(dset, h5_anc_sp_val, 'Spectroscopic_Values')
+        for dset in [self.h5_criteria, self.h5_guess]:
+            linkRefAsAlias(dset, h5_anc_sp_ind, 'Spectroscopic_Indices')
+            linkRefAsAlias(dset, h5_anc_sp_val, 'Spectroscopic_Values')
 
         # make a new spectroscopic values dataset for the shifted Vdc...
         h5_spec_ind = getAuxData(self.h5_main, auxDataName=['Spectroscopic_Indices'])[0]
@@ -147,12 +154,260 @@ class BELoopmodel(Model):
 
         self.h5_fit = getH5DsetRefs(['Fit'], h5_sho_grp_refs)[0]
 
-        h5_pos_dsets = getAuxData(self.h5_main, auxDataName=['Position_Indices',
-                                                             'Position_Values'])
-        '''self.hdf.linkRefs(self.h5_fit, h5_pos_dsets)
-        self.hdf.linkRefAsAlias(self.h5_fit, h5_anc_sp_ind, 'Spectroscopic_Indices')
-        self.hdf.linkRefAsAlias(self.h5_fit, h5_anc_sp_val, 'Spectroscopic_Values')'''
+        # same ancillary datasets as the guess
+        linkRefs(self.h5_fit, getAuxData(self.h5_guess, auxDataName=['Position_Indices', 'Position_Values']))
+        for aux_name in ['Spectroscopic_Indices', 'Spectroscopic_Values']:
+            linkRefAsAlias(self.h5_fit, getAuxData(self.h5_guess, auxDataName=[aux_name])[0], aux_name)
         '''
         Copy attributes of the fit guess
         Check the guess dataset for plot groups, copy them if they exist
-        '''
\ No newline at end of file
+        '''
+
+    def _getDCVector(self):
+        """
+        Returns the DC offsets of the first loop, shifted by one quarter as required for the fit
+
+        Returns
+        -------
+        vdc_shifted : 1D numpy array
+            DC voltage values shifted by one quarter
+        """
+        h5_spec_vals = getAuxData(self.h5_main, auxDataName=['Spectroscopic_Values'])[0]
+        num_steps = self.h5_main.shape[1] // self.h5_guess.shape[1]
+        vdc_vec = np.squeeze(h5_spec_vals[h5_spec_vals.attrs['DC_Offset']])[:num_steps]
+        return np.roll(vdc_vec, -(num_steps // 4))
+
+    def computeGuess(self, force=False, **kwargs):
+        """
+        Generates the guesses for all the loops in the dataset, one chunk of positions at a time. All loops within a
+        chunk are handled together using be_loop.generateGuessBatch(). The guesses are written to the file after
+        each chunk.
+
+        Parameters
+        ----------
+        force : Boolean (Optional. Default = False)
+            Whether or not to compute the guess even if a guess already exists for this dataset
+        kwargs:
+            Unused. Present for compatibility with Model.computeGuess()
+
+        Returns
+        -------
+        h5_guess : h5py.Dataset object
+            Dataset containing the guesses for the fit parameters
+        """
+        if self._findExistingGuess({'strategy': 'generateGuessBatch'}, force=force):
+            return self.h5_guess
+
+        self._createGuessDatasets()
+
+        num_pos = self.h5_main.shape[0]
+        num_loops = self.h5_guess.shape[1]
+        num_steps = self.h5_main.shape[1] // num_loops
+        h5_spec_vals = getAuxData(self.h5_main, auxDataName=['Spectroscopic_Values'])[0]
+        vdc_vec = np.squeeze(h5_spec_vals[h5_spec_vals.attrs['DC_Offset']])[:num_steps]
+
+        for start_pos in range(0, num_pos, self._max_pos_per_read):
+            end_pos = min(num_pos, start_pos + self._max_pos_per_read)
+            print('Generating guesses for loops at positions {} to {} of {}'.format(start_pos, end_pos, num_pos))
+
+            loops = np.reshape(self.h5_main[start_pos:end_pos], (-1, num_steps))
+            guess_mat = generateGuessBatch(vdc_vec, loops)
+
+            guess_vec = np.zeros(shape=guess_mat.shape[0], dtype=loop_fit32)
+            for ind, name in enumerate(loop_fit32.names):
+                guess_vec[name] = guess_mat[:, ind]
+            self.h5_guess[start_pos:end_pos] = guess_vec.reshape(end_pos - start_pos, num_loops)
+
+            self.hdf.flush()
+
+        markModified(self.h5_guess)
+        self._recordGuessParms()
+
+        print('Finished generating guesses for all loops!')
+        return self.h5_guess
+
+    def _reuseGuessDataset(self, h5_guess):
+        """
+        Picks up the criteria and fitted loops datasets that were created along with an existing guess dataset
+
+        Parameters
+        ----------
+        h5_guess : h5py.Dataset object
+            Existing guess dataset
+        """
+        self.h5_guess = h5_guess
+        h5_fit_grp = h5_guess.parent
+        self.h5_criteria = h5_fit_grp['Criteria'] if 'Criteria' in h5_fit_grp else None
+        self.h5_fitted_loops = h5_fit_grp['Fitted_Loops'] if 'Fitted_Loops' in h5_fit_grp else None
+
+    def computeFit(self, max_iter=200, **kwargs):
+        """
+        Fits all the loops in the dataset, one chunk of positions at a time. All loops within a chunk are fit together
+        using be_loop.fitLoopBatch(). The fit parameters, information criteria and fitted loops are written to the
+        file after each chunk.
+
+        Parameters
+        ----------
+        max_iter : unsigned int (Optional. Default = 200)
+            Maximum number of iterations of the solver
+        kwargs:
+            Passed to be_loop.fitLoopBatch()
+
+        Returns
+        -------
+        h5_fit : h5py.Dataset object
+            Dataset containing the fit parameters
+        """
+        if self.h5_guess is None:
+            warn('Need to guess before fitting!')
+            return
+        self._createFitDataset()
+
+        num_pos = self.h5_main.shape[0]
+        num_loops = self.h5_guess.shape[1]
+        num_steps = self.h5_main.shape[1] // num_loops
+        vdc_shifted = self._getDCVector()
+
+        # The solver holds the Jacobian (9 values per point) and a few copies of the loops in memory
+        pos_per_chunk = max(1, self._max_pos_per_read // 16)
+
+        for start_pos in range(0, num_pos, pos_per_chunk):
+            end_pos = min(num_pos, start_pos + pos_per_chunk)
+            print('Fitting loops at positions {} to {} of {}'.format(start_pos, end_pos, num_pos))
+
+            loops = np.reshape(self.h5_main[start_pos:end_pos], (-1, num_steps))
+            loops = np.roll(loops, -(num_steps // 4), axis=1)
+            guess = self.h5_guess[start_pos:end_pos].ravel()
+            guess_mat = np.vstack([guess[name] for name in loop_fit32.names]).T
+
+            coef_mat, criteria_mat, fit_mat = fitLoopBatch(vdc_shifted, loops, guess_mat, max_iter=max_iter,
+                                                           **kwargs)
+
+            fit_vec = np.zeros(shape=coef_mat.shape[0], dtype=loop_fit32)
+            for ind, name in enumerate(loop_fit32.names):
+                fit_vec[name] = coef_mat[:, ind]
+            self.h5_fit[start_pos:end_pos] = fit_vec.reshape(end_pos - start_pos, num_loops)
+
+            if self.h5_criteria is not None:
+                crit_vec = np.zeros(shape=criteria_mat.shape[0], dtype=crit32)
+                for ind, name in enumerate(crit32.names):
+                    crit_vec[name] = criteria_mat[:, ind]
+                self.h5_criteria[start_pos:end_pos] = crit_vec.reshape(end_pos - start_pos, num_loops)
+
+            if self.h5_fitted_loops is not None:
+                fit_mat = np.roll(fit_mat, num_steps // 4, axis=1)
+                self.h5_fitted_loops[start_pos:end_pos] = np.reshape(fit_mat, (end_pos - start_pos, -1))
+
+            self.hdf.flush()
+
+        for h5_dset in [self.h5_fit, self.h5_criteria, self.h5_fitted_loops]:
+            if h5_dset is not None:
+                markModified(h5_dset)
+        print('Finished fitting all loops!')
+        return self.h5_fit
+
+
+def projectLoops(h5_sho_fit, max_mem=1024 ** 3):
+    """
+    Projects all the loops in the SHO fit dataset, one chunk of positions at a time. All loops within a chunk are
+    projected together using be_loop.projectLoopBatch(). The projected loops and the loop metrics (area, centroid,
+    rotation angle and offset) are written to the file after each chunk. The projected loops dataset can then be
+    passed on to BELoopmodel.
+
+    Parameters
+    ----------
+    h5_sho_fit : h5py.Dataset object
+        SHO fit dataset of compound datatype sho32 arranged as [position, UDVS step]
+    max_mem : unsigned int (Optional. Default = 1 GB)
+        Maximum memory (in bytes) that may be used for the projection
+
+    Returns
+    -------
+    h5_projected_loops : h5py.Dataset object
+        Dataset containing the projected loops arranged as [position, UDVS step]
+    h5_loop_metrics : h5py.Dataset object
+        Dataset of compound datatype loop_metrics32 arranged as [position, loop]
+    """
+    hdf = ioHDF5(h5_sho_fit.file)
+
+    h5_pos_dsets = getAuxData(h5_sho_fit, auxDataName=['Position_Indices', 'Position_Values'])
+    h5_spec_inds = getAuxData(h5_sho_fit, auxDataName=['Spectroscopic_Indices'])[0]
+    h5_spec_vals = getAuxData(h5_sho_fit, auxDataName=['Spectroscopic_Values'])[0]
+
+    dc_inds = np.squeeze(h5_spec_inds[h5_spec_inds.attrs['DC_Offset']])
+    loop_start_inds = np.where(dc_inds == 0)[0]
+    num_pos = h5_sho_fit.shape[0]
+    num_loops = len(loop_start_inds)
+    num_steps = h5_sho_fit.shape[1] // num_loops
+    vdc_vec = np.squeeze(h5_spec_vals[h5_spec_vals.attrs['DC_Offset']])[:num_steps]
+
+    ds_projected_loops = MicroDataset('Projected_Loops', data=[], dtype=np.float32, maxshape=h5_sho_fit.shape,
+                                      chunking=h5_sho_fit.chunks, compression='gzip')
+    ds_loop_metrics = MicroDataset('Loop_Metrics', data=[], dtype=loop_metrics32, maxshape=(num_pos, num_loops))
+
+    not_dc = h5_spec_inds.attrs['labels'] != 'DC_Offset'
+    if np.any(not_dc):
+        # Other dimensions such as field or cycle remain in the loop metrics
+        ds_metrics_inds, ds_metrics_vals = buildReducedSpec(h5_spec_inds, h5_spec_vals, not_dc, loop_start_inds)
+    else:
+        '''
+        Special case for datasets that only vary by DC offset - a single loop per position
+        '''
+        ds_metrics_inds = MicroDataset('Spectroscopic_Indices', np.array([[0]], dtype=np.uint32))
+        ds_metrics_vals = MicroDataset('Spectroscopic_Values', np.array([[0]], dtype=np.float32))
+
+        ds_metrics_inds.attrs['labels'] = {'Single_Step': (slice(0, None), slice(None))}
+        ds_metrics_vals.attrs['labels'] = {'Single_Step': (slice(0, None), slice(None))}
+        ds_metrics_inds.attrs['units'] = ''
+        ds_metrics_vals.attrs['units'] = ''
+
+    # name of the dataset being projected. I know its 'Fit' here
+    dset_name = h5_sho_fit.name.split('/')[-1]
+
+    proj_grp = MicroDataGroup('-'.join([dset_name, 'Loop_Projection_']), h5_sho_fit.parent.name[1:])
+    proj_grp.attrs['projection_method'] = "pycroscopy BE loop model"
+    proj_grp.addChildren([ds_projected_loops, ds_loop_metrics, ds_metrics_inds, ds_metrics_vals])
+
+    h5_proj_grp_refs = hdf.writeData(proj_grp, print_log=False)
+
+    h5_projected_loops = getH5DsetRefs(['Projected_Loops'], h5_proj_grp_refs)[0]
+    h5_loop_metrics = getH5DsetRefs(['Loop_Metrics'], h5_proj_grp_refs)[0]
+    h5_metrics_inds = getH5DsetRefs(['Spectroscopic_Indices'], h5_proj_grp_refs)[0]
+    h5_metrics_vals = getH5DsetRefs(['Spectroscopic_Values'], h5_proj_grp_refs)[0]
+
+    # do linking here
+    linkRefs(h5_projected_loops, h5_pos_dsets + [h5_spec_inds, h5_spec_vals, h5_loop_metrics])
+    linkRefs(h5_loop_metrics, h5_pos_dsets)
+    linkRefAsAlias(h5_loop_metrics, h5_metrics_inds, 'Spectroscopic_Indices')
+    linkRefAsAlias(h5_loop_metrics, h5_metrics_vals, 'Spectroscopic_Values')
+
+    # The SVD holds three copies of each loop in double precision in addition to the compound data
+    pos_per_chunk = int(maxReadPixels(max_mem, num_pos, h5_sho_fit.shape[1],
+                                      bytes_per_bin=h5_sho_fit.dtype.itemsize + 8 * 8))
+
+    for start_pos in range(0, num_pos, pos_per_chunk):
+        end_pos = min(num_pos, start_pos + pos_per_chunk)
+        print('Projecting loops at positions {} to {} of {}'.format(start_pos, end_pos, num_pos))
+
+        sho_mat = h5_sho_fit[start_pos:end_pos]
+        amp_mat = np.reshape(sho_mat['Amplitude [V]'], (-1, num_steps))
+        phase_mat = np.reshape(sho_mat['Phase [rad]'], (-1, num_steps))
+
+        results = projectLoopBatch(vdc_vec, amp_mat, phase_mat)
+
+        metrics_vec = np.zeros(shape=amp_mat.shape[0], dtype=loop_metrics32)
+        metrics_vec['Area'] = results['Geometric Area']
+        metrics_vec['Centroid x'] = results['Centroid'][:, 0]
+        metrics_vec['Centroid y'] = results['Centroid'][:, 1]
+        metrics_vec['Rotation Angle [rad]'] = results['Rotation Matrix'][:, 0]
+        metrics_vec['Offset'] = results['Rotation Matrix'][:, 1]
+
+        h5_projected_loops[start_pos:end_pos] = np.reshape(results['Projected Loop'], (end_pos - start_pos, -1))
+        h5_loop_metrics[start_pos:end_pos] = np.reshape(metrics_vec, (end_pos - start_pos, num_loops))
+
+        hdf.flush()
+
+    markModified(h5_projected_loops)
+    markModified(h5_loop_metrics)
+    print('Finished projecting all loops!')
+    return h5_projected_loops, h5_loop_metrics
@@ -9,9 +9,11 @@ import numpy as np
 from .model import Model
 from ..io.be_hdf_utils import isReshapable, reshapeToNsteps, reshapeToOneStep
 from ..io.hdf_utils import buildReducedSpec, copyRegionRefs, linkRefs, getAuxData, getH5DsetRefs, \
-            copyAttributes
+            copyAttributes, markModified
 from ..io.microdata import MicroDataset, MicroDataGroup
 from .guess_methods import GuessMethods
+from .utils.be_sho import SHOfuncBatch
+from .utils.fit_quality import evaluate_fit_quality, fit_crit32
 
 # try:
 #     import multiprocess as mp
@@ -32,6 +34,9 @@ class BESHOmodel(Model):
         super(BESHOmodel, self).__init__(h5_main, variables)
         self.step_start_inds = None
         self.is_reshapable = True
+        self.h5_guess_criteria = None
+        self.h5_fit_criteria = None
+        self.__criteria = list()
 
     def _createGuessDatasets(self):
         """
@@ -62,6 +67,9 @@ class BESHOmodel(Model):
         ds_guess = MicroDataset('Guess', data=[],
                                 maxshape=(self.h5_main.shape[0], self.num_udvs_steps),
                                 chunking=(1, self.num_udvs_steps), dtype=sho32)
+        ds_guess_crit = MicroDataset('Guess_Criteria', data=[],
+                                     maxshape=(self.h5_main.shape[0], self.num_udvs_steps),
+                                     chunking=(1, self.num_udvs_steps), dtype=fit_crit32)
 
         not_freq = h5_spec_inds.attrs['labels'] != 'Frequency'
         if h5_spec_inds.shape[0] > 1:
@@ -86,6 +94,7 @@ class BESHOmodel(Model):
                                            'SHO_Fit_']),
                                  self.h5_main.parent.name[1:])
         sho_grp.addChildren([ds_guess,
+                             ds_guess_crit,
                              ds_sho_inds,
                              ds_sho_vals])
         sho_grp.attrs['SHO_guess_method'] = "pycroscopy BESHO"
@@ -93,18 +102,20 @@ class BESHOmodel(Model):
         h5_sho_grp_refs = self.hdf.writeData(sho_grp)
 
         self.h5_guess = getH5DsetRefs(['Guess'], h5_sho_grp_refs)[0]
+        self.h5_guess_criteria = getH5DsetRefs(['Guess_Criteria'], h5_sho_grp_refs)[0]
         h5_sho_inds = getH5DsetRefs(['Spectroscopic_Indices'],
                                     h5_sho_grp_refs)[0]
         h5_sho_vals = getH5DsetRefs(['Spectroscopic_Values'],
                                     h5_sho_grp_refs)[0]
 
         # Reference linking before actual fitting
-        linkRefs(self.h5_guess, [h5_sho_inds, h5_sho_vals])
-        # Linking ancillary position datasets:
         aux_dsets = getAuxData(self.h5_main, auxDataName=['Position_Indices', 'Position_Values'])
-        linkRefs(self.h5_guess, aux_dsets)
+        for h5_dset in [self.h5_guess, self.h5_guess_criteria]:
+            linkRefs(h5_dset, [h5_sho_inds, h5_sho_vals])
+            # Linking ancillary position datasets:
+            linkRefs(h5_dset, aux_dsets)
 
-        copyRegionRefs(self.h5_main, self.h5_guess)
+            copyRegionRefs(self.h5_main, h5_dset)
 
     def _createFitDataset(self):
         """
@@ -134,19 +145,41 @@ class BESHOmodel(Model):
         # dataset size is same as guess size
         ds_result = MicroDataset('Fit', data=[], maxshape=(self.h5_guess.shape[0], self.h5_guess.shape[1]),
                                  chunking=self.h5_guess.chunks, dtype=sho32)
-        sho_grp.addChildren([ds_result])
+        ds_result_crit = MicroDataset('Fit_Criteria', data=[], maxshape=ds_result.maxshape,
+                                      chunking=self.h5_guess.chunks, dtype=fit_crit32)
+        sho_grp.addChildren([ds_result, ds_result_crit])
         sho_grp.attrs['SHO_fit_method'] = "pycroscopy BESHO"
 
         h5_sho_grp_refs = self.hdf.writeData(sho_grp)
 
         self.h5_fit = getH5DsetRefs(['Fit'], h5_sho_grp_refs)[0]
+        self.h5_fit_criteria = getH5DsetRefs(['Fit_Criteria'], h5_sho_grp_refs)[0]
 
         '''
         Copy attributes of the fit guess
         '''
         copyAttributes(self.h5_guess, self.h5_fit, skip_refs=False)
+        copyAttributes(self.h5_guess, self.h5_fit_criteria, skip_refs=False)
 
 
+    def _reuseGuessDataset(self, h5_guess):
+        """
+        Sets up the UDVS steps and frequency vector required for fitting from an existing guess dataset
+
+        Parameters
+        ----------
+        h5_guess : h5py.Dataset object
+            Existing guess dataset
+        """
+        h5_spec_inds = getAuxData(self.h5_main, auxDataName=['Spectroscopic_Indices'])[0]
+        self.step_start_inds = np.where(h5_spec_inds[0] == 0)[0]
+        self.num_udvs_steps = len(self.step_start_inds)
+        self._getFrequencyVector()
+        self.is_reshapable = isReshapable(self.h5_main, self.step_start_inds)
+        self.h5_guess = h5_guess
+        if 'Guess_Criteria' in h5_guess.parent:
+            self.h5_guess_criteria = h5_guess.parent['Guess_Criteria']
+
     def _getFrequencyVector(self):
         """
         Assumes that the data is reshape-able
@@ -229,14 +262,24 @@ class BESHOmodel(Model):
             self.guess = reshapeToNsteps(self.guess, self.num_udvs_steps)
             if verbose:
                 print('Reshaped guess to shape {}'.format(self.guess.shape))
+            h5_criteria = self.h5_guess_criteria
         else:
             self.fit = np.transpose(np.atleast_2d(self.fit))
             self.fit = reshapeToNsteps(self.fit, self.num_udvs_steps)
+            h5_criteria = self.h5_fit_criteria
+
+        # goodness of fit metrics collected by _reformatResults for every chunk
+        if h5_criteria is not None and len(self.__criteria) > 0:
+            criteria = np.transpose(np.atleast_2d(np.hstack(self.__criteria)))
+            h5_criteria[:, :] = reshapeToNsteps(criteria, self.num_udvs_steps)
+            markModified(h5_criteria)
+        self.__criteria = list()
 
         # ask super to take care of the rest, which is a standardized operation
         super(BESHOmodel, self)._setResults(is_guess)
 
-    def computeGuess(self, strategy='wavelet_peaks', options={"peak_widths": np.array([10,200])}, **kwargs):
+    def computeGuess(self, strategy='wavelet_peaks', options={"peak_widths": np.array([10,200])}, force=False,
+                     **kwargs):
         """
 
         Parameters
@@ -248,6 +291,9 @@ class BESHOmodel(Model):
         options: dict
             Default {"peaks_widths": np.array([10,200])}}.
             Dictionary of options passed to strategy. For more info see GuessMethods documentation.
+        force: Boolean
+            Default False. Whether or not to compute the guess even if a guess with the same strategy and options
+            already exists for this dataset.
 
         kwargs:
             processors: int
@@ -258,15 +304,27 @@ class BESHOmodel(Model):
 
         """
 
+        if self._findExistingGuess({'strategy': strategy, 'options': options}, force=force):
+            return
+
         self._createGuessDatasets()
         self.__start_pos = 0
+        self.__criteria = list()
 
         processors = kwargs.get("processors", self._maxCpus)
         gm = GuessMethods()
         if strategy in gm.methods:
             func = gm.__getattribute__(strategy)(frequencies=self.freq_vec, **options)
             results = list()
-            if self._parallel:
+            if hasattr(func, 'batch'):
+                # The strategy can process an entire chunk of data at once
+                print('Computing Guesses In batches ...')
+                self._getDataChunk()
+                while self.data is not None:  # as long as we have not reached the end of this data set:
+                    results.append(self._reformatResults(func.batch(self.data), strategy))
+                    # read the next chunk
+                    self._getDataChunk()
+            elif self._parallel:
                 # start pool of workers
                 print('Computing Guesses In parallel ... launching %i kernels...' % processors)
                 pool = mp.Pool(processors)
@@ -302,21 +360,21 @@ class BESHOmodel(Model):
 
             # Write to file
             self._setResults(is_guess=True)
+            self._recordGuessParms()
         else:
             warn('Error: %s is not implemented in pycroscopy.analysis.GuessMethods to find guesses' % strategy)
 
 
     def computeFit(self, strategy='SHO', options={}, **kwargs):
         """
+        Fits the SHO model to every step of the dataset starting from the guess
 
         Parameters
         ----------
         strategy: string
-            Default is 'Wavelet_Peaks'.
-            Can be one of ['wavelet_peaks', 'relative_maximum', 'gaussian_processes']. For updated list, run GuessMethods.methods
+            Default is 'SHO'. Only the SHO model is currently fitted.
         options: dict
-            Default {"peaks_widths": np.array([10,200])}}.
-            Dictionary of options passed to strategy. For more info see GuessMethods documentation.
+            Default {}. Currently unused.
 
         kwargs:
             processors: int
@@ -329,6 +387,7 @@ class BESHOmodel(Model):
 
         self._createFitDataset()
         self.__start_pos = 0
+        self.__criteria = list()
         parallel = ''
 
         processors = kwargs.get("processors", self._maxCpus)
@@ -366,49 +425,65 @@ class BESHOmodel(Model):
     def _reformatResults(self, results, strategy='wavelet_peaks', verbose=False):
         """
         Model specific calculation and or reformatting of the raw guess or fit results
-        :param results:
+        :param results: list of results per pixel or (peak_offsets, peak_indices) from batched peak finding
         :return:
         """
         if verbose:
             print('Strategy to use: {}'.format(strategy))
+        if isinstance(results, tuple):
+            num_pixels = len(results[0]) - 1
+        else:
+            num_pixels = len(results)
         # Create an empty dataset to store the guess parameters
-        sho_vec = np.zeros(shape=(len(results)), dtype=sho32)
+        sho_vec = np.zeros(shape=num_pixels, dtype=sho32)
         if verbose:
-            print('Raw results and compound SHO vector of shape {}'.format(len(results)))
+            print('Raw results and compound SHO vector of shape {}'.format(num_pixels))
 
         # Extracting and reshaping the remaining parameters for SHO
         if strategy in ['wavelet_peaks', 'relative_maximum', 'absolute_maximum']:
-            # wavelet_peaks sometimes finds 0, 1, 2, or more peaks. Need to handle that:
-            # peak_inds = np.array([pixel[0] for pixel in results])
-            peak_inds = np.zeros(shape=(len(results)), dtype=np.uint32)
-            for pix_ind, pixel in enumerate(results):
-                if len(pixel) == 1:  # majority of cases - one peak found
-                    peak_inds[pix_ind] = pixel[0]
-                elif len(pixel) == 0:  # no peak found
-                    peak_inds[pix_ind] = int(0.5*self.data.shape[1])  # set to center of band
-                else:  # more than one peak found
-                    dist = np.abs(np.array(pixel) - int(0.5*self.data.shape[1]))
-                    peak_inds[pix_ind] = pixel[np.argmin(dist)]  # set to peak closest to center of band
+            # wavelet_peaks sometimes finds 0, 1, 2, or more peaks. Need to handle that.
+            # Peaks are handled in the compact form - peaks of pixel i are peak_vals[peak_offsets[i]:peak_offsets[i+1]]
+            if isinstance(results, tuple):
+                # batched strategies already provide the compact form
+                peak_offsets, peak_vals = results
+            else:
+                results = [np.atleast_1d(pixel) for pixel in results]
+                peak_offsets = np.append(0, np.cumsum([pixel.size for pixel in results]))
+                peak_vals = np.hstack(results) if len(results) > 0 else np.array([])
+            peak_offsets = np.asarray(peak_offsets, dtype=np.int64)
+            peak_vals = np.asarray(peak_vals, dtype=np.int64)
+            num_peaks = np.diff(peak_offsets)
+            band_center = int(0.5 * self.data.shape[1])
+            # set to center of band if no peak found:
+            peak_inds = np.full(shape=num_peaks.size, fill_value=band_center, dtype=np.uint32)
+            # set to peak closest to center of band otherwise. Sorting by distance within each pixel places the
+            # closest peak at the start of each pixel's segment:
+            pixel_of_peak = np.repeat(np.arange(num_peaks.size), num_peaks)
+            closest_first = np.lexsort((np.abs(peak_vals - band_center), pixel_of_peak))
+            found = num_peaks > 0
+            peak_inds[found] = peak_vals[closest_first[peak_offsets[:-1][found]]]
             if verbose:
                 print('Peak positions of shape {}'.format(peak_inds.shape))
             # First get the value (from the raw data) at these positions:
-            comp_vals = np.array(
-                [self.data[pixel_ind, peak_inds[pixel_ind]] for pixel_ind in np.arange(peak_inds.size)])
+            comp_vals = self.data[np.arange(peak_inds.size), peak_inds]
             if verbose:
                 print('Complex values at peak positions of shape {}'.format(comp_vals.shape))
             sho_vec['Amplitude [V]'] = np.abs(comp_vals)  # Amplitude
             sho_vec['Phase [rad]'] = np.angle(comp_vals)  # Phase in radians
             sho_vec['Frequency [Hz]'] = self.freq_vec[peak_inds]  # Frequency
             sho_vec['Quality Factor'] = np.ones_like(comp_vals) * 10  # Quality factor
-            # Add something here for the R^2
-            # sho_vec['R2 Criterion'] = np.array([self.r_square(self.data, self._sho_func, self.freq_vec, sho_parms) for sho_parms in sho_vec])
         elif strategy in ['complex_gaussian']:
-            for iresult, result in enumerate(results):
-                sho_vec['Amplitude [V]'][iresult] = result[0]
-                sho_vec['Frequency [Hz]'][iresult] = result[1]
-                sho_vec['Quality Factor'][iresult] = result[2]
-                sho_vec['Phase [rad]'][iresult] = result[3]
-                sho_vec['R2 Criterion'][iresult] = result[4]
+            parm_mat = np.atleast_2d(np.array(results))
+            sho_vec['Amplitude [V]'] = parm_mat[:, 0]
+            sho_vec['Frequency [Hz]'] = parm_mat[:, 1]
+            sho_vec['Quality Factor'] = parm_mat[:, 2]
+            sho_vec['Phase [rad]'] = parm_mat[:, 3]
+
+        # The goodness of the guess or fit is evaluated for the entire chunk in one shot
+        parm_mat = np.vstack([sho_vec[name] for name in sho_vec.dtype.names[:4]]).T
+        criteria = evaluate_fit_quality(self.data, SHOfuncBatch, parm_mat, self.freq_vec)
+        sho_vec['R2 Criterion'] = criteria['R2 Criterion']
+        self.__criteria.append(criteria)
 
         return sho_vec
 
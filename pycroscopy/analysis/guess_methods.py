@@ -6,8 +6,9 @@ Created on 10/5/16 3:44 PM
 from warnings import warn
 
 import numpy as np
+from scipy.fftpack import next_fast_len
 from scipy.signal import find_peaks_cwt
-from .utils.be_sho import SHOestimateGuess, SHOfunc
+from .utils.be_sho import SHOestimateGuess
 
 
 class GuessMethods(object):
@@ -39,12 +40,15 @@ class GuessMethods(object):
         Returns
         -------
         wpeaks: callable function.
+            wpeaks.batch() finds the peaks in all rows of a 2D chunk of data at once via find_peaks_cwt_batch()
         """
         try:
             peak_width_bounds = kwargs.get('peak_widths')
             kwargs.pop('peak_widths')
             peak_width_step = kwargs.get('peak_step', 20)
             kwargs.pop('peak_step')
+            # The frequency vector supplied by BESHOmodel is not needed for finding peaks
+            kwargs.pop('frequencies', None)
             # The below numpy array is used to configure the returned function wpeaks
             wavelet_widths = np.linspace(peak_width_bounds[0], peak_width_bounds[1], peak_width_step)
 
@@ -66,6 +70,26 @@ class GuessMethods(object):
                 peak_indices = find_peaks_cwt(np.abs(vector), wavelet_widths, **kwargs)
                 return peak_indices
 
+            def wpeaks_batch(data_mat):
+                """
+                Batched counterpart of wpeaks that finds the peaks in every row of a 2D chunk of data at once.
+
+                Parameters
+                ----------
+                data_mat : 2D numpy array
+                    Feature vectors arranged as [vector, bins]
+
+                Returns
+                -------
+                peak_offsets : 1D numpy array
+                    Peaks of row i are located in peak_inds[peak_offsets[i]:peak_offsets[i+1]]
+                peak_inds : 1D numpy array
+                    Indices of peaks of all rows concatenated together
+                """
+                return find_peaks_cwt_batch(np.abs(data_mat), wavelet_widths, **kwargs)
+
+            wpeaks.batch = wpeaks_batch
+
             return wpeaks
         except KeyError:
             warn('Error: Please specify "peak_widths" kwarg to use this method')
@@ -120,12 +144,9 @@ class GuessMethods(object):
             num_points = kwargs.pop('num_points', 5)
 
             def sho_guess(resp_vec):
+                # The R^2 for the guesses is computed for the whole chunk at once by the model
 
-                guess = SHOestimateGuess(w_vec, resp_vec, num_points)
-
-                guess = np.hstack([guess, np.array(r_square(resp_vec, SHOfunc, guess, w_vec))])
-
-                return guess
+                return SHOestimateGuess(w_vec, resp_vec, num_points)
 
             return sho_guess
         except KeyError:
@@ -154,9 +175,229 @@ def r_square(data_vec, func, *args, **kwargs):
         The R^2 value for the current data_vec and parameters
     """
     data_mean = np.mean(data_vec)
-    ss_tot = sum(abs(data_vec - data_mean) ** 2)
-    ss_res = sum(abs(data_vec - func(*args, **kwargs)) ** 2)
+    ss_tot = np.sum(np.abs(data_vec - data_mean) ** 2)
+    ss_res = np.sum(np.abs(data_vec - func(*args, **kwargs)) ** 2)
 
     r_squared = 1 - ss_res / ss_tot if ss_tot > 0 else 0
 
-    return r_squared
\ No newline at end of file
+    return r_squared
+
+
+def ricker_wavelet(points, width):
+    """
+    Ricker (Mexican hat) wavelet identical to the one used by scipy.signal.find_peaks_cwt()
+
+    Parameters
+    ----------
+    points : int or float
+        Number of points in the wavelet
+    width : float
+        Width parameter of the wavelet
+
+    Returns
+    -------
+    wavelet : 1D numpy array
+        The wavelet of length ceil(points)
+    """
+    amp = 2 / (np.sqrt(3 * width) * (np.pi ** 0.25))
+    x_sq = (np.arange(0, points) - (points - 1.0) / 2) ** 2
+    w_sq = width ** 2
+    return amp * (1 - x_sq / w_sq) * np.exp(-x_sq / (2 * w_sq))
+
+
+def cwt_batch(data_mat, widths, wavelet=None):
+    """
+    Continuous wavelet transform of every row of data_mat computed in one shot via the FFT.
+    The spectrum of each row is computed once and multiplied with the spectra of the entire wavelet bank.
+    Results are identical to those of scipy.signal.cwt() applied to each row.
+
+    Parameters
+    ----------
+    data_mat : 2D real numpy array
+        Data arranged as [vector, bins]
+    widths : 1D array-like
+        Widths of the wavelets
+    wavelet : callable, optional
+        Function that takes the number of points and the width and returns the wavelet. Default - ricker_wavelet
+
+    Returns
+    -------
+    cwt_mat : 3D numpy array
+        CWT coefficients arranged as [vector, width, bins]
+    """
+    if wavelet is None:
+        wavelet = ricker_wavelet
+    data_mat = np.atleast_2d(data_mat)
+    num_bins = data_mat.shape[1]
+
+    # Flipped wavelets of varying lengths, placed such that the 'same' portion of all convolutions start together
+    kernels = [np.conj(wavelet(np.min([10 * width, num_bins]), width)[::-1]) for width in widths]
+    max_len = max([len(kern) for kern in kernels])
+    half_len = (max_len - 1) // 2
+    bank = np.zeros(shape=(len(kernels), max_len + 1), dtype=np.result_type(*kernels))
+    for ind, kern in enumerate(kernels):
+        start = half_len - (len(kern) - 1) // 2
+        bank[ind, start:start + len(kern)] = kern
+
+    fft_len = next_fast_len(num_bins + bank.shape[1])
+    if np.iscomplexobj(data_mat) or np.iscomplexobj(bank):
+        spectra = np.fft.fft(data_mat, fft_len, axis=1)[:, None, :] * np.fft.fft(bank, fft_len, axis=1)[None, :, :]
+        cwt_mat = np.fft.ifft(spectra, fft_len, axis=2)
+    else:
+        spectra = np.fft.rfft(data_mat, fft_len, axis=1)[:, None, :] * np.fft.rfft(bank, fft_len, axis=1)[None, :, :]
+        cwt_mat = np.fft.irfft(spectra, fft_len, axis=2)
+
+    return cwt_mat[:, :, half_len:half_len + num_bins]
+
+
+def find_peaks_cwt_batch(data_mat, widths, wavelet=None, max_distances=None, gap_thresh=None, min_length=None,
+                         min_snr=1, noise_perc=10, window_size=None):
+    """
+    Vectorized version of scipy.signal.find_peaks_cwt() that finds the peaks in all rows of data_mat at once.
+    The CWT of the entire chunk is computed via cwt_batch() and the ridge lines are traced one width at a time
+    for all rows and bins simultaneously.
+
+    Parameters
+    ----------
+    data_mat : 2D real numpy array
+        Data arranged as [vector, bins]
+    widths : 1D array-like
+        Widths of the wavelets
+    wavelet : callable, optional
+        Function that takes the number of points and the width and returns the wavelet. Default - ricker_wavelet
+    max_distances : 1D array-like, optional
+        A ridge line is extended to the relative maximum at width n only if it is within max_distances[n] of the
+        ridge at width n+1. Default - widths / 4
+    gap_thresh : float, optional
+        A ridge line is terminated after more than gap_thresh widths without a relative maximum. Default - widths[0]
+    min_length : int, optional
+        Minimum number of widths that a ridge line needs to span. Default - a fourth of the number of widths
+    min_snr : float, optional
+        Minimum signal to noise ratio. Default - 1
+    noise_perc : float, optional
+        Percentile of the CWT coefficients at the smallest width that is considered as the noise floor. Default - 10
+    window_size : int, optional
+        Size of the window over which the noise floor is computed. Default - a twentieth of the number of bins
+
+    Returns
+    -------
+    peak_offsets : 1D numpy array of unsigned ints
+        Peaks of row i are located in peak_inds[peak_offsets[i]:peak_offsets[i+1]]
+    peak_inds : 1D numpy array of unsigned ints
+        Sorted indices of the peaks within each row, concatenated over all rows
+    """
+    data_mat = np.atleast_2d(data_mat)
+    widths = np.atleast_1d(np.asarray(widths))
+    if gap_thresh is None:
+        gap_thresh = np.ceil(widths[0])
+    if max_distances is None:
+        max_distances = widths / 4.0
+    if min_length is None:
+        min_length = np.ceil(len(widths) / 4.0)
+    num_rows, num_bins = data_mat.shape
+    if window_size is None:
+        window_size = np.ceil(num_bins / 20.0)
+
+    cwt_mat = cwt_batch(data_mat, widths, wavelet=wavelet)
+
+    # relative maxima along the bins (the edges can never be maxima):
+    rel_max = np.zeros(cwt_mat.shape, dtype=np.bool_)
+    rel_max[:, :, 1:-1] = np.logical_and(cwt_mat[:, :, 1:-1] > cwt_mat[:, :, :-2],
+                                         cwt_mat[:, :, 1:-1] > cwt_mat[:, :, 2:])
+
+    # Ridge lines are tracked by the bin at which they currently end:
+    bin_inds = np.arange(num_bins)
+    row_inds = np.repeat(np.arange(num_rows), num_bins).reshape(num_rows, num_bins)
+    active = np.zeros(shape=(num_rows, num_bins), dtype=np.bool_)
+    lengths = np.zeros(shape=(num_rows, num_bins), dtype=np.uint32)
+    gaps = np.zeros(shape=(num_rows, num_bins), dtype=np.uint32)
+    last_width = np.zeros(shape=(num_rows, num_bins), dtype=np.uint32)
+    first_width = np.zeros(shape=(num_rows, num_bins), dtype=np.uint32)
+    # Terminated ridges that pass the length criterion. The SNR is checked at the end
+    peak_mask = np.zeros(shape=(num_rows, num_bins), dtype=np.bool_)
+    peak_width = np.zeros(shape=(num_rows, num_bins), dtype=np.uint32)
+
+    def terminate(ridges):
+        good = np.logical_and(ridges, lengths >= min_length)
+        peak_mask[good] = True
+        peak_width[good] = last_width[good]
+
+    for width_ind in range(len(widths) - 1, -1, -1):
+        this_max = rel_max[:, width_ind]
+        gaps[active] += 1
+
+        # Closest active ridge to the left and right of each bin
+        left = np.maximum.accumulate(np.where(active, bin_inds, -num_bins), axis=1)
+        right = np.minimum.accumulate(np.where(active, bin_inds, 2 * num_bins)[:, ::-1], axis=1)[:, ::-1]
+        # Ties go to the older ridge, just as in scipy
+        left_dist = bin_inds - left
+        right_dist = right - bin_inds
+        prefer_right = np.logical_or(right_dist < left_dist,
+                                     np.logical_and(right_dist == left_dist,
+                                                    first_width[row_inds, np.clip(right, 0, num_bins - 1)] >
+                                                    first_width[row_inds, np.clip(left, 0, num_bins - 1)]))
+        closest = np.where(prefer_right, right, left)
+        linked = np.logical_and(this_max, np.abs(closest - bin_inds) <= max_distances[width_ind])
+        source = np.clip(closest, 0, num_bins - 1)
+
+        # Several maxima may link to the same ridge. The ridge then grows by that many points and continues from
+        # the last of these maxima. Since the closest ridge is non-decreasing along the bins, such maxima are adjacent
+        link_rows, link_bins = np.nonzero(linked)
+        link_src = source[link_rows, link_bins]
+        link_keys = link_rows * num_bins + link_src
+        is_last = np.ones(link_keys.size, dtype=np.bool_)
+        is_last[:-1] = link_keys[1:] != link_keys[:-1]
+        run_ends = np.nonzero(is_last)[0]
+        run_counts = np.diff(np.append(-1, run_ends))
+        link_rows, link_bins, link_src = link_rows[run_ends], link_bins[run_ends], link_src[run_ends]
+
+        old_first = first_width
+        extended = np.zeros_like(active)
+        extended[link_rows, link_src] = True
+        new_max = np.logical_and(this_max, np.logical_not(linked))
+        new_lengths = np.ones(shape=(num_rows, num_bins), dtype=np.uint32)
+        new_lengths[link_rows, link_bins] = lengths[link_rows, link_src] + run_counts
+        new_max[link_rows, link_bins] = True
+
+        # Ridges that were not extended retain their position but may have to be terminated
+        waiting = np.logical_and(active, np.logical_not(extended))
+        dead = np.logical_and(waiting, gaps > gap_thresh)
+        terminate(dead)
+        waiting = np.logical_and(waiting, np.logical_not(dead))
+
+        lengths = np.where(new_max, new_lengths, np.where(waiting, lengths, 0))
+        gaps = np.where(new_max, 0, gaps)
+        last_width = np.where(new_max, width_ind, last_width)
+        first_width = np.where(new_max, width_ind, first_width)
+        first_width[link_rows, link_bins] = old_first[link_rows, link_src]
+        active = np.logical_or(new_max, waiting)
+
+    terminate(active)
+
+    peak_rows, peak_inds = np.nonzero(peak_mask)
+
+    # Noise floor from the coefficients at the smallest width within a window around each candidate peak:
+    half_window, odd = divmod(int(window_size), 2)
+    win_starts = np.clip(peak_inds - half_window, 0, num_bins)
+    win_ends = np.clip(peak_inds + half_window + odd, 0, num_bins)
+    win_inds = win_starts[:, None] + np.arange(2 * half_window + odd)[None, :]
+    windows = cwt_mat[peak_rows[:, None], 0, np.clip(win_inds, 0, num_bins - 1)]
+    windows[win_inds >= win_ends[:, None]] = np.inf
+    windows.sort(axis=1)
+    # linearly interpolated percentile of the valid (finite) portion of each window
+    frac_ind = (win_ends - win_starts - 1) * noise_perc / 100.0
+    low_ind = np.floor(frac_ind).astype(int)
+    high_ind = np.ceil(frac_ind).astype(int)
+    cand_inds = np.arange(peak_rows.size)
+    noises = windows[cand_inds, low_ind] + (frac_ind - low_ind) * (windows[cand_inds, high_ind] -
+                                                                   windows[cand_inds, low_ind])
+
+    snr = np.abs(cwt_mat[peak_rows, peak_width[peak_rows, peak_inds], peak_inds] / noises)
+    keep = snr >= min_snr
+    peak_rows = peak_rows[keep]
+    peak_inds = peak_inds[keep]
+
+    peak_offsets = np.zeros(num_rows + 1, dtype=np.uint32)
+    peak_offsets[1:] = np.cumsum(np.bincount(peak_rows, minlength=num_rows))
+
+    return peak_offsets, peak_inds.astype(np.uint32)
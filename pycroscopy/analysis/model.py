@@ -9,7 +9,8 @@ import numpy as np
 import psutil
 import scipy
 from .guess_methods import GuessMethods
-from ..io.hdf_utils import checkIfMain, getAuxData
+from ..io.hdf_catalog import updateCatalog
+from ..io.hdf_utils import checkIfMain, getAuxData, calcParmsHash, findIdenticalResult, markModified
 from ..io.io_hdf5 import ioHDF5
 # try:
 #     import multiprocess as mp
@@ -62,6 +63,7 @@ class Model(object):
         self.__end_pos = self.h5_main.shape[0]
         self.h5_guess = None
         self.h5_fit = None
+        self._guess_parms_hash = None
 
         self.data = None
         self.guess = None
@@ -187,11 +189,60 @@ class Model(object):
         """print('Writing data to positions: {} to {}'.format(self.__start_pos, self.__end_pos))
         targ_dset[self.__start_pos:self.__end_pos, :] = source_dset"""
         targ_dset[:, :] = source_dset
+        markModified(targ_dset)
 
         # flush the file
         self.hdf.flush()
         print('Finished writing to file!')
 
+    def _findExistingGuess(self, parms, force=False):
+        """
+        Looks for a guess that was already computed for this dataset with the same parameters.
+        If one is found, it will be used instead of computing the guess again.
+
+        Parameters
+        ----------
+        parms : dict
+            Parameters of the guess such as the strategy and its options
+        force : Boolean (Optional. Default = False)
+            Whether or not to ignore existing guesses
+
+        Returns
+        -------
+        found : Boolean
+            Whether or not an existing guess is being reused
+        """
+        self._guess_parms_hash = calcParmsHash(self.h5_main, self.__class__.__name__ + '-Guess', parms)
+        if force:
+            return False
+        h5_grp = findIdenticalResult(self.h5_main, None, self._guess_parms_hash, hash_attr='guess_parms_hash')
+        if h5_grp is None or 'Guess' not in h5_grp:
+            return False
+        print('Returning existing guess in {}. Use force=True to recompute'.format(h5_grp.name))
+        self._reuseGuessDataset(h5_grp['Guess'])
+        return True
+
+    def _reuseGuessDataset(self, h5_guess):
+        """
+        Model specific call that sets up this object to continue from an existing guess dataset instead of one
+        created by _createGuessDatasets
+
+        Parameters
+        ----------
+        h5_guess : h5py.Dataset object
+            Existing guess dataset
+        """
+        self.h5_guess = h5_guess
+
+    def _recordGuessParms(self):
+        """
+        Records the hash of the guess parameters in the group containing the guess so that it can be reused
+        """
+        if self.h5_guess is None or self._guess_parms_hash is None:
+            return
+        self.h5_guess.parent.attrs['guess_parms_hash'] = self._guess_parms_hash
+        updateCatalog(self.h5_guess.parent)
+
     def _createGuessDatasets(self):
         """
         Model specific call that will write the h5 group, guess dataset, corresponding spectroscopic datasets and also
@@ -234,7 +285,8 @@ class Model(object):
         self.fit = None # replace with actual h5 dataset
         pass
 
-    def computeGuess(self, strategy='wavelet_peaks', options={"peak_widths": np.array([10,200])}, **kwargs):
+    def computeGuess(self, strategy='wavelet_peaks', options={"peak_widths": np.array([10,200])}, force=False,
+                     **kwargs):
         """
 
         Parameters
@@ -246,6 +298,9 @@ class Model(object):
         options: dict
             Default {"peaks_widths": np.array([10,200])}}.
             Dictionary of options passed to strategy. For more info see GuessMethods documentation.
+        force: Boolean
+            Default False. Whether or not to compute the guess even if a guess with the same strategy and options
+            already exists for this dataset.
 
         kwargs:
             processors: int
@@ -256,6 +311,9 @@ class Model(object):
 
         """
 
+        if self._findExistingGuess({'strategy': strategy, 'options': options}, force=force):
+            return
+
         self._createGuessDatasets()
         self.__start_pos = 0
 
@@ -264,7 +322,15 @@ class Model(object):
         if strategy in gm.methods:
             func = gm.__getattribute__(strategy)(**options)
             results = list()
-            if self._parallel:
+            if hasattr(func, 'batch'):
+                # The strategy can process an entire chunk of data at once
+                print('Computing Guesses In batches ...')
+                self._getDataChunk()
+                while self.data is not None:  # as long as we have not reached the end of this data set:
+                    results.append(self._reformatResults(func.batch(self.data), strategy))
+                    # read the next chunk
+                    self._getDataChunk()
+            elif self._parallel:
                 # start pool of workers
                 print('Computing Guesses In parallel ... launching %i kernels...' % processors)
                 pool = mp.Pool(processors)
@@ -300,6 +366,7 @@ class Model(object):
 
             # Write to file
             self._setResults(is_guess=True)
+            self._recordGuessParms()
         else:
             warn('Error: %s is not implemented in pycroscopy.analysis.GuessMethods to find guesses' % strategy)
 
@@ -445,8 +512,8 @@ class Model(object):
             The R^2 value for the current data_vec and parameters
         """
         data_mean = np.mean(data_vec)
-        ss_tot = sum(abs(data_vec - data_mean) ** 2)
-        ss_res = sum(abs(data_vec - func(*args, **kwargs)) ** 2)
+        ss_tot = np.sum(np.abs(data_vec - data_mean) ** 2)
+        ss_res = np.sum(np.abs(data_vec - func(*args, **kwargs)) ** 2)
 
         r_squared = 1 - ss_res / ss_tot if ss_tot > 0 else 0
 
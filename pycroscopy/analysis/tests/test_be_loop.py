@@ -0,0 +1,94 @@
+from unittest import TestCase
+
+import numpy as np
+
+from pycroscopy.analysis.utils import be_loop
+
+
+def _soft_l1_cost(resid):
+    return np.sum(2 * (np.sqrt(1 + resid ** 2) - 1), axis=-1)
+
+
+class TestBatchedLoopFitting(TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(1)
+        num_loops = 20
+        vdc = np.hstack([np.linspace(-5, 5, 32), np.linspace(5, -5, 32)])
+        self.vdc_shifted = np.roll(vdc, -16)
+        self.coef_mat = np.array([0.1, 2.0, -1.5, 1.5, 0.01, 1.0, 1.2, 0.9, 1.1]) + \
+            0.05 * rand.randn(num_loops, 9)
+        self.pr_mat = be_loop.loopFitFunctionBatch(self.vdc_shifted, self.coef_mat) + \
+            0.05 * rand.randn(num_loops, self.vdc_shifted.size)
+        self.guess_mat = self.coef_mat + 0.2 * rand.randn(*self.coef_mat.shape)
+
+    def test_function(self):
+        resp_mat = be_loop.loopFitFunctionBatch(self.vdc_shifted, self.coef_mat)
+        for coef_vec, resp_vec in zip(self.coef_mat, resp_mat):
+            self.assertTrue(np.allclose(resp_vec, be_loop.loopFitFunction(self.vdc_shifted, coef_vec)))
+
+    def test_jacobian(self):
+        jac_mat = be_loop.loopFitJacobianBatch(self.vdc_shifted, self.coef_mat)
+        for coef_vec, jac in zip(self.coef_mat, jac_mat):
+            self.assertTrue(np.allclose(jac, be_loop.loopFitJacobian(self.vdc_shifted, coef_vec)))
+
+    def test_fit_from_per_loop_solution(self):
+        # Starting at the solution of fitLoop(), the batch can only polish it further
+        per_loop = [be_loop.fitLoop(self.vdc_shifted, pr_vec, guess) for pr_vec, guess in
+                    zip(self.pr_mat, self.guess_mat)]
+        start_mat = np.array([plsq.x for plsq, _, _ in per_loop])
+        coef_mat, criteria_mat, fit_mat = be_loop.fitLoopBatch(self.vdc_shifted, self.pr_mat, start_mat)
+        for (plsq, criteria_exp, fit_exp), pr_vec, fit_vec, criteria in zip(per_loop, self.pr_mat, fit_mat,
+                                                                            criteria_mat):
+            self.assertLessEqual(_soft_l1_cost(pr_vec - fit_vec), _soft_l1_cost(pr_vec - fit_exp))
+            self.assertTrue(np.allclose(fit_vec, fit_exp, atol=0.01))
+            self.assertTrue(np.allclose(criteria, criteria_exp, rtol=0.01))
+
+    def test_fit_quality_matches_per_loop_fit(self):
+        coef_mat, criteria_mat, fit_mat = be_loop.fitLoopBatch(self.vdc_shifted, self.pr_mat, self.guess_mat)
+        per_loop = [be_loop.fitLoop(self.vdc_shifted, pr_vec, guess) for pr_vec, guess in
+                    zip(self.pr_mat, self.guess_mat)]
+        fit_exp = np.array([fit_vec for _, _, fit_vec in per_loop])
+        criteria_exp = np.array([criteria for _, criteria, _ in per_loop])
+
+        # the line fit does not depend on the solver
+        self.assertTrue(np.allclose(criteria_mat[:, 2:], criteria_exp[:, 2:]))
+
+        # The model is piecewise in V, so both solvers only find local minima and these need not be the same ones.
+        # Even least_squares(method='dogbox') ends up ~10% above the default method on average for these loops
+        cost = _soft_l1_cost(self.pr_mat - fit_mat)
+        cost_exp = _soft_l1_cost(self.pr_mat - fit_exp)
+        guess_cost = _soft_l1_cost(self.pr_mat - be_loop.loopFitFunctionBatch(self.vdc_shifted, self.guess_mat))
+        self.assertTrue(np.all(cost < guess_cost))
+        self.assertLess(np.mean(cost), 1.1 * np.mean(cost_exp))
+        self.assertTrue(np.all(cost < 1.5 * cost_exp))
+
+        # Both recover the noise-free loops equally well
+        clean_mat = be_loop.loopFitFunctionBatch(self.vdc_shifted, self.coef_mat)
+        self.assertLess(np.std(fit_mat - clean_mat), 1.05 * np.std(fit_exp - clean_mat))
+
+
+class TestBatchedLoopProjection(TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(2)
+        num_loops = 40
+        self.vdc = np.hstack([np.linspace(-5, 5, 32), np.linspace(5, -5, 32)])
+        pr_vec = np.hstack([np.tanh(self.vdc[:32] - 1), np.tanh(self.vdc[32:] + 1)])
+        pr_mat = rand.uniform(0.5, 2, (num_loops, 1)) * pr_vec + 0.05 * rand.randn(num_loops, self.vdc.size)
+        # loops rotated away from the real axis and offset in the complex plane
+        theta = rand.uniform(0, np.pi, (num_loops, 1))
+        offsets = rand.uniform(-0.5, 0.5, (num_loops, 2))
+        x_mat = pr_mat * np.cos(theta) + offsets[:, 0:1]
+        y_mat = pr_mat * np.sin(theta) + offsets[:, 1:2]
+        self.amp_mat = np.hypot(x_mat, y_mat)
+        self.phase_mat = np.arctan2(y_mat, x_mat)
+
+    def test_projection_matches_per_loop(self):
+        results = be_loop.projectLoopBatch(self.vdc, self.amp_mat, self.phase_mat)
+        for ind, (amp_vec, phase_vec) in enumerate(zip(self.amp_mat, self.phase_mat)):
+            expected = be_loop.projectLoop(self.vdc, amp_vec, phase_vec)
+            self.assertTrue(np.allclose(results['Projected Loop'][ind], expected['Projected Loop'], atol=1E-6))
+            self.assertTrue(np.allclose(results['Rotation Matrix'][ind], expected['Rotation Matrix'], atol=1E-6))
+            self.assertTrue(np.allclose(results['Centroid'][ind], expected['Centroid'], atol=1E-6))
+            self.assertTrue(np.allclose(results['Geometric Area'][ind], expected['Geometric Area'], atol=1E-6))
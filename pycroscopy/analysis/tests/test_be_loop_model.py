@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import h5py
+import numpy as np
+
+from pycroscopy.analysis.be_loop_model import BELoopmodel, projectLoops, crit32, loop_fit32, loop_metrics32
+from pycroscopy.analysis.be_sho_model import sho32
+from pycroscopy.analysis.utils.be_loop import loopFitFunctionBatch
+from pycroscopy.io.hdf_utils import getH5DsetRefs, linkRefs
+from pycroscopy.io.io_hdf5 import ioHDF5
+from pycroscopy.io.microdata import MicroDataGroup, MicroDataset
+
+
+def _writeSHOFitDataset(h5_file, num_pos=4, num_dc=32, num_cycles=2):
+    """
+    Writes a SHO fit dataset whose amplitude and phase trace hysteretic loops at each position and cycle
+    """
+    rand = np.random.RandomState(0)
+    vdc_vec = -5 * np.cos(np.linspace(0, 2 * np.pi, num_dc, endpoint=False))
+    spec_inds = np.vstack([np.tile(np.arange(num_dc), num_cycles),
+                           np.repeat(np.arange(num_cycles), num_dc)]).astype(np.uint32)
+    spec_vals = np.vstack([vdc_vec[spec_inds[0]], spec_inds[1]]).astype(np.float32)
+    spec_labels = {'DC_Offset': (slice(0, 1), slice(None)), 'Cycle': (slice(1, 2), slice(None))}
+
+    # hysteretic loops with a coercive voltage of 1 V
+    rising = np.gradient(vdc_vec) > 0
+    pr_vec = np.where(rising, np.tanh(vdc_vec - 1), np.tanh(vdc_vec + 1))
+    pr_mat = np.tile(pr_vec, (num_pos, num_cycles)) * rand.uniform(0.5, 1.5, (num_pos, 1))
+    sho_mat = np.zeros(shape=pr_mat.shape, dtype=sho32)
+    sho_mat['Amplitude [V]'] = 1E-3 * np.abs(pr_mat)
+    sho_mat['Frequency [Hz]'] = 325E+3
+    sho_mat['Quality Factor'] = 100
+    sho_mat['Phase [rad]'] = np.where(pr_mat > 0, 0, np.pi)
+    sho_mat['R2 Criterion'] = 1
+
+    ds_pos_inds = MicroDataset('Position_Indices', np.arange(num_pos, dtype=np.uint32)[:, np.newaxis])
+    ds_pos_vals = MicroDataset('Position_Values', np.arange(num_pos, dtype=np.float32)[:, np.newaxis])
+    for dset in [ds_pos_inds, ds_pos_vals]:
+        dset.attrs['labels'] = {'X': (slice(None), slice(0, 1))}
+        dset.attrs['units'] = ['']
+    ds_spec_inds = MicroDataset('Spectroscopic_Indices', spec_inds)
+    ds_spec_vals = MicroDataset('Spectroscopic_Values', spec_vals)
+    for dset in [ds_spec_inds, ds_spec_vals]:
+        dset.attrs['labels'] = spec_labels
+        dset.attrs['units'] = ['V', '']
+    ds_fit = MicroDataset('Fit', sho_mat, chunking=(1, sho_mat.shape[1]))
+
+    sho_grp = MicroDataGroup('Raw_Data-SHO_Fit_000')
+    sho_grp.addChildren([ds_spec_inds, ds_spec_vals, ds_fit])
+    chan_grp = MicroDataGroup('Channel_000')
+    chan_grp.addChildren([ds_pos_inds, ds_pos_vals, sho_grp])
+    meas_grp = MicroDataGroup('Measurement_000')
+    meas_grp.addChildren([chan_grp])
+    root_grp = MicroDataGroup('')
+    root_grp.addChildren([meas_grp])
+
+    h5_refs = ioHDF5(h5_file).writeData(root_grp)
+    h5_fit = getH5DsetRefs(['Fit'], h5_refs)[0]
+    linkRefs(h5_fit, getH5DsetRefs(['Position_Indices', 'Position_Values', 'Spectroscopic_Indices',
+                                    'Spectroscopic_Values'], h5_refs))
+    return h5_fit
+
+
+class TestLoopRoundTrip(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.h5_file = h5py.File(os.path.join(self.tmp_dir, 'sho.h5'), mode='w')
+        self.h5_sho_fit = _writeSHOFitDataset(self.h5_file)
+
+    def tearDown(self):
+        self.h5_file.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def assertLinked(self, h5_dset, aux_name, h5_aux):
+        self.assertIsInstance(h5_dset.attrs[aux_name], h5py.Reference)
+        self.assertEqual(self.h5_file[h5_dset.attrs[aux_name]], h5_aux)
+
+    def test_project_guess_and_fit(self):
+        h5_pos_inds = self.h5_file[self.h5_sho_fit.attrs['Position_Indices']]
+        h5_spec_inds = self.h5_file[self.h5_sho_fit.attrs['Spectroscopic_Indices']]
+        num_pos, num_loops = self.h5_sho_fit.shape[0], 2
+
+        h5_projected_loops, h5_loop_metrics = projectLoops(self.h5_sho_fit)
+        self.assertEqual(h5_projected_loops.shape, self.h5_sho_fit.shape)
+        self.assertEqual(h5_loop_metrics.shape, (num_pos, num_loops))
+        self.assertEqual(h5_loop_metrics.dtype, loop_metrics32)
+        self.assertLinked(h5_projected_loops, 'Position_Indices', h5_pos_inds)
+        self.assertLinked(h5_projected_loops, 'Spectroscopic_Indices', h5_spec_inds)
+        self.assertLinked(h5_projected_loops, 'Loop_Metrics', h5_loop_metrics)
+        self.assertLinked(h5_loop_metrics, 'Position_Indices', h5_pos_inds)
+        h5_metrics_inds = self.h5_file[h5_loop_metrics.attrs['Spectroscopic_Indices']]
+        self.assertEqual(h5_metrics_inds.shape, (1, num_loops))
+
+        model = BELoopmodel(h5_projected_loops)
+        h5_guess = model.computeGuess()
+        h5_fit = model.computeFit()
+        for h5_dset, dtype in zip([h5_guess, h5_fit, model.h5_criteria], [loop_fit32, loop_fit32, crit32]):
+            self.assertEqual(h5_dset.shape, (num_pos, num_loops))
+            self.assertEqual(h5_dset.dtype, dtype)
+            self.assertLinked(h5_dset, 'Position_Indices', h5_pos_inds)
+            self.assertLinked(h5_dset, 'Spectroscopic_Indices', h5_metrics_inds)
+        self.assertEqual(h5_fit.parent, h5_guess.parent)
+        self.assertEqual(model.h5_fitted_loops.shape, h5_projected_loops.shape)
+        self.assertLinked(model.h5_fitted_loops, 'Position_Indices', h5_pos_inds)
+
+        # the fit can only improve on the guess
+        guess_vec = h5_guess[()].ravel()
+        guess_mat = np.vstack([guess_vec[name] for name in loop_fit32.names]).T
+        num_steps = h5_projected_loops.shape[1] // num_loops
+        guess_loops = np.roll(loopFitFunctionBatch(model._getDCVector(), guess_mat), num_steps // 4, axis=1)
+        proj_mat = np.reshape(h5_projected_loops[()], (-1, num_steps))
+        fit_mat = np.reshape(model.h5_fitted_loops[()], (-1, num_steps))
+        self.assertTrue(np.all(np.isfinite(fit_mat)))
+        self.assertLess(np.linalg.norm(fit_mat - proj_mat), np.linalg.norm(guess_loops - proj_mat))
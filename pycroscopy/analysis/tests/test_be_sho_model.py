@@ -0,0 +1,101 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import h5py
+import numpy as np
+
+from pycroscopy.analysis.be_sho_model import BESHOmodel
+from pycroscopy.analysis.utils.be_sho import SHOfuncBatch
+from pycroscopy.analysis.utils.fit_quality import calc_fit_criteria, fit_crit32
+from pycroscopy.io.be_hdf_utils import reshapeToOneStep
+from pycroscopy.io.hdf_utils import getH5DsetRefs, linkRefs
+from pycroscopy.io.io_hdf5 import ioHDF5
+from pycroscopy.io.microdata import MicroDataGroup, MicroDataset
+
+
+def _writeBEPSDataset(h5_file, num_pos=6, num_bins=16, num_dc=32, num_cycles=2):
+    """
+    Writes BEPS-like raw data: one SHO response per position, DC offset and cycle
+    """
+    rand = np.random.RandomState(0)
+    freq_vec = np.linspace(300E+3, 350E+3, num_bins)
+    vdc_vec = 5 * np.sin(np.linspace(0, 2 * np.pi, num_dc, endpoint=False))
+    spec_inds = np.vstack([np.tile(np.arange(num_bins), num_dc * num_cycles),
+                           np.tile(np.repeat(np.arange(num_dc), num_bins), num_cycles),
+                           np.repeat(np.arange(num_cycles), num_bins * num_dc)]).astype(np.uint32)
+    spec_vals = np.vstack([freq_vec[spec_inds[0]], vdc_vec[spec_inds[1]], spec_inds[2]]).astype(np.float32)
+    spec_labels = {'Frequency': (slice(0, 1), slice(None)), 'DC_Offset': (slice(1, 2), slice(None)),
+                   'Cycle': (slice(2, 3), slice(None))}
+
+    # hysteretic loops with a coercive voltage of 1 V
+    rising = np.gradient(vdc_vec) > 0
+    pr_vec = np.where(rising, np.tanh(vdc_vec - 1), np.tanh(vdc_vec + 1))
+    pr_mat = np.tile(pr_vec, (num_pos, num_cycles)) * rand.uniform(0.5, 1.5, (num_pos, 1))
+    parm_mat = np.vstack([1E-3 * np.abs(pr_mat).ravel(), np.full(pr_mat.size, 325E+3), np.full(pr_mat.size, 100),
+                          np.where(pr_mat.ravel() > 0, 0, np.pi)]).T
+    resp_mat = SHOfuncBatch(parm_mat, freq_vec) + 1E-6 * rand.randn(pr_mat.size, num_bins)
+
+    ds_pos_inds = MicroDataset('Position_Indices', np.arange(num_pos, dtype=np.uint32)[:, np.newaxis])
+    ds_pos_vals = MicroDataset('Position_Values', np.arange(num_pos, dtype=np.float32)[:, np.newaxis])
+    for dset in [ds_pos_inds, ds_pos_vals]:
+        dset.attrs['labels'] = {'X': (slice(None), slice(0, 1))}
+        dset.attrs['units'] = ['']
+    ds_spec_inds = MicroDataset('Spectroscopic_Indices', spec_inds)
+    ds_spec_vals = MicroDataset('Spectroscopic_Values', spec_vals)
+    for dset in [ds_spec_inds, ds_spec_vals]:
+        dset.attrs['labels'] = spec_labels
+        dset.attrs['units'] = ['Hz', 'V', '']
+    ds_main = MicroDataset('Raw_Data', np.complex64(resp_mat.reshape(num_pos, -1)))
+
+    chan_grp = MicroDataGroup('Channel_000')
+    chan_grp.addChildren([ds_pos_inds, ds_pos_vals, ds_spec_inds, ds_spec_vals, ds_main])
+    meas_grp = MicroDataGroup('Measurement_000')
+    meas_grp.addChildren([chan_grp])
+    root_grp = MicroDataGroup('')
+    root_grp.addChildren([meas_grp])
+
+    h5_refs = ioHDF5(h5_file).writeData(root_grp)
+    h5_main = getH5DsetRefs(['Raw_Data'], h5_refs)[0]
+    linkRefs(h5_main, getH5DsetRefs(['Position_Indices', 'Position_Values', 'Spectroscopic_Indices',
+                                     'Spectroscopic_Values'], h5_refs))
+    return h5_main
+
+
+class TestSHOFitCriteria(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.h5_file = h5py.File(os.path.join(self.tmp_dir, 'beps.h5'), mode='w')
+        self.h5_main = _writeBEPSDataset(self.h5_file)
+        self.num_bins = 16
+        self.freq_vec = np.linspace(300E+3, 350E+3, self.num_bins)
+
+    def tearDown(self):
+        self.h5_file.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def _assertCriteriaMatch(self, h5_sho, h5_criteria):
+        self.assertEqual(h5_criteria.shape, h5_sho.shape)
+        self.assertEqual(h5_criteria.dtype, fit_crit32)
+
+        num_steps = h5_sho.shape[1]
+        sho_vec = reshapeToOneStep(h5_sho[()], num_steps).ravel()
+        parm_mat = np.vstack([sho_vec[name] for name in sho_vec.dtype.names[:4]]).T
+        data_mat = reshapeToOneStep(self.h5_main[()], num_steps)
+        expected = calc_fit_criteria(data_mat, SHOfuncBatch(parm_mat, self.freq_vec), 4)
+        criteria = reshapeToOneStep(h5_criteria[()], num_steps).ravel()
+        # the stored parameters are rounded to float32, which shows in residuals at the noise floor
+        for name in fit_crit32.names:
+            self.assertTrue(np.allclose(criteria[name], expected[name], rtol=0.05))
+        self.assertTrue(np.allclose(sho_vec['R2 Criterion'], criteria['R2 Criterion']))
+
+    def test_guess_and_fit_criteria(self):
+        model = BESHOmodel(self.h5_main)
+        model.computeGuess(strategy='complex_gaussian', options={}, processors=1)
+        self._assertCriteriaMatch(model.h5_guess, model.h5_guess_criteria)
+
+        model.computeFit(processors=1)
+        self._assertCriteriaMatch(model.h5_fit, model.h5_fit_criteria)
+        self.assertEqual(model.h5_fit_criteria.parent, model.h5_guess_criteria.parent)
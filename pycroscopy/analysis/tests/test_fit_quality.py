@@ -0,0 +1,54 @@
+from unittest import TestCase
+
+import numpy as np
+from scipy import stats
+
+from pycroscopy.analysis.guess_methods import r_square
+from pycroscopy.analysis.utils.be_sho import SHOfunc, SHOfuncBatch
+from pycroscopy.analysis.utils.fit_quality import r_square_batch, information_criteria, evaluate_fit_quality
+
+
+class TestBatchedFitQuality(TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        num_rows = 30
+        self.w_vec = np.linspace(300E+3, 350E+3, 87)
+        self.parm_mat = np.vstack([rand.uniform(1E-4, 1E-3, num_rows), rand.uniform(310E+3, 340E+3, num_rows),
+                                   rand.uniform(50, 300, num_rows), rand.uniform(-np.pi, np.pi, num_rows)]).T
+        resp_mat = SHOfuncBatch(self.parm_mat, self.w_vec)
+        self.data_mat = resp_mat + 5E-5 * (rand.randn(*resp_mat.shape) + 1j * rand.randn(*resp_mat.shape))
+
+    def test_sho_function(self):
+        resp_mat = SHOfuncBatch(self.parm_mat, self.w_vec)
+        for parms, resp_vec in zip(self.parm_mat, resp_mat):
+            self.assertTrue(np.allclose(resp_vec, SHOfunc(parms, self.w_vec)))
+
+    def test_r_square_matches_per_pixel(self):
+        r2_vec = r_square_batch(self.data_mat, SHOfuncBatch(self.parm_mat, self.w_vec))
+        for data_vec, parms, r2 in zip(self.data_mat, self.parm_mat, r2_vec):
+            self.assertAlmostEqual(r2, r_square(data_vec, SHOfunc, parms, self.w_vec))
+
+    def test_r_square_without_variance(self):
+        data_mat = np.ones((2, 10))
+        self.assertTrue(np.all(r_square_batch(data_mat, np.zeros((2, 10))) == 0))
+
+    def test_information_criteria_match_per_pixel(self):
+        data_mat = np.real(self.data_mat)
+        fit_mat = np.real(SHOfuncBatch(self.parm_mat, self.w_vec))
+        aic_vec, bic_vec = information_criteria(data_mat, fit_mat, 4)
+        num_obs = data_mat.shape[1]
+        for data_vec, fit_vec, aic, bic in zip(data_mat, fit_mat, aic_vec, bic_vec):
+            # same as in be_loop.fitLoop()
+            log_lik = np.sum(stats.norm.logpdf(data_vec, loc=fit_vec, scale=np.std(data_vec - fit_vec)))
+            self.assertTrue(np.isclose(aic, 2.0 * 4 - 2.0 * log_lik))
+            self.assertTrue(np.isclose(bic, -2.0 * log_lik + 4 * np.log(num_obs)))
+
+    def test_evaluate_fit_quality(self):
+        criteria = evaluate_fit_quality(self.data_mat, SHOfuncBatch, self.parm_mat, self.w_vec)
+        fit_mat = SHOfuncBatch(self.parm_mat, self.w_vec)
+        self.assertTrue(np.allclose(criteria['R2 Criterion'], r_square_batch(self.data_mat, fit_mat)))
+        self.assertTrue(np.allclose(criteria['Residual Norm'], np.linalg.norm(self.data_mat - fit_mat, axis=1)))
+        aic_vec, bic_vec = information_criteria(self.data_mat, fit_mat, 4)
+        self.assertTrue(np.allclose(criteria['AIC'], aic_vec))
+        self.assertTrue(np.allclose(criteria['BIC'], bic_vec))
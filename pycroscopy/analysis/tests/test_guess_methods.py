@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+import numpy as np
+from scipy.signal import find_peaks_cwt
+
+from pycroscopy.analysis.guess_methods import GuessMethods, cwt_batch, find_peaks_cwt_batch, ricker_wavelet
+from pycroscopy.analysis.utils.be_sho import SHOfuncBatch
+
+
+class TestBatchedPeakFinding(TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        num_rows = 40
+        self.w_vec = np.linspace(300E+3, 350E+3, 87)
+        parm_mat = np.vstack([rand.uniform(1E-4, 1E-3, num_rows), rand.uniform(310E+3, 340E+3, num_rows),
+                              rand.uniform(50, 300, num_rows), rand.uniform(-np.pi, np.pi, num_rows)]).T
+        resp_mat = SHOfuncBatch(parm_mat, self.w_vec)
+        self.data_mat = np.abs(resp_mat + 5E-5 * (rand.randn(*resp_mat.shape) + 1j * rand.randn(*resp_mat.shape)))
+        self.widths = np.linspace(2, 20, 10)
+
+    def test_cwt_matches_convolution(self):
+        cwt_mat = cwt_batch(self.data_mat, self.widths)
+        num_bins = self.data_mat.shape[1]
+        for row, data_vec in enumerate(self.data_mat):
+            for ind, width in enumerate(self.widths):
+                wavelet = ricker_wavelet(min(10 * width, num_bins), width)
+                expected = np.convolve(data_vec, wavelet[::-1], mode='same')
+                self.assertTrue(np.allclose(cwt_mat[row, ind], expected))
+
+    def test_peaks_match_scipy(self):
+        peak_offsets, peak_inds = find_peaks_cwt_batch(self.data_mat, self.widths)
+        self.assertEqual(len(peak_offsets), self.data_mat.shape[0] + 1)
+        for row, data_vec in enumerate(self.data_mat):
+            expected = np.sort(find_peaks_cwt(data_vec, self.widths))
+            self.assertEqual(list(peak_inds[peak_offsets[row]:peak_offsets[row + 1]]), list(expected))
+
+    def test_wavelet_peaks_batch(self):
+        wpeaks = GuessMethods().wavelet_peaks(peak_widths=[2, 20], peak_step=10)
+        peak_offsets, peak_inds = wpeaks.batch(self.data_mat)
+        for row, data_vec in enumerate(self.data_mat):
+            self.assertEqual(list(peak_inds[peak_offsets[row]:peak_offsets[row + 1]]),
+                             list(np.sort(wpeaks(data_vec))))
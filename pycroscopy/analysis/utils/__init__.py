@@ -1,5 +1,6 @@
 from . import be_loop
 from . import be_sho
 from . import tree
+from . import fit_quality
 
-__all__ = ['be_sho', 'be_loop', 'tree']
+__all__ = ['be_sho', 'be_loop', 'tree', 'fit_quality']
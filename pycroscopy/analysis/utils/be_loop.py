@@ -14,9 +14,10 @@ import numpy as np
 from scipy import stats
 from scipy.optimize import least_squares
 from scipy.optimize import leastsq
-from scipy.spatial import ConvexHull
 from scipy.special import erf, erfinv
 
+from .fit_quality import information_criteria
+
 
 ###############################################################################
 
@@ -40,25 +41,47 @@ def calcCentroid(Vdc,loop_vals):
         geometric area
     """
     
-    x_vals = np.zeros(len(Vdc)-1)
-    y_vals = np.zeros(len(Vdc)-1)
-    area_vals = np.zeros(len(Vdc)-1)
-    
-    for index in range(0,len(Vdc)-1):
-        x_i = Vdc[index]
-        x_i1 = Vdc[index+1]
-        y_i = loop_vals[index]
-        y_i1 = loop_vals[index+1]
-        
-        x_vals[index] = (x_i + x_i1)*(x_i*y_i1 - x_i1*y_i)
-        y_vals[index] = (y_i + y_i1)*(x_i*y_i1 - x_i1*y_i)
-        area_vals[index] = (x_i*y_i1 - x_i1*y_i)
-    
-    area = 0.50 * np.sum(area_vals)
-    Cx = (1.0/(6.0*area)) * np.sum(x_vals)
-    Cy = (1.0/(6.0*area)) * np.sum(y_vals)
-    
-    return ((Cx,Cy), area)
+    cent, area = calcCentroidBatch(Vdc, loop_vals)
+
+    return ((cent[0, 0], cent[0, 1]), area[0])
+
+
+###############################################################################
+
+def calcCentroidBatch(Vdc, loop_mat):
+    """
+    Calculates the centroids of several loops at once. Uses polyogonal centroid,
+    see wiki article for details.
+
+    Parameters
+    -----------
+    Vdc : 1D list or numpy array
+        DC voltage steps
+    loop_mat : 2D numpy array
+        unfolded loops arranged as [loop, voltage]
+
+    Returns
+    -----------
+    cent : 2D numpy array
+        (x,y) coordinates of the centroids arranged as [loop, coordinate]
+    area : 1D numpy array
+        geometric area of each loop
+    """
+    Vdc = np.asarray(Vdc).ravel()
+    loop_mat = np.atleast_2d(loop_mat)
+
+    x_i = Vdc[:-1]
+    x_i1 = Vdc[1:]
+    y_i = loop_mat[:, :-1]
+    y_i1 = loop_mat[:, 1:]
+    cross = x_i * y_i1 - x_i1 * y_i
+
+    area = 0.50 * np.sum(cross, axis=1)
+    cent = np.zeros(shape=(loop_mat.shape[0], 2), dtype=np.float64)
+    cent[:, 0] = np.sum((x_i + x_i1) * cross, axis=1) / (6.0 * area)
+    cent[:, 1] = np.sum((y_i + y_i1) * cross, axis=1) / (6.0 * area)
+
+    return cent, area
 
 
 ###############################################################################
@@ -221,7 +244,97 @@ def projectLoop(Vdc, amp_vec, phase_vec):
                'Centroid': centroid, 'Geometric Area': geo_area}  # Dictionary of Results from projecting
 
     return results
-    
+
+
+###############################################################################
+
+def projectLoopBatch(Vdc, amp_mat, phase_mat):
+    """
+    This function projects several loop cycles at once using the amplitude and phase matrices.
+    Unlike projectLoop(), the plane is fit in closed form from the singular value decomposition of the
+    centered (Vdc, Acosphi, Asinphi) point cloud of each loop instead of an iterative least squares fit.
+
+    Parameters
+    ------------
+    Vdc : 1D list or numpy array
+        DC voltages. vector of length N
+    amp_mat : 2D numpy array
+        amplitude of response arranged as [loop, voltage]
+    phase_mat : 2D numpy array
+        phase of response arranged as [loop, voltage]
+
+    Returns
+    ----------
+    results : dictionary
+        Results from projecting the provided matrices with following components
+
+        'Projected Loop' : 2D numpy array
+            projected loops arranged as [loop, voltage]
+        'Rotation Matrix' : 2D numpy array
+            rotation angle [rad] for the projecting, as well as the offset value arranged as [loop, 2]
+        'Centroid' : 2D numpy array
+            (x,y) positions of centroids for each projected loop arranged as [loop, 2]
+        'Geometric Area' : 1D numpy array
+            geometric area of each loop
+    """
+    Vdc = np.asarray(Vdc, dtype=np.float64).ravel()
+    amp_mat = np.atleast_2d(amp_mat)
+    phase_mat = np.atleast_2d(phase_mat)
+    loop_inds = np.arange(amp_mat.shape[0])
+    v_min = np.min(Vdc)
+
+    Acosphi = amp_mat * np.cos(phase_mat)
+    Asinphi = amp_mat * np.sin(phase_mat)
+
+    # Fit to a plane - Ax + By + Cz + D = 0
+    # The normal of the plane is the right singular vector with the smallest singular value
+    XYZ = np.stack((np.broadcast_to(Vdc, Acosphi.shape), Acosphi, Asinphi), axis=2)  # [loop, point, axis]
+    XYZ_mean = np.mean(XYZ, axis=1)
+    normals = np.linalg.svd(XYZ - XYZ_mean[:, np.newaxis, :], full_matrices=False)[2][:, -1, :]
+    A = normals[:, 0]
+    B = normals[:, 1]
+    C = normals[:, 2]
+    D = -1 * np.sum(normals * XYZ_mean, axis=1)
+
+    # Projection of the plane onto the Acosphi / Asinphi plane at the lowest voltage is the straight line:
+    # zproj = -(B/C) * yproj + (A * min(Vdc) - D) / C, with yproj spanning the range of Acosphi + A * min(Vdc) / B
+    slopes = -B / C
+    intercepts = (A * v_min - D) / C
+    y_proj_min = np.min(Acosphi, axis=1) + A * v_min / B
+    y_proj_max = np.max(Acosphi, axis=1) + A * v_min / B
+
+    # Number of points in the linear fit. This will make the offset more accurate, but 100 is reasonable.
+    num_pt_fit = 100
+
+    # Find the point on the line closest to the origin
+    xdat_fit = y_proj_min[:, np.newaxis] + np.outer(y_proj_max - y_proj_min, np.linspace(0, 1, num_pt_fit))
+    ydat_fit = slopes[:, np.newaxis] * xdat_fit + intercepts[:, np.newaxis]
+    min_point_ind = np.argmin(xdat_fit ** 2 + ydat_fit ** 2, axis=1)
+    x_min_pt = xdat_fit[loop_inds, min_point_ind]
+    y_min_pt = ydat_fit[loop_inds, min_point_ind]
+    offset_dist = np.sqrt(x_min_pt ** 2 + y_min_pt ** 2)
+    rot_angle = np.tan(slopes)
+
+    # Now adjust the loop by first subtracting offset and then do the rotation.
+    # taking only the first row of the rotation, since this is all that was being used.
+    pr_mat = np.cos(rot_angle)[:, np.newaxis] * (Acosphi - x_min_pt[:, np.newaxis]) - \
+        np.sin(rot_angle)[:, np.newaxis] * (Asinphi - y_min_pt[:, np.newaxis])
+
+    # Centroid calculation also gives geometric area. If the area is positive then the loop rotates the correct way.
+    # If the area is negative it rotates the 'wrong' way. Rotating by the other angle (pi + rot_angle) simply
+    # negates the projected loop, its area and the y coordinate of its centroid.
+    centroids, geo_areas = calcCentroidBatch(Vdc, pr_mat)
+    flip = np.logical_not(geo_areas > 0)
+    pr_mat[flip] *= -1
+    centroids[flip, 1] *= -1
+    geo_areas[flip] *= -1
+    rot_angle[flip] += np.pi
+
+    results = {'Projected Loop': pr_mat, 'Rotation Matrix': np.vstack((rot_angle, offset_dist)).T,
+               'Centroid': centroids, 'Geometric Area': geo_areas}  # Dictionary of Results from projecting
+
+    return results
+
 ###############################################################################
 
 def loopFitFunction(V,coef_vec):
@@ -245,8 +358,8 @@ def loopFitFunction(V,coef_vec):
     b = coef_vec[5:]
     d = 1000
     
-    V1 = V[:(len(V)/2)]
-    V2 = V[(len(V)/2):]
+    V1 = V[:(len(V)//2)]
+    V2 = V[(len(V)//2):]
     
     g1 = (b[1]-b[0])/2*(erf((V1-a[2])*d)+1)+b[0]
     g2 = (b[3]-b[2])/2*(erf((V2-a[3])*d)+1)+b[2]
@@ -262,111 +375,132 @@ def loopFitFunction(V,coef_vec):
 
 ###############################################################################
 
-def loopFitJacobian(V, coef_vec):
+def loopFitFunctionBatch(V, coef_mat):
     """
-    Jacobian of 9 parameter fit function
+    9 parameter fit function evaluated for several loops at once
 
     Parameters
     -----------
     V : 1D numpy array or list
         DC voltages
-    coef_vec : 1D numpy array or list
-        9 parameter coefficient vector
+    coef_mat : 2D numpy array
+        9 parameter coefficient vectors arranged as [loop, coefficient]
 
     Returns
     ---------
     F : 2D numpy array
-        function values
+        function values arranged as [loop, voltage]
     """
-
-    a = coef_vec[:5]
-    b = coef_vec[5:]
+    V = np.asarray(V).ravel()
+    coef_mat = np.atleast_2d(coef_mat)
+    a = [coef_mat[:, [ind]] for ind in range(5)]
+    b = [coef_mat[:, [ind]] for ind in range(5, 9)]
     d = 1000
 
-    J = np.zeros([len(V),9], dtype=np.float32)
-
-    V1 = V[:(len(V) / 2)]
-    V2 = V[(len(V) / 2):]
+    V1 = V[:len(V) // 2]
+    V2 = V[len(V) // 2:]
 
     g1 = (b[1] - b[0]) / 2 * (erf((V1 - a[2]) * d) + 1) + b[0]
     g2 = (b[3] - b[2]) / 2 * (erf((V2 - a[3]) * d) + 1) + b[2]
 
-# Some useful fractions
-    oosqpi = 1.0/np.sqrt(np.pi)
-    oob01 = 1.0 / (b[0] + b[1])
-    oob23 = 1.0 / (b[2] + b[3])
+    Y1 = (g1 * erf((V1 - a[2]) / g1) + b[0]) / (b[0] + b[1])
+    Y2 = (g2 * erf((V2 - a[3]) / g2) + b[2]) / (b[2] + b[3])
 
-# Derivatives of g1 and g2
-    dg1a2 = -(b[1] - b[0]) / oosqpi * d * np.exp(-(V1 - a[2]) ** 2)
-    dg2a3 = -(b[3] - b[2]) / oosqpi * d * np.exp(-(V2 - a[3]) ** 2)
-    dg1b0 = -0.5 * (erf(V1 - a[2]) * d + 1)
-    dg1b1 = -dg1b0
-    dg2b2 = -0.5 * (erf(V2 - a[3]) * d + 1)
-    dg2b3 = -dg2b2
+    F1 = a[0] + a[1] * Y1 + a[4] * V1
+    F2 = a[0] + a[1] * Y2 + a[4] * V2
 
-    Y1 = oob01 * (g1 * erf((V1-a[2])/g1) + b[0])
-    Y2 = oob23 * (g2 * erf((V2-a[3])/g2) + b[2])
+    return np.hstack((F1, F2))
 
-# Derivatives of Y1 and Y2
-    dY1g1 = oob01 * (erf((V1 - a[2]) / g1) - 2 * oosqpi * np.exp(-(V1 - a[2])**2 / g1**2))
-    dY2g2 = oob23 * (erf((V2 - a[4]) / g2) - 2 * oosqpi * np.exp(-(V2 - a[4])**2 / g2**2))
+###############################################################################
+
+def loopFitJacobian(V, coef_vec):
+    """
+    Jacobian of 9 parameter fit function
 
-    dY1a2 = -2 * oosqpi * oob01 * np.exp(-(V1 - a[2])**2 / g1**2)
+    Parameters
+    -----------
+    V : 1D numpy array or list
+        DC voltages
+    coef_vec : 1D numpy array or list
+        9 parameter coefficient vector
 
-    dY2a3 = -2 * oosqpi * oob01 * np.exp(-(V2 - a[3])**2 / g2**2)
+    Returns
+    ---------
+    J : 2D numpy array
+        Jacobian arranged as [voltage, coefficient]
+    """
+    return loopFitJacobianBatch(V, np.atleast_2d(coef_vec))[0].astype(np.float32)
 
-    dY1b0 = oob01 * (1 - Y1)
-    dY1b1 = -oob01 * Y1
+###############################################################################
 
-    dY2b2 = oob23 * (1 - Y2)
-    dY2b3 = -oob23 * Y2
+def loopFitJacobianBatch(V, coef_mat):
+    """
+    Jacobian of 9 parameter fit function evaluated for several loops at once
 
-    '''
-    Jacobian terms
-    '''
-    zeroV = np.zeroes_like(V1)
-# Derivative with respect to a[0] is always 1
-    J[:, 0] = 1
-
-# Derivative with respect to a[1] is different for F1 and F2
-    J[:, 1] = np.hstack(Y1, Y2)
-
-# Derivative with respect to a[2] is zero for F2, but not F1
-    J21 = a[1] * (dY1g1 * dg1a2 + dY1a2)
-    J22 = zeroV
-    J[:, 2] = np.hstack(J21, J22)
-
-# Derivative with respect to a[3] is zero for F1, but not F2
-    J31 = zeroV
-    J32 = a[1] * (dY2g2 * dg2a3 + dY2a3)
-    J[:, 3] = np.hstack(J31, J32)
-
-# Derivative with respect to a[4] is V
-    J[:, 4] = V
-
-# Derivative with respect to b[0] is zero for F2, but not F1
-    J51 = a[1] * (dY1g1 * dg1b0 + dY1b0)
-    J52 = zeroV
-    J[:, 5] = np.hstack(J51, J52)
-
-# Derivative with respect to b[1] is zero for F2, but not F1
-    J61 = a[1] * (dY1g1 * dg1b1 + dY1b1)
-    J62 = zeroV
-    J[:, 6] = np.hstack(J61, J62)
-
-# Derivative with respect to b[2] is zero for F1, but not F2
-    J71 = zeroV
-    J72 = a[1] * (dY2g2 * dg2b2 + dY2b2)
-    J[:, 7] = np.hstack(J71, J72)
-
-# Derivative with respect to b[3] is zero for F1, but not F2
-    J81 = zeroV
-    J82 = a[1] * (dY2g2 * dg2b3 + dY2b3)
-    J[:, 8] = np.hstack(J81, J82)
+    Parameters
+    -----------
+    V : 1D numpy array or list
+        DC voltages
+    coef_mat : 2D numpy array
+        9 parameter coefficient vectors arranged as [loop, coefficient]
+
+    Returns
+    ---------
+    J : 3D numpy array
+        Jacobian arranged as [loop, voltage, coefficient]
+    """
+    V = np.asarray(V).ravel()
+    coef_mat = np.atleast_2d(coef_mat)
+    a = [coef_mat[:, [ind]] for ind in range(5)]
+    b = [coef_mat[:, [ind]] for ind in range(5, 9)]
+    d = 1000
+    half = len(V) // 2
+    oosqpi = 1.0 / np.sqrt(np.pi)
+
+    J = np.zeros(shape=(coef_mat.shape[0], len(V), 9), dtype=np.float64)
+
+    def branch_derivatives(V_b, a_sw, b_lo, b_hi):
+        """
+        Derivatives of Y = (g * erf((V - a_sw) / g) + b_lo) / (b_lo + b_hi) for one branch of the loop
+        """
+        step = erf((V_b - a_sw) * d)
+        g = (b_hi - b_lo) / 2 * (step + 1) + b_lo
+        u = (V_b - a_sw) / g
+        erf_u = erf(u)
+        gauss_u = 2 * oosqpi * np.exp(-u ** 2)
+        b_sum = b_lo + b_hi
+        Y = (g * erf_u + b_lo) / b_sum
+
+        # derivatives of g
+        dg_a = -(b_hi - b_lo) * d * oosqpi * np.exp(-((V_b - a_sw) * d) ** 2)
+        dg_blo = 0.5 * (1 - step)
+        dg_bhi = 0.5 * (1 + step)
+
+        # derivative of the numerator of Y with respect to g (at constant V - a_sw)
+        dnum_g = erf_u - u * gauss_u
+
+        dY_a = (dnum_g * dg_a - gauss_u) / b_sum
+        dY_blo = (dnum_g * dg_blo + 1) / b_sum - Y / b_sum
+        dY_bhi = dnum_g * dg_bhi / b_sum - Y / b_sum
+
+        return Y, dY_a, dY_blo, dY_bhi
+
+    Y1, dY1a2, dY1b0, dY1b1 = branch_derivatives(V[:half], a[2], b[0], b[1])
+    Y2, dY2a3, dY2b2, dY2b3 = branch_derivatives(V[half:], a[3], b[2], b[3])
+
+    J[:, :, 0] = 1
+    J[:, :half, 1] = Y1
+    J[:, half:, 1] = Y2
+    J[:, :half, 2] = a[1] * dY1a2
+    J[:, half:, 3] = a[1] * dY2a3
+    J[:, :, 4] = V
+    J[:, :half, 5] = a[1] * dY1b0
+    J[:, :half, 6] = a[1] * dY1b1
+    J[:, half:, 7] = a[1] * dY2b2
+    J[:, half:, 8] = a[1] * dY2b3
 
     return J
 
-    
 ###############################################################################
 
 
@@ -457,7 +591,7 @@ def generateGuess(Vdc, pr_vec, show_plots=False):
     pr_vec : 1D numpy array
         Piezoresponse or unfolded loop
     show_plots : Boolean (Optional. Default = False)
-        Whether or not the plot the convex hull, centroid, intersection points
+        Whether or not the plot the loop polygon, centroid, intersection points
 
     Returns
     -----------------
@@ -465,122 +599,120 @@ def generateGuess(Vdc, pr_vec, show_plots=False):
         Fit guess coefficient vector
     '''
 
-    points = np.transpose(np.array([np.squeeze(Vdc), pr_vec]))  # [points,axis]
-
-    geom_centroid, geom_area = calcCentroid(points[:, 0], points[:, 1])
-
-    hull = ConvexHull(points)
-
-    ''' Now we need to find the intersection points on the N,S,E,W
-    the simplex of the complex hull is essentially a set of line equations.
-    We need to find the two lines (top and bottom) or (left and right) that
-    interect with the vertical / horizontal lines passing through the geometric centroid'''
-
-    def findIntersection(A, B, C, D):
-        '''
-        Finds the coordinates where two line segments intersect
-
-        Parameters
-        ------------
-        A, B, C, D : Tuple or 1D list or 1D numpy array
-            (x,y) coordinates of the points that define the two line segments AB and CD
-
-        Returns
-        ----------
-        obj : None or tuple
-            None if not intersecting. (x,y) coordinates of intersection
-        '''
-
-        def ccw(A, B, C):
-            '''Credit - StackOverflow'''
-            return (C[1] - A[1]) * (B[0] - A[0]) > (B[1] - A[1]) * (C[0] - A[0])
-
-        def line(p1, p2):
-            '''Credit - StackOverflow'''
-            A = (p1[1] - p2[1])
-            B = (p2[0] - p1[0])
-            C = (p1[0] * p2[1] - p2[0] * p1[1])
-            return A, B, -C
-
-        def intersection(L1, L2):
-            '''
-            Finds the intersection of two lines (NOT line segments).
-            Credit - StackOverflow
-            '''
-            D = L1[0] * L2[1] - L1[1] * L2[0]
-            Dx = L1[2] * L2[1] - L1[1] * L2[2]
-            Dy = L1[0] * L2[2] - L1[2] * L2[0]
-            if D != 0:
-                x = Dx / D
-                y = Dy / D
-                return x, y
-            else:
-                return None
-
-        if (ccw(A, C, D) != ccw(B, C, D) and ccw(A, B, C) != ccw(A, B, D)) == False:
-            return None
-        else:
-            return intersection(line(A, B), line(C, D))
-
-    # start and end coordinates of each line segment defining the convex hull
-    outline_1 = np.zeros((hull.simplices.shape[0], 2), dtype=np.float)
-    outline_2 = np.zeros((hull.simplices.shape[0], 2), dtype=np.float)
-    for index, pair in enumerate(hull.simplices):
-        outline_1[index, :] = points[pair[0]]
-        outline_2[index, :] = points[pair[1]]
-
-    '''Find the coordinates of the points where the vertical line through the
-    centroid intersects with the convex hull'''
-    Y_intersections = []
-    for pair in xrange(outline_1.shape[0]):
-        x_pt = findIntersection(outline_1[pair], outline_2[pair],
-                                [geom_centroid[0], hull.min_bound[1]],
-                                [geom_centroid[0], hull.max_bound[1]])
-        if type(x_pt) != type(None):
-            Y_intersections.append(x_pt)
-
-    '''Find the coordinates of the points where the horizontal line through the
-    centroid intersects with the convex hull'''
-    X_intersections = []
-    for pair in xrange(outline_1.shape[0]):
-        x_pt = findIntersection(outline_1[pair], outline_2[pair],
-                                [hull.min_bound[0], geom_centroid[1]],
-                                [hull.max_bound[0], geom_centroid[1]])
-        if type(x_pt) != type(None):
-            X_intersections.append(x_pt)
-
-    min_Y_intercept = min(Y_intersections[0][1], Y_intersections[1][1])
-    max_Y_intercept = max(Y_intersections[0][1], Y_intersections[1][1])
-
-    # Only the first four parameters use the information from the intercepts
-    init_guess_coef_vec = np.zeros(shape=(9))
-    init_guess_coef_vec[0] = min_Y_intercept
-    init_guess_coef_vec[1] = max_Y_intercept - min_Y_intercept
-    init_guess_coef_vec[2] = max(X_intersections[0][0], X_intersections[1][0])
-    init_guess_coef_vec[3] = min(X_intersections[0][0], X_intersections[1][0])
-    init_guess_coef_vec[4] = 0
-    init_guess_coef_vec[5] = .5
-    init_guess_coef_vec[6] = .2
-    init_guess_coef_vec[7] = 1
-    init_guess_coef_vec[8] = .2
+    Vdc = np.squeeze(Vdc)
+    init_guess_coef_vec = generateGuessBatch(Vdc, pr_vec)[0]
 
     if show_plots:
+        geom_centroid = calcCentroid(Vdc, pr_vec)[0]
         fig, ax = plt.subplots()
-        ax.plot(points[:, 0], points[:, 1], 'o')
+        ax.plot(Vdc, pr_vec, 'o')
+        ax.plot(np.append(Vdc, Vdc[0]), np.append(pr_vec, pr_vec[0]), 'k')
         ax.plot(geom_centroid[0], geom_centroid[1], 'r*')
-        ax.plot([geom_centroid[0], geom_centroid[0]], [hull.max_bound[1], hull.min_bound[1]], 'g')
-        ax.plot([hull.min_bound[0], hull.max_bound[0]], [geom_centroid[1], geom_centroid[1]], 'g')
-        for simplex in hull.simplices:
-            ax.plot(points[simplex, 0], points[simplex, 1], 'k')
-        ax.plot(X_intersections[0][0], X_intersections[0][1], 'r*')
-        ax.plot(X_intersections[1][0], X_intersections[1][1], 'r*')
-        ax.plot(Y_intersections[0][0], Y_intersections[0][1], 'r*')
-        ax.plot(Y_intersections[1][0], Y_intersections[1][1], 'r*')
+        ax.plot([geom_centroid[0], geom_centroid[0]], [np.max(pr_vec), np.min(pr_vec)], 'g')
+        ax.plot([np.min(Vdc), np.max(Vdc)], [geom_centroid[1], geom_centroid[1]], 'g')
+        ax.plot([geom_centroid[0], geom_centroid[0]], [init_guess_coef_vec[0],
+                                                       init_guess_coef_vec[0] + init_guess_coef_vec[1]], 'r*')
+        ax.plot(init_guess_coef_vec[2:4], [geom_centroid[1], geom_centroid[1]], 'r*')
         ax.plot(Vdc, loopFitFunction(Vdc, init_guess_coef_vec))
 
     return init_guess_coef_vec
 
 
+###############################################################################
+
+def _hullIntercepts(x_mat, y_mat, level):
+    """
+    Lowest and highest points where the line x = level crosses the convex hull of each set of points.
+    The boundary of the hull at any x lies on a segment joining two of the points on either side of x, so the
+    extremes over all such pairs are the intercepts. This needs no hull to be built and works on all sets at once.
+
+    Parameters
+    -----------
+    x_mat : 2D numpy array
+        x coordinates of the points arranged as [set, point]. The first axis may be a singleton
+    y_mat : 2D numpy array
+        y coordinates of the points arranged as [set, point]. The first axis may be a singleton
+    level : 2D numpy array
+        x coordinate of the line for each set arranged as [set, 1]
+
+    Returns
+    -----------
+    min_intercept : 1D numpy array
+        Lowest y coordinate of the hull at x = level for each set. inf if the line misses the hull
+    max_intercept : 1D numpy array
+        Highest y coordinate of the hull at x = level for each set. -inf if the line misses the hull
+    """
+    x_mat, y_mat, level = np.broadcast_arrays(x_mat, y_mat, level)
+    # points lying on the line are intercepts themselves
+    on_line = x_mat == level
+    min_intercept = np.min(np.where(on_line, y_mat, np.inf), axis=1)
+    max_intercept = np.max(np.where(on_line, y_mat, -np.inf), axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for ind in range(x_mat.shape[1]):
+            x_i = x_mat[:, ind:ind + 1]
+            y_i = y_mat[:, ind:ind + 1]
+            # segments from a point left of the line to a point right of the line
+            spans = (x_i < level) & (x_mat > level)
+            y_cross = y_i + (level - x_i) * (y_mat - y_i) / (x_mat - x_i)
+            min_intercept = np.minimum(min_intercept, np.min(np.where(spans, y_cross, np.inf), axis=1))
+            max_intercept = np.maximum(max_intercept, np.max(np.where(spans, y_cross, -np.inf), axis=1))
+
+    return min_intercept, max_intercept
+
+
+###############################################################################
+
+def generateGuessBatch(Vdc, pr_mat):
+    """
+    Given several unfolded loops, returns the initial guesses for the fitting of all loops at once.
+    Like generateGuess(), the guesses come from the points where the vertical and horizontal lines through the
+    geometric centroid of each loop intersect with the convex hull of the loop. The intercepts are found from
+    all pairs of points on either side of the lines so no hull needs to be computed for each loop.
+
+    Parameters
+    -----------
+    Vdc : 1D numpy array
+        DC offsets
+    pr_mat : 2D numpy array
+        Piezoresponse or unfolded loops arranged as [loop, voltage]
+
+    Returns
+    -----------------
+    init_guess_mat : 2D Numpy array
+        Fit guess coefficients arranged as [loop, coefficient]
+    """
+    Vdc = np.asarray(Vdc, dtype=np.float64).ravel()
+    pr_mat = np.atleast_2d(pr_mat)
+
+    geom_centroids = calcCentroidBatch(Vdc, pr_mat)[0]
+
+    # Intercepts of the vertical line through the centroid with the hull
+    min_Y_intercept, max_Y_intercept = _hullIntercepts(Vdc[np.newaxis], pr_mat, geom_centroids[:, 0:1])
+    # Intercepts of the horizontal line through the centroid with the hull
+    min_X_intercept, max_X_intercept = _hullIntercepts(pr_mat, Vdc[np.newaxis], geom_centroids[:, 1:2])
+
+    # Loops that are never crossed (eg - degenerate loops with no area) fall back to their extents
+    min_Y_intercept = np.where(np.isfinite(min_Y_intercept), min_Y_intercept, np.min(pr_mat, axis=1))
+    max_Y_intercept = np.where(np.isfinite(max_Y_intercept), max_Y_intercept, np.max(pr_mat, axis=1))
+    min_X_intercept = np.where(np.isfinite(min_X_intercept), min_X_intercept, np.min(Vdc))
+    max_X_intercept = np.where(np.isfinite(max_X_intercept), max_X_intercept, np.max(Vdc))
+
+    # Only the first four parameters use the information from the intercepts
+    init_guess_mat = np.zeros(shape=(pr_mat.shape[0], 9))
+    init_guess_mat[:, 0] = min_Y_intercept
+    init_guess_mat[:, 1] = max_Y_intercept - min_Y_intercept
+    init_guess_mat[:, 2] = max_X_intercept
+    init_guess_mat[:, 3] = min_X_intercept
+    init_guess_mat[:, 4] = 0
+    init_guess_mat[:, 5] = .5
+    init_guess_mat[:, 6] = .2
+    init_guess_mat[:, 7] = 1
+    init_guess_mat[:, 8] = .2
+
+    return init_guess_mat
+
+
 ###############################################################################
 
 def fitLoop(Vdc_shifted, pr_shifted, guess):
@@ -655,4 +787,139 @@ def fitLoop(Vdc_shifted, pr_shifted, guess):
 
     criterion_values = (AIC_loop, BIC_loop, AIC_line, BIC_line)
 
-    return plsq, criterion_values, pr_fit_vec
\ No newline at end of file
+    return plsq, criterion_values, pr_fit_vec
+
+
+###############################################################################
+
+def calcLineCriteria(Vdc, pr_mat, df_line=1):
+    """
+    AIC and BIC of straight lines fit to several loops at once. The lines are fit in closed form rather than via
+    np.polyfit
+
+    Parameters
+    ----------
+    Vdc : 1D numpy array
+        DC voltage values
+    pr_mat : 2D numpy array
+        Loops arranged as [loop, voltage]
+    df_line : unsigned int (Optional. Default = 1)
+        Degrees of freedom of the line
+
+    Returns
+    -------
+    aic : 1D numpy array
+        AIC of the line fit for each loop
+    bic : 1D numpy array
+        BIC of the line fit for each loop
+    """
+    x_vec = np.asarray(Vdc).ravel()
+    x_cent = x_vec - np.mean(x_vec)
+    pr_mean = np.mean(pr_mat, axis=1, keepdims=True)
+    slopes = np.dot(pr_mat - pr_mean, x_cent) / np.sum(x_cent ** 2)
+    line_mat = pr_mean + slopes[:, None] * x_cent[None, :]
+
+    return information_criteria(pr_mat, line_mat, df_line)
+
+###############################################################################
+
+def fitLoopBatch(Vdc_shifted, pr_mat, guess_mat, max_iter=200, ftol=1E-8, xtol=1E-8):
+    """
+    Given several unfolded loops, returns the results of the least squares fitting for all loops at once.
+    This is a vectorized counterpart of fitLoop() that replaces one scipy.optimize.least_squares call per loop with
+    a Levenberg-Marquardt solver that is iterated for the whole batch. As in fitLoop(), the parameters are restricted
+    to the same bounds and the residuals are subjected to the soft-L1 loss (via iteratively reweighted least squares).
+    Since the loop function is piecewise in V, both solvers only find local minima. These fits are as good as those
+    from fitLoop() on average but individual loops may settle in a different minimum
+
+    Parameters
+    ----------
+    Vdc_shifted : 1D numpy array
+        DC voltage values shifted by one quarter, as this is requirement for the fit
+    pr_mat : 2D numpy array
+        unfolded loops shifted by one quarter arranged as [loop, voltage]
+    guess_mat : 2D numpy array
+        9 parameters for the fit guess arranged as [loop, coefficient]
+    max_iter : unsigned int (Optional. Default = 200)
+        Maximum number of iterations
+    ftol : float (Optional. Default = 1E-8)
+        Loops are considered converged once the relative change in the cost falls below this value
+    xtol : float (Optional. Default = 1E-8)
+        Loops are considered converged once the relative change in the parameters falls below this value
+
+    Returns
+    --------
+    coef_mat : 2D numpy array
+        Fit parameters arranged as [loop, coefficient]
+    criteria_mat : 2D numpy array
+        (AIC (loop fit), BIC(loop fit), AIC(line fit), BIC(line fit)) arranged as [loop, criterion]
+    pr_fit_mat : 2D numpy array
+        fit result values, ie. evaluation of f(V) arranged as [loop, voltage]
+    """
+    # Same bounds as fitLoop()
+    lb = np.array([-1E3, -1E3, -1E3, -1E3, -10, -100, -100, -100, -100])
+    ub = np.array([1E3, 1E3, 1E3, 1E3, 10, 100, 100, 100, 100])
+
+    xdata = np.asarray(Vdc_shifted).ravel()
+    pr_mat = np.atleast_2d(pr_mat).astype(np.float64)
+    coef_mat = np.clip(np.atleast_2d(guess_mat).astype(np.float64), lb, ub)
+
+    def soft_l1_cost(resid):
+        cost = np.sum(2 * (np.sqrt(1 + resid ** 2) - 1), axis=1)
+        cost[~np.isfinite(cost)] = np.inf
+        return cost
+
+    resid_mat = pr_mat - loopFitFunctionBatch(xdata, coef_mat)
+    cost_vec = soft_l1_cost(resid_mat)
+    damping = np.full(coef_mat.shape[0], 1E-3)
+    active = np.isfinite(cost_vec)
+    eye = np.eye(coef_mat.shape[1])
+
+    for _ in range(int(max_iter)):
+        inds = np.nonzero(active)[0]
+        if inds.size == 0:
+            break
+        coefs = coef_mat[inds]
+        resids = resid_mat[inds]
+
+        # Gauss-Newton system with weights from the soft-L1 loss. Jacobian of the residuals is -J
+        jac = loopFitJacobianBatch(xdata, coefs)
+        weights = 1.0 / np.sqrt(1 + resids ** 2)
+        jac_t_w = np.transpose(jac, (0, 2, 1)) * weights[:, None, :]
+        hess = np.matmul(jac_t_w, jac)
+        grad = np.einsum('ijk,ik->ij', jac_t_w, resids)
+        scale = np.maximum(np.diagonal(hess, axis1=1, axis2=2), 1E-12)
+        hess += damping[inds, None, None] * scale[:, None, :] * eye[None, :, :]
+        steps = np.linalg.solve(hess + 1E-12 * eye[None, :, :], grad[:, :, None])[:, :, 0]
+
+        trial = np.clip(coefs + steps, lb, ub)
+        trial_resids = pr_mat[inds] - loopFitFunctionBatch(xdata, trial)
+        trial_cost = soft_l1_cost(trial_resids)
+
+        improved = trial_cost < cost_vec[inds]
+        better = inds[improved]
+        cost_change = cost_vec[better] - trial_cost[improved]
+        step_size = np.linalg.norm(trial[improved] - coefs[improved], axis=1)
+        coef_mat[better] = trial[improved]
+        resid_mat[better] = trial_resids[improved]
+        converged = np.logical_or(cost_change <= ftol * trial_cost[improved],
+                                  step_size <= xtol * (xtol + np.linalg.norm(trial[improved], axis=1)))
+        cost_vec[better] = trial_cost[improved]
+
+        damping[better] /= 3
+        damping[inds[~improved]] *= 2
+        active[better[converged]] = False
+        active[damping > 1E10] = False
+
+    pr_fit_mat = loopFitFunctionBatch(xdata, coef_mat)
+
+    """Here we compare the values of the information criterion, for the whole loop fit and a simple linear fit
+    We use both the AIC and BIC creterion metrics to compare which is better
+    Lower values (even negative) are better than higher values)."""
+
+    df_loop = 8  # degrees of freedom, same as in fitLoop()
+    criteria_mat = np.zeros(shape=(pr_mat.shape[0], 4), dtype=np.float64)
+    criteria_mat[:, 0], criteria_mat[:, 1] = information_criteria(pr_mat, pr_fit_mat, df_loop)
+    criteria_mat[:, 2], criteria_mat[:, 3] = calcLineCriteria(xdata, pr_mat)
+
+    return coef_mat, criteria_mat, pr_fit_mat
@@ -23,6 +23,27 @@ def SHOfunc(parms, w_vec):
     return parms[0] * exp(1j * parms[3]) * parms[1] ** 2 / (w_vec ** 2 - 1j * w_vec * parms[1] / parms[2] - parms[1] ** 2)
 
 
+def SHOfuncBatch(parm_mat, w_vec):
+    """
+    Generates the SHO responses for several sets of parameters at once
+
+    Parameters
+    -----------
+    parm_mat : 2D numpy array
+        SHO parameters arranged as [position, (A,w0,Q,phi)]
+    w_vec : 1D numpy array
+        Vector of frequency values
+
+    Returns
+    -------
+    resp_mat : 2D complex numpy array
+        SHO responses arranged as [position, frequency]
+    """
+    parm_mat = np.atleast_2d(parm_mat)
+    amp, w_0, qual, phi = [parm_mat[:, [ind]] for ind in range(4)]
+    return amp * exp(1j * phi) * w_0 ** 2 / (w_vec ** 2 - 1j * w_vec * w_0 / qual - w_0 ** 2)
+
+
 def SHOestimateGuess(w_vec, resp_vec, num_points=5):
     """
     Generates good initial guesses for fitting
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized goodness-of-fit metrics that evaluate an entire chunk of guesses or fits in one shot
+"""
+
+from __future__ import division
+
+import numpy as np
+
+fit_crit32 = np.dtype([('R2 Criterion', np.float32),
+                       ('Residual Norm', np.float32),
+                       ('AIC', np.float32),
+                       ('BIC', np.float32)])
+
+
+def _as_real_observations(data_mat):
+    """
+    Complex valued data is treated as twice as many real valued observations
+
+    Parameters
+    ----------
+    data_mat : 2D real or complex numpy array
+        Data arranged as [position, spectroscopic]
+
+    Returns
+    -------
+    real_mat : 2D real numpy array
+        Real valued data arranged as [position, spectroscopic]
+    """
+    data_mat = np.atleast_2d(data_mat)
+    if np.iscomplexobj(data_mat):
+        return np.hstack([np.real(data_mat), np.imag(data_mat)])
+    return data_mat
+
+
+def r_square_batch(data_mat, fit_mat):
+    """
+    R-square for every row of the data. Vectorized equivalent of guess_methods.r_square()
+
+    Parameters
+    ----------
+    data_mat : 2D real or complex numpy array
+        Measured data arranged as [position, spectroscopic]
+    fit_mat : 2D real or complex numpy array
+        Model evaluated for each position, of the same shape as data_mat
+
+    Returns
+    -------
+    r_squared : 1D numpy array
+        R^2 value for each position. Set to 0 where the data has no variance
+    """
+    data_mat = np.atleast_2d(data_mat)
+    ss_tot = np.sum(np.abs(data_mat - np.mean(data_mat, axis=1, keepdims=True)) ** 2, axis=1)
+    ss_res = np.sum(np.abs(data_mat - np.atleast_2d(fit_mat)) ** 2, axis=1)
+
+    r_squared = np.zeros(ss_tot.shape, dtype=np.float64)
+    valid = ss_tot > 0
+    r_squared[valid] = 1 - ss_res[valid] / ss_tot[valid]
+
+    return r_squared
+
+
+def information_criteria(data_mat, fit_mat, num_params):
+    """
+    Akaike and Bayesian information criteria for every row of the data, assuming normally distributed residuals.
+    The log likelihood is computed in closed form rather than through scipy.stats.norm.logpdf()
+
+    Parameters
+    ----------
+    data_mat : 2D real or complex numpy array
+        Measured data arranged as [position, spectroscopic]
+    fit_mat : 2D real or complex numpy array
+        Model evaluated for each position, of the same shape as data_mat
+    num_params : unsigned int
+        Number of degrees of freedom in the model
+
+    Returns
+    -------
+    aic : 1D numpy array
+        AIC for each position
+    bic : 1D numpy array
+        BIC for each position
+    """
+    resid_mat = _as_real_observations(data_mat) - _as_real_observations(fit_mat)
+    num_obs = resid_mat.shape[1]
+    variance = np.var(resid_mat, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_lik = -0.5 * num_obs * np.log(2 * np.pi * variance) - np.sum(resid_mat ** 2, axis=1) / (2 * variance)
+    aic = 2.0 * num_params - 2.0 * log_lik
+    bic = -2.0 * log_lik + num_params * np.log(num_obs)
+
+    return aic, bic
+
+
+def calc_fit_criteria(data_mat, fit_mat, num_params):
+    """
+    R^2, norm of the residuals, AIC and BIC for every row of the data in one shot
+
+    Parameters
+    ----------
+    data_mat : 2D real or complex numpy array
+        Measured data arranged as [position, spectroscopic]
+    fit_mat : 2D real or complex numpy array
+        Model evaluated for each position, of the same shape as data_mat
+    num_params : unsigned int
+        Number of degrees of freedom in the model
+
+    Returns
+    -------
+    criteria : 1D numpy array of compound datatype fit_crit32
+        Goodness of fit metrics for each position
+    """
+    data_mat = np.atleast_2d(data_mat)
+    fit_mat = np.atleast_2d(fit_mat)
+
+    criteria = np.zeros(shape=data_mat.shape[0], dtype=fit_crit32)
+    criteria['R2 Criterion'] = r_square_batch(data_mat, fit_mat)
+    criteria['Residual Norm'] = np.linalg.norm(_as_real_observations(data_mat) - _as_real_observations(fit_mat),
+                                               axis=1)
+    criteria['AIC'], criteria['BIC'] = information_criteria(data_mat, fit_mat, num_params)
+
+    return criteria
+
+
+def evaluate_fit_quality(data_mat, func, parm_mat, *args, **kwargs):
+    """
+    Evaluates the model for all positions at once and computes the goodness of fit metrics
+
+    Parameters
+    ----------
+    data_mat : 2D real or complex numpy array
+        Measured data arranged as [position, spectroscopic]
+    func : callable function
+        Batched model such as be_sho.SHOfuncBatch that takes the parameters arranged as [position, parameter]
+        followed by args and kwargs and returns an array of the same shape as data_mat
+    parm_mat : 2D numpy array
+        Model parameters arranged as [position, parameter]
+    args :
+        Parameters to be passed to func after parm_mat
+    kwargs :
+        Keyword parameters to be passed to func
+
+    Returns
+    -------
+    criteria : 1D numpy array of compound datatype fit_crit32
+        Goodness of fit metrics for each position
+    """
+    parm_mat = np.atleast_2d(parm_mat)
+    return calc_fit_criteria(data_mat, func(parm_mat, *args, **kwargs), parm_mat.shape[1])
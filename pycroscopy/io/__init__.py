@@ -1,4 +1,5 @@
 from . import hdf_utils
+from . import hdf_catalog
 from . import be_hdf_utils
 from . import io_hdf5
 from .io_hdf5 import ioHDF5
@@ -6,9 +7,12 @@ from . import io_utils
 from .io_utils import *
 from . import microdata
 from .microdata import MicroDataset, MicroDataGroup
+from . import nd_view
+from .nd_view import NDView
 from . import translators
 from .translators import *
 from . import dm4reader
 
-__all__ = ['ioHDF5', 'MicroDataset', 'MicroDataGroup', 'be_hdf_utils', 'hdf_utils', 'io_utils', 'microdata']
+__all__ = ['ioHDF5', 'MicroDataset', 'MicroDataGroup', 'be_hdf_utils', 'hdf_utils', 'hdf_catalog', 'io_utils',
+           'microdata', 'nd_view', 'NDView']
 __all__+= translators.__all__
\ No newline at end of file
@@ -6,7 +6,7 @@ Created on Tue Dec 15 11:10:37 2015
 """
 import numpy as np
 
-from .hdf_utils import getAuxData
+from .hdf_utils import getAuxData, readCachedAuxData
 
 __all__ = [
     'maxReadPixels', 'getActiveUDVSsteps', 'getDataIndicesForUDVSstep', 'getForExcitWfm',
@@ -60,7 +60,7 @@ def getActiveUDVSsteps(h5_raw):
     steps : 1D numpy array
         Active UDVS steps
     """
-    udvs_step_vec = getAuxData(h5_raw, auxDataName =['UDVS_Indices'])[0].value
+    udvs_step_vec = readCachedAuxData(h5_raw, 'UDVS_Indices')
     return np.unique(udvs_step_vec)
     
 def getSliceForExcWfm(h5_bin_wfm, excit_wfm):
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory catalog of the contents of an HDF5 file so that lookups do not need to walk the file
+"""
+
+from __future__ import print_function
+
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+import h5py
+
+__all__ = ['HDFCatalog', 'getCatalog', 'updateCatalog']
+
+# Catalogs of the open files, keyed by file number
+_catalogs = dict()
+
+_main_attrs = ['Position_Indices', 'Position_Values', 'Spectroscopic_Indices', 'Spectroscopic_Values']
+
+
+def _parseIndexedName(name):
+    """
+    Splits names such as 'Raw_Data-SVD_002' into their components
+
+    Parameters
+    ----------
+    name : str
+        Name (not path) of the object
+
+    Returns
+    -------
+    prefix : str or None
+        Name without the index, eg - 'Raw_Data-SVD_'. None if the name does not end in an index
+    index : int or None
+        Index of the object, eg - 2
+    source : str or None
+        Name of the dataset the tool was applied to, eg - 'Raw_Data'
+    tool : str or None
+        Name of the tool, eg - 'SVD'
+    """
+    base, _, suffix = name.rpartition('_')
+    if not base or not suffix.isdigit():
+        return None, None, None, None
+    source, _, tool = base.rpartition('-')
+    if not source:
+        return base + '_', int(suffix), None, None
+    return base + '_', int(suffix), source, tool
+
+
+class HDFCatalog(object):
+    """
+    Names, types, shapes, datatypes and attribute names of every object in an HDF5 file, built with a single pass
+    over the file and updated incrementally by ioHDF5.writeData and the reference linking functions.
+
+    Objects can be found by the end of their name, by the tool that created them or by their attributes without
+    visiting the file. Files modified by other means should be refreshed via refresh().
+    """
+
+    def __init__(self, h5_file):
+        """
+        Parameters
+        ----------
+        h5_file : h5py.File object
+            Open HDF5 file
+        """
+        self.file = h5_file.file
+        self.refresh()
+
+    def refresh(self):
+        """
+        Rebuilds the catalog from the contents of the file
+        """
+        self.entries = dict()
+        self.__children = defaultdict(set)
+        self.__reversed_paths = []
+        self.__by_attr = defaultdict(set)
+        self.__by_tool = defaultdict(set)
+        self.__max_index = dict()
+
+        self.add(self.file)
+        self.file.visititems(lambda name, obj: self.add(obj))
+
+    @property
+    def is_valid(self):
+        """
+        Whether or not the file that was cataloged is still open
+        """
+        return bool(self.file.id.valid)
+
+    def add(self, h5_obj):
+        """
+        Adds or updates the record of an object
+
+        Parameters
+        ----------
+        h5_obj : h5py.Dataset, h5py.Group or h5py.File object
+            Object to be recorded
+        """
+        path = h5_obj.name
+        if path in self.entries:
+            self.remove(path)
+
+        attr_names = list(h5_obj.attrs.keys())
+        record = {'name': path.split('/')[-1], 'parent': path.rsplit('/', 1)[0] or '/', 'attrs': set(attr_names)}
+        if isinstance(h5_obj, h5py.Dataset):
+            record.update({'type': 'Dataset', 'shape': h5_obj.shape, 'dtype': h5_obj.dtype})
+            record['is_main'] = len(h5_obj.shape) == 2 and \
+                all([name in record['attrs'] and isinstance(h5_obj.attrs[name], h5py.Reference)
+                     for name in _main_attrs])
+        else:
+            record.update({'type': 'Group', 'shape': None, 'dtype': None, 'is_main': False})
+
+        prefix, index, source, tool = _parseIndexedName(record['name'])
+        record.update({'index': index, 'source': source, 'tool': tool})
+
+        self.entries[path] = record
+        if path == '/':
+            return
+
+        self.__children[record['parent']].add(record['name'])
+        insort(self.__reversed_paths, path[::-1])
+        for name in attr_names:
+            self.__by_attr[name].add(path)
+        if tool is not None:
+            self.__by_tool[tool].add(path)
+        if prefix is not None:
+            key = (record['parent'], prefix)
+            self.__max_index[key] = max(index, self.__max_index.get(key, -1))
+
+    def remove(self, path):
+        """
+        Removes the record of an object
+
+        Parameters
+        ----------
+        path : str
+            Absolute path of the object within the file
+        """
+        record = self.entries.pop(path, None)
+        if record is None or path == '/':
+            return
+        self.__children[record['parent']].discard(record['name'])
+        rev_path = path[::-1]
+        ind = bisect_left(self.__reversed_paths, rev_path)
+        if ind < len(self.__reversed_paths) and self.__reversed_paths[ind] == rev_path:
+            del self.__reversed_paths[ind]
+        for name in record['attrs']:
+            self.__by_attr[name].discard(path)
+        if record['tool'] is not None:
+            self.__by_tool[record['tool']].discard(path)
+        # The highest index of its siblings is deliberately kept so that indices are never reused
+
+    def __get_objects(self, paths):
+        """
+        Returns the objects at the provided paths, forgetting any that no longer exist
+        """
+        objects = []
+        for path in sorted(paths):
+            try:
+                objects.append(self.file[path])
+            except KeyError:
+                self.remove(path)
+        return objects
+
+    def children(self, parent):
+        """
+        Names of the objects directly under a group
+
+        Parameters
+        ----------
+        parent : str
+            Absolute path of the group
+
+        Returns
+        -------
+        names : list of str
+            Names of the children, sorted
+        """
+        return sorted(self.__children.get(parent, set()))
+
+    def findBySuffix(self, suffix, obj_type='Dataset', under='/'):
+        """
+        Objects whose absolute path ends with the provided string
+
+        Parameters
+        ----------
+        suffix : str
+            End of the path. Eg - 'Raw_Data'
+        obj_type : str or None (Optional. Default = 'Dataset')
+            'Dataset', 'Group' or None for any type
+        under : str (Optional. Default = '/')
+            Only objects under this group are returned
+
+        Returns
+        -------
+        objects : list of h5py.Dataset or h5py.Group objects
+        """
+        rev_suffix = suffix[::-1]
+        paths = []
+        ind = bisect_left(self.__reversed_paths, rev_suffix)
+        while ind < len(self.__reversed_paths) and self.__reversed_paths[ind].startswith(rev_suffix):
+            path = self.__reversed_paths[ind][::-1]
+            if (obj_type is None or self.entries[path]['type'] == obj_type) and \
+                    (under == '/' or path.startswith(under.rstrip('/') + '/')):
+                paths.append(path)
+            ind += 1
+        return self.__get_objects(paths)
+
+    def findByTool(self, tool_name, source=None, parent=None):
+        """
+        Groups created by a tool such as 'Raw_Data-SVD_000'
+
+        Parameters
+        ----------
+        tool_name : str
+            Name of the tool. Eg - 'SVD'
+        source : str (Optional)
+            Name of the dataset that the tool was applied to. Eg - 'Raw_Data'
+        parent : str (Optional)
+            Absolute path of the group containing the results
+
+        Returns
+        -------
+        objects : list of h5py.Group or h5py.Dataset objects
+            Sorted by path
+        """
+        paths = [path for path in self.__by_tool.get(tool_name, set())
+                 if (source is None or self.entries[path]['source'] == source) and
+                 (parent is None or self.entries[path]['parent'] == parent)]
+        return self.__get_objects(paths)
+
+    def findByAttr(self, attr_name, value=None):
+        """
+        Objects that have the provided attribute
+
+        Parameters
+        ----------
+        attr_name : str
+            Name of the attribute
+        value : object (Optional)
+            If provided, only objects whose attribute equals this value are returned
+
+        Returns
+        -------
+        objects : list of h5py.Dataset or h5py.Group objects
+        """
+        objects = self.__get_objects(self.__by_attr.get(attr_name, set()))
+        if value is None:
+            return objects
+        return [obj for obj in objects if attr_name in obj.attrs and obj.attrs[attr_name] == value]
+
+    def mainDatasets(self):
+        """
+        All the "Main" datasets in the file
+
+        Returns
+        -------
+        objects : list of h5py.Dataset objects
+        """
+        return self.__get_objects([path for path, record in self.entries.items() if record['is_main']])
+
+    def isCurrent(self, h5_grp):
+        """
+        Whether the catalog records exactly the objects that are directly under a group. Only the names of the
+        children of the group are read from the file
+
+        Parameters
+        ----------
+        h5_grp : h5py.Group or h5py.File object
+            Group to check
+
+        Returns
+        -------
+        is_current : bool
+            False if objects were added to or removed from the group without updating the catalog
+        """
+        return set(h5_grp.keys()) == self.__children.get(h5_grp.name, set())
+
+    def nextIndex(self, parent, prefix):
+        """
+        Index to be appended to a new indexed group
+
+        Parameters
+        ----------
+        parent : str
+            Absolute path of the group that will contain the new group
+        prefix : str
+            Name of the new group without the index. Eg - 'Raw_Data-SVD_'
+
+        Returns
+        -------
+        index : unsigned int
+            One more than the highest index used so far, 0 if there were none
+        """
+        return self.__max_index.get((parent, prefix), -1) + 1
+
+
+def getCatalog(h5_obj):
+    """
+    Returns the catalog of the file containing the provided object, building it with a single pass over the file if
+    needed
+
+    Parameters
+    ----------
+    h5_obj : h5py.Dataset, h5py.Group or h5py.File object
+        Any object in the file
+
+    Returns
+    -------
+    catalog : HDFCatalog object
+    """
+    file_key = h5_obj.file.id.fileno
+    catalog = _catalogs.get(file_key)
+    if catalog is None or not catalog.is_valid or catalog.file.id != h5_obj.file.id:
+        catalog = HDFCatalog(h5_obj.file)
+        _catalogs[file_key] = catalog
+    return catalog
+
+
+def updateCatalog(h5_objs):
+    """
+    Updates the records of objects in the catalog of their file. Nothing is done if the file has not been cataloged.
+
+    Parameters
+    ----------
+    h5_objs : h5py.Dataset, h5py.Group or list of these
+        Objects that were created or modified
+    """
+    if not isinstance(h5_objs, (list, tuple)):
+        h5_objs = [h5_objs]
+    for h5_obj in h5_objs:
+        catalog = _catalogs.get(h5_obj.file.id.fileno)
+        if catalog is not None and catalog.is_valid and catalog.file.id == h5_obj.file.id:
+            catalog.add(h5_obj)
@@ -5,15 +5,140 @@ Created on Tue Nov  3 21:14:25 2015
 @author: Suhas Somnath, Chris Smith, Numan Laanait
 """
 from __future__ import print_function
+import hashlib
+import inspect
+import json
+import zlib
 import h5py
 from warnings import warn
 import numpy as np
+from .hdf_catalog import getCatalog, updateCatalog
 from .microdata import MicroDataset
 
 __all__ = ['getDataSet', 'getH5DsetRefs', 'getH5RegRefIndices', 'get_dimensionality', 'get_sort_order',
            'getAuxData', 'getDataAttr', 'getH5GroupRef', 'checkIfMain', 'checkAndLinkAncillary',
            'createRefFromIndices', 'copyAttributes', 'reshape_to_Ndims', 'linkRefs', 'linkRefAsAlias',
-           'findH5group', 'get_formatted_labels']
+           'findH5group', 'get_formatted_labels', 'calcParmsHash', 'markModified', 'findIdenticalResult', 'getCachedAuxData', 'readCachedAuxData', 'clearAuxCache']
+
+# Ancillary datasets and their contents resolved so far, arranged as:
+# {file number: {'file_id': h5py FileID, 'dsets': {(dataset id, name): h5py.Dataset},
+#                'data': {(dataset id, name): array}}}
+_aux_cache = dict()
+
+
+def _getFileCache(h5_obj):
+    """
+    Returns the cache of ancillary datasets for the file containing the provided object.
+    Caches of files that have since been closed are discarded.
+
+    Parameters
+    ----------
+    h5_obj : h5py.Dataset or h5py.Group or h5py.File object
+        Any object in the file
+
+    Returns
+    -------
+    file_cache : dict
+        Cache for this file
+    """
+    for file_key in [key for key, file_cache in _aux_cache.items() if not file_cache['file_id'].valid]:
+        del _aux_cache[file_key]
+
+    file_id = h5_obj.file.id
+    file_cache = _aux_cache.get(file_id.fileno)
+    if file_cache is None or file_cache['file_id'] != file_id:
+        # File numbers may be reused by files opened later
+        file_cache = {'file_id': file_id, 'dsets': dict(), 'data': dict()}
+        _aux_cache[file_id.fileno] = file_cache
+    return file_cache
+
+
+def clearAuxCache(h5_obj=None):
+    """
+    Discards the cached ancillary datasets and their contents. This is called by ioHDF5.writeData and the
+    reference linking functions whenever a file is modified and by ioHDF5.close before the file is closed
+
+    Parameters
+    ----------
+    h5_obj : h5py.Dataset or h5py.Group or h5py.File object (Optional)
+        Any object in the file whose cache must be invalidated. The caches of all files are cleared if not provided
+    """
+    if h5_obj is None:
+        _aux_cache.clear()
+        return
+    file_id = h5_obj.file.id
+    file_cache = _aux_cache.get(file_id.fileno)
+    if file_cache is not None and file_cache['file_id'] == file_id:
+        del _aux_cache[file_id.fileno]
+
+
+def getCachedAuxData(parentData, auxDataName):
+    """
+    Returns the ancillary dataset referenced in an attribute of some dataset. The dereferenced dataset is
+    remembered until the file is modified via ioHDF5.writeData or closed so repeated calls do not touch the file.
+
+    Parameters
+    ----------
+    parentData : h5py.Dataset
+        Dataset object reference.
+    auxDataName : str
+        Name of the attribute holding the reference to the ancillary dataset
+
+    Returns
+    -------
+    h5_aux : h5py.Dataset object
+        Ancillary dataset
+
+    Raises
+    ------
+    KeyError : if the attribute does not exist or does not refer to a dataset
+    """
+    file_cache = _getFileCache(parentData)
+    key = (parentData.id, auxDataName)
+    h5_aux = file_cache['dsets'].get(key)
+    if h5_aux is not None and h5_aux.id.valid:
+        return h5_aux
+
+    ref = parentData.attrs[auxDataName]
+    if not isinstance(ref, h5py.Reference) or not isinstance(parentData.file[ref], h5py.Dataset):
+        raise KeyError('{} of {} does not refer to a dataset'.format(auxDataName, parentData.name))
+
+    h5_aux = parentData.file[ref]
+    file_cache['dsets'][key] = h5_aux
+    return h5_aux
+
+
+def readCachedAuxData(parentData, auxDataName):
+    """
+    Returns the contents of the ancillary dataset referenced in an attribute of some dataset. The contents are read
+    only once until the file is modified via ioHDF5.writeData. The returned array is shared and therefore read-only.
+
+    Parameters
+    ----------
+    parentData : h5py.Dataset
+        Dataset object reference.
+    auxDataName : str
+        Name of the attribute holding the reference to the ancillary dataset. Eg - 'Position_Indices'
+
+    Returns
+    -------
+    aux_data : numpy array
+        Read-only contents of the ancillary dataset
+
+    Raises
+    ------
+    KeyError : if the attribute does not exist or does not refer to a dataset
+    """
+    file_cache = _getFileCache(parentData)
+    key = (parentData.id, auxDataName)
+    h5_aux = getCachedAuxData(parentData, auxDataName)
+    aux_data = file_cache['data'].get(key)
+    if aux_data is None:
+        aux_data = h5_aux[()]
+        if isinstance(aux_data, np.ndarray):
+            aux_data.flags.writeable = False
+        file_cache['data'][key] = aux_data
+    return aux_data
 
 
 def getDataSet(h5Parent, dataName):
@@ -34,13 +159,12 @@ def getDataSet(h5Parent, dataName):
     list of h5py.Reference of the dataset.
     """
     if isinstance(h5Parent, h5py.File) or isinstance(h5Parent, h5py.Group):
-        dataList = []
-
-        def findData(name, obj):
-            if name.endswith(dataName) and isinstance(obj, h5py.Dataset):
-                dataList.append(obj)
-
-        h5Parent.visititems(findData)
+        catalog = getCatalog(h5Parent)
+        dataList = catalog.findBySuffix(dataName, obj_type='Dataset', under=h5Parent.name)
+        if len(dataList) == 0:
+            # The dataset may have been written without ioHDF5 after the catalog was built
+            catalog.refresh()
+            dataList = catalog.findBySuffix(dataName, obj_type='Dataset', under=h5Parent.name)
         return dataList
     else:
         print('%s is not an hdf5 File or Group' % (h5Parent))
@@ -65,11 +189,14 @@ def getAuxData(parentData, **kwargs):
 
     try:
         dataList = []
-        f = parentData.file
         for auxName in auxDataName:
-            ref = parentData.attrs[auxName]
-            if isinstance(ref, h5py.Reference) and isinstance(f[ref], h5py.Dataset):
-                dataList.append(f[ref])
+            if not isinstance(parentData.attrs[auxName], h5py.Reference):
+                continue
+            try:
+                dataList.append(getCachedAuxData(parentData, auxName))
+            except KeyError:
+                # reference to a group or some other object
+                continue
     except KeyError:
         warn('%s is not an attribute of %s'
              % (str(auxName), parentData.name))
@@ -178,13 +305,172 @@ def findH5group(h5_main, tool_name):
     """
     dset_name = h5_main.name.split('/')[-1]
     parent_grp = h5_main.parent
-    groups = []
-    for key in parent_grp.keys():
-        if dset_name in key and tool_name in key:
-            groups.append(parent_grp[key])
+    catalog = getCatalog(h5_main)
+    if not catalog.isCurrent(parent_grp):
+        # Groups may have been written without ioHDF5 after the catalog was built
+        catalog.refresh()
+    groups = catalog.findByTool(tool_name, source=dset_name, parent=parent_grp.name)
+    if len(groups) == 0:
+        # tool names that are only part of the name of the tool
+        groups = [parent_grp[key] for key in catalog.children(parent_grp.name)
+                  if dset_name in key and tool_name in key]
     return groups
 
 
+def _canonicalParms(obj):
+    """
+    Converts parameters to built-in types that can be serialized the same way every time
+
+    Parameters
+    ----------
+    obj : object
+        Parameter value. Dictionaries, lists, tuples and numpy arrays are converted recursively. Random number
+        generators are represented by their state and functions by their qualified names since the default
+        representation of either includes the memory address and would change from one session to the next
+
+    Returns
+    -------
+    obj : object
+        JSON serializable version of the parameter
+    """
+    if isinstance(obj, np.random.RandomState):
+        return {'RandomState': _canonicalParms(obj.get_state())}
+    if hasattr(np.random, 'Generator') and isinstance(obj, np.random.Generator):
+        return {'Generator': _canonicalParms(obj.bit_generator.state)}
+    if isinstance(obj, dict):
+        return {str(key): _canonicalParms(val) for key, val in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_canonicalParms(val) for val in obj]
+    if isinstance(obj, np.ndarray):
+        return {'dtype': str(obj.dtype), 'shape': list(obj.shape), 'data': _canonicalParms(obj.tolist())}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8', 'replace')
+    if obj is None or isinstance(obj, (bool, int, float, str)):
+        return obj
+    if isinstance(obj, type) or inspect.isroutine(obj):
+        return '{}.{}'.format(getattr(obj, '__module__', None), getattr(obj, '__qualname__', obj.__name__))
+    return repr(obj)
+
+
+def markModified(h5_dset):
+    """
+    Records that the contents of a dataset were written to by incrementing its 'modification_count' attribute.
+    Results computed from the previous contents of the dataset are then no longer reused by findIdenticalResult().
+    ioHDF5.writeData calls this for every dataset it writes. Functions that write into existing datasets should call
+    this once they are done writing
+
+    Parameters
+    ----------
+    h5_dset : h5py.Dataset object
+        Dataset that was written to
+    """
+    h5_dset.attrs['modification_count'] = int(h5_dset.attrs.get('modification_count', 0)) + 1
+
+
+def _getSourceStamp(h5_main, checksum=False, max_block_bytes=2**26):
+    """
+    Describes the current contents of a dataset via its name, shape, datatype and modification count.
+    This does not read the dataset. A checksum of the contents may also be requested but this reads the entire
+    dataset, in blocks of rows
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset object
+        Source dataset
+    checksum : bool (Optional. Default = False)
+        Whether or not to include a CRC-32 checksum of the entire dataset
+    max_block_bytes : unsigned int (Optional. Default = 64 MB)
+        Maximum size of the block of rows read at a time for the checksum
+
+    Returns
+    -------
+    stamp : dict
+        Name, shape, datatype, modification count and optionally the checksum of the dataset
+    """
+    stamp = {'name': h5_main.name, 'shape': list(h5_main.shape), 'dtype': str(h5_main.dtype),
+             'modification_count': int(h5_main.attrs.get('modification_count', 0))}
+    if not checksum:
+        return stamp
+
+    crc = 0
+    if h5_main.shape == ():
+        crc = zlib.crc32(np.ascontiguousarray(h5_main[()]).tobytes())
+    elif h5_main.size > 0:
+        row_bytes = max(1, h5_main.dtype.itemsize * h5_main.size // h5_main.shape[0])
+        rows_per_block = max(1, int(max_block_bytes // row_bytes))
+        for start in range(0, h5_main.shape[0], rows_per_block):
+            block = np.ascontiguousarray(h5_main[start:start + rows_per_block])
+            crc = zlib.crc32(block.tobytes(), crc)
+    stamp['checksum'] = crc & 0xffffffff
+    return stamp
+
+
+def calcParmsHash(h5_main, tool_name, parms, checksum=False):
+    """
+    Canonical hash of the parameters of a processing tool and the dataset it is applied to.
+    Tools record this hash in the attributes of the group holding their results so that identical results can be
+    found via findIdenticalResult() instead of being recomputed.
+    The dataset is described by its name, shape, datatype and modification count (see markModified()), so this
+    does not read the data unless a checksum is requested.
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset object
+        Dataset the tool is applied to
+    tool_name : str
+        Name of the tool. Eg - 'SVD'
+    parms : dict
+        Parameters of the tool
+    checksum : bool (Optional. Default = False)
+        Whether or not to also checksum the contents of the dataset. This catches in-place modifications that were
+        not recorded via markModified() but reads the entire dataset
+
+    Returns
+    -------
+    parms_hash : str
+        SHA-1 hex digest
+    """
+    desc = {'tool': tool_name, 'parms': _canonicalParms(parms), 'source': _getSourceStamp(h5_main, checksum=checksum)}
+    return hashlib.sha1(json.dumps(desc, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def findIdenticalResult(h5_main, tool_name, parms_hash, hash_attr='parms_hash'):
+    """
+    Finds the group containing the results of a tool that was already applied to the dataset with the same
+    parameters
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset object
+        Dataset the tool was applied to
+    tool_name : str or None
+        Name of the tool. Eg - 'SVD'. If None, any group next to h5_main with a matching hash is returned
+    parms_hash : str
+        Hash computed via calcParmsHash()
+    hash_attr : str (Optional. Default = 'parms_hash')
+        Name of the attribute holding the hash
+
+    Returns
+    -------
+    h5_grp : h5py.Group object or None
+        Most recent group with identical results. None if there were none
+    """
+    catalog = getCatalog(h5_main)
+    if not catalog.isCurrent(h5_main.parent):
+        catalog.refresh()
+    if tool_name is None:
+        candidates = [grp for grp in catalog.findByAttr(hash_attr) if grp.parent.name == h5_main.parent.name]
+    else:
+        candidates = catalog.findByTool(tool_name, source=h5_main.name.split('/')[-1], parent=h5_main.parent.name)
+    matches = [grp for grp in candidates if isinstance(grp, h5py.Group) and hash_attr in grp.attrs and
+               _canonicalParms(grp.attrs[hash_attr]) == parms_hash]
+    if len(matches) == 0:
+        return None
+    return matches[-1]
+
+
 def getH5RegRefIndices(ref, h5_main, return_method='slices'):
     """
     Given an hdf5 region reference and the dataset it refers to,
@@ -483,7 +769,7 @@ def reshape_to_Ndims(h5_main, h5_pos=None, h5_spec=None):
         """
         if isinstance(h5_main, h5py.Dataset):
             try:
-                ds_pos = h5_main.file[h5_main.attrs['Position_Indices']][()]
+                ds_pos = readCachedAuxData(h5_main, 'Position_Indices')
             except KeyError:
                 print('No position datasets found as attributes of {}'.format(h5_main.name))
                 if len(h5_main.shape) > 1:
@@ -510,7 +796,7 @@ def reshape_to_Ndims(h5_main, h5_pos=None, h5_spec=None):
         """
         if isinstance(h5_main, h5py.Dataset):
             try:
-                ds_spec = h5_main.file[h5_main.attrs['Spectroscopic_Indices']][()]
+                ds_spec = readCachedAuxData(h5_main, 'Spectroscopic_Indices')
             except KeyError:
                 print ('No spectroscopic datasets found as attributes of {}'.format(h5_main.name))
                 if len(h5_main.shape) > 1:
@@ -614,7 +900,7 @@ def get_sort_order(ds_spec):
     change_sort : List of unsigned integers
         Order of rows sorted from fastest changing to slowest
     """
-    change_count = [len(np.where([row[i] != row[i - 1] for i in xrange(len(row))])[0]) for row in ds_spec]
+    change_count = np.count_nonzero(np.diff(np.atleast_2d(ds_spec), axis=1), axis=1)
     change_sort = np.argsort(change_count)[::-1]
 
     return change_sort
@@ -701,8 +987,7 @@ def checkIfMain(h5_main):
 
     for name in dset_names:
         try:
-            ds = h5_main.file[h5_main.attrs[name]]
-            success = np.all([success, isinstance(ds, h5py.Dataset)])
+            getCachedAuxData(h5_main, name)
         except:
             print('{} not found as an attribute of {}.'.format(name, h5_name))
             success = False
@@ -728,6 +1013,8 @@ def linkRefs(src, trg):
     """
     for itm in trg:
         src.attrs[itm.name.split('/')[-1]] = itm.ref
+    clearAuxCache(src)
+    updateCatalog(src)
 
 
 def linkRefAsAlias(src, trg, trg_name):
@@ -746,6 +1033,8 @@ def linkRefAsAlias(src, trg, trg_name):
         Alias / alternate name for trg
     """
     src.attrs[trg_name] = trg.ref
+    clearAuxCache(src)
+    updateCatalog(src)
 
 
 def copyRegionRefs(h5_source, h5_target):
@@ -12,8 +12,9 @@ from time import time, sleep
 from warnings import warn
 
 import h5py
-import numpy as np
 
+from .hdf_catalog import getCatalog, updateCatalog
+from .hdf_utils import clearAuxCache, markModified
 from .microdata import MicroDataGroup
 from ..__version__ import version
 
@@ -68,6 +69,7 @@ class ioHDF5(object):
         function immediately after the creation of the ioHDF5 object.
         """
         self.file.clear()
+        clearAuxCache(self.file)
         self.repack()
 
 
@@ -118,6 +120,7 @@ class ioHDF5(object):
 
     def close(self):
         '''Close h5.file'''
+        clearAuxCache(self.file)
         self.file.close()
 
     def delete(self):
@@ -147,6 +150,10 @@ class ioHDF5(object):
         '''
 
         f = self.file
+        catalog = getCatalog(f)
+
+        # The file is about to change. Previously resolved ancillary datasets may no longer be valid
+        clearAuxCache(f)
 
         f.attrs['PySPM version']=version
 
@@ -155,6 +162,19 @@ class ioHDF5(object):
             warn('Input of type: {} \n'.format(type(data)))
             sys.exit("Input not of type MicroDataGroup.\n We're done here! \n")
 
+        def __indexedName(parent, prefix):
+            """
+            Name with the next free index for a group whose name ends in '_'. Existing groups are never reused
+            """
+            h5_parent = f[parent]
+            if not catalog.isCurrent(h5_parent):
+                # Objects were created or removed without ioHDF5 after the catalog was built
+                catalog.refresh()
+            index = catalog.nextIndex(h5_parent.name, prefix)
+            while prefix + '{:03d}'.format(index) in h5_parent:
+                index += 1
+            return prefix + '{:03d}'.format(index)
+
         # Figuring out if the first item in AFMData tree is file or group
         if data.name is '' and data.parent is '/':
             # For file we just write the attributes
@@ -169,18 +189,13 @@ class ioHDF5(object):
                 the suffix index to be appended automatically. Here, we check to
                 ensure that the chosen index is new.
                 '''
-                previous = np.where([data.name in key for key in f[data.parent].keys()])[0]
-                if len(previous)==0:
-                    index = 0
-                else:
-                    # assuming that the last element of previous contains the highest index
-                    last = f[data.parent].keys()[previous[-1]]
-                    index = int(last.split('_')[-1])+1
-                data.name+='{:03d}'.format(index)
+                data.name = __indexedName(data.parent, data.name)
             try:
                 g = f[data.parent].create_group(data.name)
                 if print_log: print('Created group {}'.format(g.name))
             except ValueError:
+                if data.indexed:
+                    raise
                 g = f[data.parent][data.name]
                 print('Group already exists: {}'.format(g.name))
             except:
@@ -191,6 +206,7 @@ class ioHDF5(object):
                 if data.attrs[key] is None:
                     continue
                 g.attrs[key] = data.attrs[key]
+            updateCatalog(g)
             if print_log: print('Wrote attributes to group: {} \n'.format(data.name))
             root = g.name
 
@@ -201,17 +217,13 @@ class ioHDF5(object):
 
             if isinstance(child, MicroDataGroup):
                 if child.indexed:
-                    previous = np.where([child.name in key for key in f[parent].keys()])[0]
-                    if len(previous)==0:
-                        index = 0
-                    else:
-                        last = f[parent].keys()[previous[-1]]
-                        index = int(last.split('_')[-1])+1
-                    child.name+='{:03d}'.format(index)
+                    child.name = __indexedName(parent, child.name)
                 try:
                     itm = f[parent].create_group(child.name)
                     if print_log: print('Created Group {}'.format(itm.name))
                 except ValueError:
+                    if child.indexed:
+                        raise
                     itm = f[parent][child.name]
                     print('Found Group already exists {}'.format(itm.name))
                 except:
@@ -308,6 +320,9 @@ class ioHDF5(object):
                         itm.attrs[key] = child.attrs[key]
                         if print_log: print('Wrote Attributes of Dataset %s \n' %(itm.name.split('/')[-1]))
                         # Make a dictionary of references
+                # Results computed from any previous contents of this dataset must not be reused
+                markModified(itm)
+            updateCatalog(itm)
             refList.append(itm)
             return refList
 
@@ -315,6 +330,8 @@ class ioHDF5(object):
         for child in data.children:
             __populate(child, root)
 
+        clearAuxCache(f)
+
         if print_log:
             print('Finished writing to h5 file.\n'+
                   'Right now you got yourself a fancy folder structure. \n'+
@@ -13,7 +13,8 @@ from PyQt5 import QtWidgets
 
 __all__ = ['getAvailableMem', 'getTimeStamp', 'uiGetFile', 'transformToTargetType', 'transformToReal',
            'complex_to_float', 'compound_to_scalar', 'realToComplex', 'realToCompound', 'check_dtype',
-           'recommendCores']
+           'recommendCores', 'complex_to_interleaved', 'compound_to_interleaved', 'interleavedToComplex',
+           'interleavedToCompound']
 
 def getTimeStamp():
     """
@@ -149,7 +150,146 @@ def compound_to_scalar(ds_main):
         raise TypeError('Datatype {} not supported in compound_to_scalar'.format(type(ds_main)))
 
 
-def check_dtype(ds_main):
+def _getPackedFieldType(compound_type):
+    """
+    Returns the datatype of the fields of a compound datatype if all fields share the same scalar datatype
+    and are packed back to back without any padding. Such compound data can be viewed as real values.
+
+    Parameters
+    ----------
+    compound_type : numpy dtype
+        Compound datatype
+
+    Returns
+    -------
+    field_type : numpy dtype or None
+        Datatype of every field. None if the fields cannot be viewed as a contiguous real array
+    """
+    field_types = [compound_type.fields[name][0] for name in compound_type.names]
+    offsets = [compound_type.fields[name][1] for name in compound_type.names]
+    field_type = field_types[0]
+    if field_type.kind != 'f' or any([ftype != field_type for ftype in field_types]):
+        return None
+    if offsets != [ind * field_type.itemsize for ind in range(len(field_types))] or \
+            compound_type.itemsize != len(field_types) * field_type.itemsize:
+        return None
+    return field_type
+
+
+def complex_to_interleaved(ds_main):
+    """
+    Views a complex ND numpy array or HDF5 dataset as a real array where the real and imaginary components of
+    each element are interleaved along the last axis - [real_0, imag_0, real_1, imag_1, ...]
+
+    Unlike complex_to_float, no copy is made for in-memory arrays and HDF5 datasets are read only once
+
+    Parameters
+    ----------
+    ds_main : complex ND numpy array or ND HDF5 dataset
+        Dataset of interest
+
+    Returns
+    -------
+    retval : ND real numpy array
+        Last axis is twice as long as that of ds_main
+    """
+    if isinstance(ds_main, h5py.Dataset):
+        ds_main = ds_main[()]
+    ds_main = np.ascontiguousarray(ds_main)
+    return ds_main.view(np.real(ds_main.flat[:1]).dtype)
+
+
+def interleavedToComplex(ds_real):
+    """
+    Views real data whose real and imaginary components are interleaved along the last axis as complex values.
+    This is the inverse of complex_to_interleaved
+
+    Parameters
+    ----------
+    ds_real : ND real numpy array or HDF5 dataset
+        Data arranged as [instance, 2 x features] with the real and imaginary components interleaved
+
+    Returns
+    -------
+    ds_complex : ND complex numpy array
+        Data arranged as [instance, features]
+    """
+    if isinstance(ds_real, h5py.Dataset):
+        ds_real = ds_real[()]
+    if ds_real.dtype not in [np.float32, np.float64]:
+        ds_real = np.float64(ds_real)
+    return np.ascontiguousarray(ds_real).view(np.result_type(ds_real.dtype, np.complex64))
+
+
+def compound_to_interleaved(ds_main):
+    """
+    Converts a compound ND numpy array or HDF5 dataset into a real array where the fields of each element are
+    interleaved along the last axis - [field_0 of element 0, field_1 of element 0, field_0 of element 1, ...]
+
+    If all the fields share the same floating point datatype and are packed without padding, the data is only
+    viewed as real values without making any copies. Otherwise, a single copy is made.
+    HDF5 datasets are read only once in either case.
+
+    Parameters
+    ----------
+    ds_main : ND numpy array or ND HDF5 dataset object of compound datatype
+        Dataset of interest
+
+    Returns
+    -------
+    retval : ND real numpy array
+        Last axis is as many times longer than that of ds_main as there are fields
+    """
+    if isinstance(ds_main, h5py.Dataset):
+        ds_main = ds_main[()]
+    elif not isinstance(ds_main, np.ndarray):
+        raise TypeError('Datatype {} not supported in compound_to_interleaved'.format(type(ds_main)))
+
+    field_type = _getPackedFieldType(ds_main.dtype)
+    num_fields = len(ds_main.dtype.names)
+    if field_type is not None:
+        return np.ascontiguousarray(ds_main).view(field_type)
+
+    ds_real = np.empty(ds_main.shape + (num_fields,), dtype=np.float32)
+    for iname, name in enumerate(ds_main.dtype.names):
+        ds_real[..., iname] = ds_main[name]
+    return ds_real.reshape(ds_main.shape[:-1] + (ds_main.shape[-1] * num_fields,))
+
+
+def interleavedToCompound(ds_real, compound_type):
+    """
+    Converts real data whose fields are interleaved along the last axis to the provided compound datatype.
+    This is the inverse of compound_to_interleaved
+
+    Parameters
+    ----------
+    ds_real : ND real numpy array or HDF5 dataset
+        Data arranged as [instance, num_fields x features] with the fields interleaved
+    compound_type : dtype
+        Target compound datatype
+
+    Returns
+    -------
+    ds_compound : ND numpy array of the compound datatype
+        Data arranged as [instance, features]
+    """
+    if isinstance(ds_real, h5py.Dataset):
+        ds_real = ds_real[()]
+    num_fields = len(compound_type.names)
+    if ds_real.shape[-1] % num_fields:
+        raise TypeError('Provided compound type was not compatible by number of elements')
+
+    field_type = _getPackedFieldType(compound_type)
+    if field_type is not None:
+        return np.ascontiguousarray(ds_real, dtype=field_type).view(compound_type)
+
+    ds_compound = np.empty(ds_real.shape[:-1] + (ds_real.shape[-1] // num_fields,), dtype=compound_type)
+    for iname, name in enumerate(compound_type.names):
+        ds_compound[name] = ds_real[..., iname::num_fields]
+    return ds_compound
+
+
+def check_dtype(ds_main, interleaved=False):
     """
     Checks the datatype of the input dataset and provides the appropriate
     function calls to convert it to a float
@@ -158,6 +298,9 @@ def check_dtype(ds_main):
     ----------
     ds_main : HDF5 Dataset
         Dataset of interest
+    interleaved : Boolean (Optional. Default = False)
+        Whether or not the components of complex and compound values should be interleaved rather than stacked
+        in the converted data. See complex_to_interleaved and compound_to_interleaved
 
     Returns
     -------
@@ -184,7 +327,7 @@ def check_dtype(ds_main):
         is_complex = True
         new_dtype = np.real(ds_main[0, 0]).dtype
         type_mult = new_dtype.itemsize * 2
-        func = complex_to_float
+        func = complex_to_interleaved if interleaved else complex_to_float
         n_features *= 2
     elif len(ds_main.dtype) > 1:
         """
@@ -193,8 +336,13 @@ def check_dtype(ds_main):
         """
         is_compound = True
         new_dtype = np.float32
+        if interleaved:
+            func = compound_to_interleaved
+            if _getPackedFieldType(in_dtype) is not None:
+                new_dtype = _getPackedFieldType(in_dtype).type
+        else:
+            func = compound_to_scalar
         type_mult = len(in_dtype) * new_dtype(0).itemsize
-        func = compound_to_scalar
         n_features *= len(in_dtype)
     else:
         if ds_main.dtype not in [np.float32, np.float64]:
@@ -259,7 +407,7 @@ def realToCompound(ds_real, compound_type):
 
     return ds_compound
 
-def transformToTargetType(ds_real, new_dtype):
+def transformToTargetType(ds_real, new_dtype, interleaved=False):
     """
     Transforms real data into the target dtype
 
@@ -271,6 +419,9 @@ def transformToTargetType(ds_real, new_dtype):
         second half contains the imaginary components
     new_dtype : dtype
         Target datatype
+    interleaved : Boolean (Optional. Default = False)
+        Whether or not the components are interleaved rather than stacked in ds_real.
+        See complex_to_interleaved and compound_to_interleaved
 
     Returns
     ----------
@@ -278,14 +429,18 @@ def transformToTargetType(ds_real, new_dtype):
         Data of the target data type
     """
     if new_dtype in [np.complex64, np.complex128, np.complex]:
+        if interleaved:
+            return interleavedToComplex(ds_real)
         return realToComplex(ds_real)
     elif len(new_dtype) > 1:
+        if interleaved:
+            return interleavedToCompound(ds_real, new_dtype)
         return realToCompound(ds_real, new_dtype)
     else:
         return new_dtype.type(ds_real)
 
 
-def transformToReal(ds_main):
+def transformToReal(ds_main, interleaved=False):
     """
     Transforms real data into the target dtype
 
@@ -297,6 +452,8 @@ def transformToReal(ds_main):
         second half contains the imaginary components
     new_dtype : dtype
         Target datatype
+    interleaved : Boolean (Optional. Default = False)
+        Whether or not the components of complex and compound values should be interleaved rather than stacked
 
     Returns
     ----------
@@ -304,8 +461,12 @@ def transformToReal(ds_main):
         Data of the target data type
     """
     if ds_main.dtype in [np.complex64, np.complex128, np.complex]:
+        if interleaved:
+            return complex_to_interleaved(ds_main)
         return complex_to_float(ds_main)
     elif len(ds_main.dtype) > 1:
+        if interleaved:
+            return compound_to_interleaved(ds_main)
         return compound_to_scalar(ds_main)
     else:
         return ds_main
\ No newline at end of file
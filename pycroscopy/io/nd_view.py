@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy N-dimensional view over pycroscopy "Main" datasets
+"""
+
+from __future__ import division, print_function
+
+import h5py
+import numpy as np
+
+from .hdf_utils import get_sort_order, getCachedAuxData, readCachedAuxData
+
+__all__ = ['NDView']
+
+
+class NDView(object):
+    """
+    Lazy N-dimensional view over a two dimensional "Main" dataset arranged as [position, spectroscopic].
+
+    The dimensions are worked out once from the Position_Indices and Spectroscopic_Indices datasets. Nothing is read
+    from the Main dataset until the view is sliced, at which point only the requested sub-array is read using the
+    fewest two dimensional hyperslabs possible.
+
+    The dimensions of the view are arranged as [position dimensions, spectroscopic dimensions], each in the same
+    order as in the corresponding indices dataset. The view can be sliced with integers, slices, lists or arrays
+    either by position or by dimension name:
+
+    >>> view = NDView(h5_main)
+    >>> view.dim_names
+    ['X', 'Y', 'DC_Offset', 'Frequency']
+    >>> view[10:20, :, 5]
+    >>> view[{'X': slice(10, 20), 'DC_Offset': 5}]
+    >>> view.sel(X=slice(10, 20), DC_Offset=5)
+    """
+
+    def __init__(self, h5_main, h5_pos=None, h5_spec=None):
+        """
+        Parameters
+        ----------
+        h5_main : h5py.Dataset object
+            2D "Main" dataset arranged as [position, spectroscopic]
+        h5_pos : h5py.Dataset object (Optional)
+            Position indices corresponding to rows in `h5_main`. Found via the attributes of h5_main if not provided
+        h5_spec : h5py.Dataset object (Optional)
+            Spectroscopic indices corresponding to columns in `h5_main`. Found via the attributes of h5_main if not
+            provided
+        """
+        if not isinstance(h5_main, h5py.Dataset) or len(h5_main.shape) != 2:
+            raise TypeError('h5_main must be a two dimensional h5py.Dataset')
+        self.h5_main = h5_main
+
+        if h5_pos is None:
+            h5_pos = getCachedAuxData(h5_main, 'Position_Indices')
+            pos_inds = readCachedAuxData(h5_main, 'Position_Indices')
+        else:
+            pos_inds = h5_pos[()]
+        if h5_spec is None:
+            h5_spec = getCachedAuxData(h5_main, 'Spectroscopic_Indices')
+            spec_inds = readCachedAuxData(h5_main, 'Spectroscopic_Indices')
+        else:
+            spec_inds = h5_spec[()]
+
+        # Position indices are arranged as [position, dimension] and spectroscopic ones as [dimension, spectroscopic]
+        pos_sizes, pos_strides = self.__get_dimensions(np.atleast_2d(np.transpose(pos_inds)), h5_main.shape[0])
+        spec_sizes, spec_strides = self.__get_dimensions(np.atleast_2d(spec_inds), h5_main.shape[1])
+
+        self.pos_dim_names = self.__get_names(h5_pos, len(pos_sizes), 'Position_Dimension')
+        self.spec_dim_names = self.__get_names(h5_spec, len(spec_sizes), 'Spectroscopic_Dimension')
+        self.dim_names = self.pos_dim_names + self.spec_dim_names
+        self.shape = tuple(pos_sizes + spec_sizes)
+        self.ndim = len(self.shape)
+        self.dtype = h5_main.dtype
+
+        self.__num_pos_dims = len(pos_sizes)
+        self.__strides = pos_strides + spec_strides
+
+    @staticmethod
+    def __get_dimensions(ind_mat, num_elements):
+        """
+        Computes the size of each dimension and the step between successive indices of each dimension
+
+        Parameters
+        ----------
+        ind_mat : 2D numpy array
+            Indices arranged as [dimension, element]
+        num_elements : unsigned int
+            Number of rows or columns in the Main dataset
+
+        Returns
+        -------
+        sizes : list of unsigned ints
+            Size of each dimension
+        strides : list of unsigned ints
+            Number of elements between successive indices of each dimension
+        """
+        sizes = [int(row.max()) + 1 for row in ind_mat]
+        strides = np.ones(len(sizes), dtype=np.int64)
+        # walking from the fastest varying dimension to the slowest one
+        sort_order = get_sort_order(ind_mat)
+        for prev_dim, dim in zip(sort_order[:-1], sort_order[1:]):
+            strides[dim] = strides[prev_dim] * sizes[prev_dim]
+
+        if np.prod(sizes) != num_elements or \
+                not np.array_equal(np.dot(strides, ind_mat), np.arange(num_elements)):
+            raise ValueError('Dataset cannot be viewed as an N-dimensional array since the indices do not form a '
+                             'regular grid')
+
+        return sizes, [int(stride) for stride in strides]
+
+    @staticmethod
+    def __get_names(h5_inds, num_dims, default_name):
+        """
+        Returns the names of the dimensions from the labels attribute of the indices dataset
+
+        Parameters
+        ----------
+        h5_inds : h5py.Dataset object
+            Position or Spectroscopic indices dataset
+        num_dims : unsigned int
+            Number of dimensions
+        default_name : str
+            Prefix of the names to be used if the labels attribute was missing
+
+        Returns
+        -------
+        names : list of str
+            Name of each dimension
+        """
+        labels = h5_inds.attrs.get('labels')
+        if labels is None or len(labels) != num_dims:
+            return ['{}_{}'.format(default_name, dim) for dim in range(num_dims)]
+        return [lab.decode('utf-8') if isinstance(lab, bytes) else str(lab) for lab in labels]
+
+    def __normalize_key(self, key):
+        """
+        Expands the provided key into one selection per dimension
+
+        Parameters
+        ----------
+        key : int, slice, list, numpy array, Ellipsis, tuple of these or dict
+            Selection either by position or as a dictionary keyed by dimension name
+
+        Returns
+        -------
+        selections : list
+            int, slice or 1D numpy array for each dimension
+        """
+        if isinstance(key, dict):
+            selections = [slice(None)] * self.ndim
+            for name, item in key.items():
+                if name not in self.dim_names:
+                    raise KeyError('{} is not a dimension of this dataset. Available: {}'.format(name,
+                                                                                              self.dim_names))
+                selections[self.dim_names.index(name)] = item
+            return selections
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(item is Ellipsis for item in key):
+            ell_ind = [item is Ellipsis for item in key].index(True)
+            key = key[:ell_ind] + (slice(None),) * (self.ndim - len(key) + 1) + key[ell_ind + 1:]
+        if len(key) > self.ndim:
+            raise IndexError('Too many indices: view has {} dimensions'.format(self.ndim))
+
+        return list(key) + [slice(None)] * (self.ndim - len(key))
+
+    @staticmethod
+    def __to_index_array(item, size):
+        """
+        Converts a selection along one dimension to an array of indices
+
+        Parameters
+        ----------
+        item : int, slice, list or numpy array
+            Selection along the dimension
+        size : unsigned int
+            Size of the dimension
+
+        Returns
+        -------
+        inds : 1D numpy array
+            Indices selected along this dimension
+        """
+        if isinstance(item, slice):
+            return np.arange(size)[item]
+        inds = np.atleast_1d(np.array(item, dtype=np.int64))
+        if inds.ndim != 1:
+            raise IndexError('Only integers, slices and 1D index arrays are supported')
+        if np.any(inds >= size) or np.any(inds < -size):
+            raise IndexError('Index out of bounds for dimension of size {}'.format(size))
+        return np.where(inds < 0, inds + size, inds)
+
+    @staticmethod
+    def __get_runs(inds):
+        """
+        Splits sorted unique indices into contiguous runs
+
+        Parameters
+        ----------
+        inds : 1D numpy array
+            Sorted unique indices
+
+        Returns
+        -------
+        runs : list of tuples
+            (start, stop) of each run of contiguous indices
+        """
+        breaks = np.where(np.diff(inds) != 1)[0] + 1
+        starts = np.append(0, breaks)
+        stops = np.append(breaks, len(inds))
+        return [(int(inds[start]), int(inds[stop - 1]) + 1) for start, stop in zip(starts, stops)]
+
+    def __flat_indices(self, ind_arrays, strides):
+        """
+        Flattens the N-D indices of the selected elements into the rows or columns of the Main dataset
+        """
+        flat_inds = np.zeros([len(inds) for inds in ind_arrays], dtype=np.int64)
+        for axis, (inds, stride) in enumerate(zip(ind_arrays, strides)):
+            shape = [1] * len(ind_arrays)
+            shape[axis] = len(inds)
+            flat_inds = flat_inds + np.reshape(inds * stride, shape)
+        return flat_inds.ravel()
+
+    def __getitem__(self, key):
+        """
+        Reads only the requested portion of the dataset
+
+        Parameters
+        ----------
+        key : int, slice, list, numpy array, Ellipsis, tuple of these or dict
+            Selection either by position or as a dictionary keyed by dimension name
+
+        Returns
+        -------
+        data : numpy array
+            Requested sub-array. Dimensions selected using integers are dropped
+        """
+        selections = self.__normalize_key(key)
+        ind_arrays = [self.__to_index_array(item, size) for item, size in zip(selections, self.shape)]
+        num_pos_dims = self.__num_pos_dims
+
+        rows = self.__flat_indices(ind_arrays[:num_pos_dims], self.__strides[:num_pos_dims])
+        cols = self.__flat_indices(ind_arrays[num_pos_dims:], self.__strides[num_pos_dims:])
+        uniq_rows, row_inv = np.unique(rows, return_inverse=True)
+        uniq_cols, col_inv = np.unique(cols, return_inverse=True)
+
+        # Read each block of contiguous rows and columns exactly once
+        data = np.zeros(shape=(len(uniq_rows), len(uniq_cols)), dtype=self.dtype)
+        row_offset = 0
+        for row_start, row_stop in self.__get_runs(uniq_rows):
+            col_offset = 0
+            for col_start, col_stop in self.__get_runs(uniq_cols):
+                data[row_offset:row_offset + row_stop - row_start,
+                     col_offset:col_offset + col_stop - col_start] = self.h5_main[row_start:row_stop,
+                                                                                 col_start:col_stop]
+                col_offset += col_stop - col_start
+            row_offset += row_stop - row_start
+
+        data = data[np.ravel(row_inv)][:, np.ravel(col_inv)]
+        data = np.reshape(data, [len(inds) for inds in ind_arrays])
+
+        # Drop the dimensions that were selected using integers
+        drop_dims = tuple(axis for axis, item in enumerate(selections) if np.ndim(item) == 0 and
+                          not isinstance(item, slice))
+        if len(drop_dims) > 0:
+            data = np.squeeze(data, axis=drop_dims)
+
+        return data
+
+    def sel(self, **kwargs):
+        """
+        Reads only the requested portion of the dataset, selected by dimension names
+
+        Parameters
+        ----------
+        kwargs : int, slice, list or numpy array
+            Selection for each dimension keyed by the name of the dimension. Dimensions that are not specified are
+            read in full
+
+        Returns
+        -------
+        data : numpy array
+            Requested sub-array. Dimensions selected using integers are dropped
+        """
+        return self[kwargs]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return 'NDView of {} with dimensions: {}'.format(self.h5_main.name,
+                                                         ', '.join(['{}: {}'.format(name, size) for name, size in
+                                                                    zip(self.dim_names, self.shape)]))
@@ -0,0 +1,140 @@
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+import h5py
+import numpy as np
+
+from pycroscopy.io.hdf_utils import getDataSet, calcParmsHash, findIdenticalResult, markModified, findH5group, \
+    _getSourceStamp, _canonicalParms
+from pycroscopy.io.io_hdf5 import ioHDF5
+from pycroscopy.io.microdata import MicroDataGroup, MicroDataset
+
+
+class TestGetDataSet(TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.h5_file = h5py.File(path.join(self.folder, 'test.h5'), 'w')
+        self.h5_file.create_group('Measurement_000/Channel_000')
+        self.h5_file['Measurement_000/Channel_000'].create_dataset('Raw_Data', data=np.zeros((4, 3)))
+
+    def tearDown(self):
+        self.h5_file.close()
+        rmtree(self.folder)
+
+    def test_finds_existing_dataset(self):
+        found = getDataSet(self.h5_file, 'Raw_Data')
+        self.assertEqual([dset.name for dset in found], ['/Measurement_000/Channel_000/Raw_Data'])
+
+    def test_finds_dataset_written_with_h5py_after_lookup(self):
+        # the first lookup catalogs the file
+        self.assertEqual(len(getDataSet(self.h5_file, 'Raw_Data')), 1)
+        self.h5_file['Measurement_000/Channel_000'].create_dataset('Fit', data=np.ones(3))
+        self.h5_file['Measurement_000'].copy('Channel_000', 'Channel_001')
+
+        found = getDataSet(self.h5_file, 'Fit')
+        self.assertEqual([dset.name for dset in found], ['/Measurement_000/Channel_000/Fit',
+                                                         '/Measurement_000/Channel_001/Fit'])
+        found = getDataSet(self.h5_file['Measurement_000/Channel_001'], 'Raw_Data')
+        self.assertEqual([dset.name for dset in found], ['/Measurement_000/Channel_001/Raw_Data'])
+
+    def test_missing_dataset(self):
+        self.assertEqual(getDataSet(self.h5_file, 'Not_There'), [])
+
+
+class TestIndexedGroups(TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.h5_file = h5py.File(path.join(self.folder, 'test.h5'), 'w')
+        self.h5_main = self.h5_file.create_dataset('Raw', data=np.zeros((4, 3)))
+        self.hdf = ioHDF5(self.h5_file)
+
+    def tearDown(self):
+        self.h5_file.close()
+        rmtree(self.folder)
+
+    def __write_results(self):
+        grp = MicroDataGroup('Raw-SVD_')
+        grp.addChildren([MicroDataset('U', np.ones((4, 2)))])
+        return self.hdf.writeData(grp)[0].parent
+
+    def test_groups_written_with_h5py(self):
+        self.assertEqual(self.__write_results().name, '/Raw-SVD_000')
+        # the catalog of the file now exists and does not know of this group
+        self.h5_file.create_group('Raw-SVD_001')
+
+        h5_grp = self.__write_results()
+        self.assertEqual(h5_grp.name, '/Raw-SVD_002')
+        self.assertNotIn('U', self.h5_file['Raw-SVD_001'])
+        self.assertEqual([grp.name for grp in findH5group(self.h5_main, 'SVD')],
+                         ['/Raw-SVD_000', '/Raw-SVD_001', '/Raw-SVD_002'])
+
+    def test_groups_removed_with_h5py(self):
+        self.__write_results()
+        self.assertEqual(len(findH5group(self.h5_main, 'SVD')), 1)
+        del self.h5_file['Raw-SVD_000']
+        self.assertEqual(findH5group(self.h5_main, 'SVD'), [])
+
+
+class TestParmsHash(TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.h5_file = h5py.File(path.join(self.folder, 'test.h5'), 'w')
+        self.h5_main = self.h5_file.create_dataset('Raw_Data', data=np.random.rand(10, 7))
+        self.parms = {'num_comps': 4, 'method': 'sklearn'}
+
+    def tearDown(self):
+        self.h5_file.close()
+        rmtree(self.folder)
+
+    def __save_result(self):
+        h5_grp = self.h5_file.create_group('Raw_Data-SVD_000')
+        h5_grp.attrs['parms_hash'] = calcParmsHash(self.h5_main, 'SVD', self.parms)
+        return h5_grp
+
+    def test_identical_parms_and_data(self):
+        self.assertEqual(calcParmsHash(self.h5_main, 'SVD', self.parms),
+                         calcParmsHash(self.h5_main, 'SVD', dict(self.parms)))
+        h5_grp = self.__save_result()
+        parms_hash = calcParmsHash(self.h5_main, 'SVD', self.parms)
+        self.assertEqual(findIdenticalResult(self.h5_main, 'SVD', parms_hash), h5_grp)
+
+    def test_different_parms(self):
+        self.__save_result()
+        parms_hash = calcParmsHash(self.h5_main, 'SVD', {'num_comps': 5, 'method': 'sklearn'})
+        self.assertIsNone(findIdenticalResult(self.h5_main, 'SVD', parms_hash))
+
+    def test_random_state_hashed_by_state(self):
+        parms = [dict(self.parms, random_state=np.random.RandomState(seed)) for seed in [0, 0, 1]]
+        hashes = [calcParmsHash(self.h5_main, 'SVD', parm_dict) for parm_dict in parms]
+        self.assertEqual(hashes[0], hashes[1])
+        self.assertNotEqual(hashes[0], hashes[2])
+        self.assertEqual(_canonicalParms({'func': np.mean}), _canonicalParms({'func': np.mean}))
+        self.assertNotIn('0x', _canonicalParms(np.mean))
+
+    def test_recorded_edit_invalidates_result(self):
+        self.__save_result()
+        old_hash = calcParmsHash(self.h5_main, 'SVD', self.parms)
+        self.h5_main[3, 2] += 1
+        markModified(self.h5_main)
+        parms_hash = calcParmsHash(self.h5_main, 'SVD', self.parms)
+        self.assertNotEqual(parms_hash, old_hash)
+        self.assertIsNone(findIdenticalResult(self.h5_main, 'SVD', parms_hash))
+
+    def test_does_not_read_data(self):
+        # unrecorded edits are only caught by the optional checksum
+        old_hash = calcParmsHash(self.h5_main, 'SVD', self.parms)
+        old_checksum_hash = calcParmsHash(self.h5_main, 'SVD', self.parms, checksum=True)
+        self.h5_main[3, 2] += 1
+        self.assertEqual(calcParmsHash(self.h5_main, 'SVD', self.parms), old_hash)
+        self.assertNotEqual(calcParmsHash(self.h5_main, 'SVD', self.parms, checksum=True), old_checksum_hash)
+
+    def test_blockwise_checksum(self):
+        whole = _getSourceStamp(self.h5_main, checksum=True)
+        self.assertEqual(_getSourceStamp(self.h5_main, checksum=True, max_block_bytes=1), whole)
+        self.assertEqual(_getSourceStamp(self.h5_main, checksum=True, max_block_bytes=3 * 7 * 8), whole)
+        self.assertNotIn('checksum', _getSourceStamp(self.h5_main))
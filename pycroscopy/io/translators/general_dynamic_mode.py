@@ -8,6 +8,7 @@ Created on Fri Mar 04 11:12:45 2016
 from __future__ import print_function, division # int/int = float
 
 from os import path, remove# File Path formatting
+from multiprocessing import Pool
 
 import numpy as np # For array operations
 from scipy.io.matlab import loadmat # To load parameters stored in Matlab .mat file
@@ -17,6 +18,7 @@ from .translator import Translator # Because this class extends the abstract Tra
 from .utils import makePositionMat, getPositionSlicing, generateDummyMainParms
 from ..hdf_utils import getH5DsetRefs, linkRefs
 from ..io_hdf5 import ioHDF5 # Now the translator is responsible for writing the data.
+from ..io_utils import recommendCores
 from ..microdata import MicroDataGroup, MicroDataset # The building blocks for defining heirarchical storage in the H5 file
 
 
@@ -25,14 +27,21 @@ class GDMTranslator(Translator):
     Translates G-mode w^2 datasets from .mat files to .h5
     """
     
-    def translate(self, parm_path):
+    def translate(self, parm_path, num_cores=None):
         """
         Basic method that translates .mat data files to a single .h5 file
         
+        The per-pixel .mat files are loaded one grid row at a time by a pool of workers 
+        and each completed row is written to Raw_Data in a single write. Pixels whose 
+        files could not be found are flagged in the Missing_Pixels dataset.
+        
         Parameters
         ------------
         parm_path : string / unicode
             Absolute file path of the parameters .mat file. 
+        num_cores : unsigned int (Optional. Default = None)
+            Number of processes used to read the pixel files. 
+            All but two of the available cores are used by default. Set to 1 to read serially.
             
         Returns
         ----------
@@ -98,10 +107,13 @@ class GDMTranslator(Translator):
         # For some reason, compression is more effective on time series data
         ds_main_data = MicroDataset('Raw_Data', data=[], maxshape=(num_pix, len(freq_array)*num_bins), dtype=np.float32, chunking=(1,num_bins), compression='gzip')
         
+        # Flags pixels whose data files were not found
+        ds_missing = MicroDataset('Missing_Pixels', np.zeros(num_pix, dtype=np.bool_))
+        
         chan_grp = MicroDataGroup('Channel_000')		
         chan_grp.attrs = parm_dict        
         chan_grp.addChildren([ds_pos_ind, ds_pos_val, ds_spec_inds, ds_spec_vals, 
-								ds_ex_freqs, ds_bin_freq, ds_main_data])
+								ds_ex_freqs, ds_bin_freq, ds_main_data, ds_missing])
         meas_grp = MicroDataGroup('Measurement_000')
         meas_grp.addChildren([chan_grp])
         
@@ -125,7 +137,7 @@ class GDMTranslator(Translator):
         
         h5_refs = hdf.writeData(spm_data)
                     
-        h5_main = getH5DsetRefs(['Raw_Data'], h5_refs)[0]
+        h5_main, h5_missing = getH5DsetRefs(['Raw_Data', 'Missing_Pixels'], h5_refs)
             
         #Now doing linkrefs:
         aux_ds_names = ['Position_Indices','Position_Values',
@@ -133,28 +145,68 @@ class GDMTranslator(Translator):
                      'Excitation_Frequencies', 'Bin_Frequencies']
         linkRefs(h5_main, getH5DsetRefs(aux_ds_names, h5_refs))
 
-        # Now read the raw data files:
-        pos_ind = 0
-        for row_ind in xrange(1,num_rows+1):
-            for col_ind in xrange(1,num_cols+1):
-                file_path = path.join(folder_path,'fSweep_r'+str(row_ind)+'_c'+str(col_ind)+'.mat')
-                print('Working on row {} col {}'.format(row_ind,col_ind))
-                if path.exists(file_path):
-                    # Load data file
-                    pix_data = loadmat(file_path, squeeze_me=True)
-                    pix_mat = pix_data['AI_mat']
-                    # Take the inverse FFT on 2nd dimension
-                    pix_mat = np.fft.ifft(np.fft.ifftshift(pix_mat,axes=1), axis=1)
-                    # Verified with Matlab - no conjugate required here.
-                    pix_vec = pix_mat.transpose().reshape(pix_mat.size)
-                    h5_main[pos_ind,:] = np.float32(pix_vec)
-                    hdf.flush() # flush from memory!
-                else:
-                    print('File not found for: row {} col {}'.format(row_ind,col_ind))
-                pos_ind +=1
-                if (100.0*(pos_ind)/num_pix)%10 == 0:
-                    print('completed translating {} %'.format(int(100*pos_ind/num_pix)))
-                    
+        # Now read the raw data files, one row of the grid at a time:
+        num_cores = recommendCores(num_rows, requested_cores=num_cores)
+        tasks = [(folder_path, row_ind, num_cols, len(freq_array)*num_bins) for row_ind in range(num_rows)]
+        if num_cores > 1:
+            pool = Pool(processes=num_cores)
+            row_iter = pool.imap(_readPixelRow, tasks)
+        else:
+            pool = None
+            row_iter = (_readPixelRow(task) for task in tasks)
+
+        try:
+            for row_ind, (row_mat, missing) in enumerate(row_iter):
+                pix_slice = slice(row_ind*num_cols, (row_ind+1)*num_cols)
+                h5_main[pix_slice, :] = row_mat
+                h5_missing[pix_slice] = missing
+                hdf.flush() # flush from memory!
+                for col_ind in np.where(missing)[0]:
+                    print('File not found for: row {} col {}'.format(row_ind+1, col_ind+1))
+                if int(10*(row_ind+1)/num_rows) > int(10*row_ind/num_rows):
+                    print('completed translating {} %'.format(int(100*(row_ind+1)/num_rows)))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        h5_main.attrs['num_missing_pixels'] = int(np.sum(h5_missing[()]))
         hdf.close()
         
-        return h5_path
\ No newline at end of file
+        return h5_path
+
+
+def _readPixelRow(task):
+    """
+    Loads and converts the .mat files of all pixels in one row of the grid
+    
+    Parameters
+    ------------
+    task : tuple
+        (folder_path, row_ind, num_cols, num_spec) - folder containing the fSweep files, 
+        zero based row index, number of columns in the grid and number of spectral points per pixel
+        
+    Returns
+    ----------
+    row_mat : 2D numpy float32 array
+        Time-domain data of each pixel in the row arranged as [column, spectral]. 
+        Rows for missing pixels are left as zeros.
+    missing : 1D numpy bool array
+        True for the columns whose data file was not found
+    """
+    folder_path, row_ind, num_cols, num_spec = task
+    row_mat = np.zeros((num_cols, num_spec), dtype=np.float32)
+    missing = np.ones(num_cols, dtype=np.bool_)
+    for col_ind in range(num_cols):
+        file_path = path.join(folder_path, 'fSweep_r'+str(row_ind+1)+'_c'+str(col_ind+1)+'.mat')
+        if not path.exists(file_path):
+            continue
+        # Load data file
+        pix_mat = loadmat(file_path, squeeze_me=True)['AI_mat']
+        # Take the inverse FFT on 2nd dimension
+        pix_mat = np.fft.ifft(np.fft.ifftshift(pix_mat, axes=1), axis=1)
+        # Verified with Matlab - no conjugate required here.
+        pix_vec = pix_mat.transpose().reshape(pix_mat.size)
+        row_mat[col_ind] = np.real(pix_vec)
+        missing[col_ind] = False
+    return row_mat, missing
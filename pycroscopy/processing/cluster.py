@@ -9,10 +9,11 @@ import sklearn.cluster as cls
 from scipy.cluster.hierarchy import linkage
 from scipy.spatial.distance import pdist
 
+from ..io.be_hdf_utils import maxReadPixels
 from ..io.hdf_utils import checkIfMain
-from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary
+from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary, calcParmsHash, findIdenticalResult, markModified
 from ..io.io_hdf5 import ioHDF5
-from ..io.io_utils import check_dtype, transformToTargetType
+from ..io.io_utils import check_dtype, transformToTargetType, getAvailableMem
 from ..io.microdata import MicroDataGroup, MicroDataset
 
 
@@ -51,6 +52,7 @@ class Cluster(object):
         # Instantiate the clustering object
         self.estimator = cls.__dict__[method_name].__call__(*args, **kwargs)
         self.method_name = method_name
+        self.parms_hash = None
 
         if num_comps is None:
             self.num_comps = self.h5_main.shape[1]
@@ -59,11 +61,14 @@ class Cluster(object):
         self.data_slice = (slice(None), slice(0, num_comps))
 
         # figure out the operation that needs need to be performed to convert to real scalar
-        retval = check_dtype(h5_main)
+        retval = check_dtype(h5_main, interleaved=True)
         self.data_transform_func, self.data_is_complex, self.data_is_compound, \
         self.data_n_features, self.data_n_samples, self.data_type_mult = retval
 
-    def do_cluster(self, rearrange_clusters=True):
+        # Maximum memory that blocks of data read from the file may occupy
+        self.max_mem = min(1024 ** 3, 0.75 * getAvailableMem())
+
+    def do_cluster(self, rearrange_clusters=True, force=False, streaming=None, allow_in_memory=False):
         """
         Clusters the hdf5 dataset, calculates mean response for each cluster, and writes the labels and mean response
         back to the h5 file
@@ -72,12 +77,38 @@ class Cluster(object):
         ----------
         rearrange_clusters : (Optional) Boolean. Default = True
             Whether or not the clusters should be re-ordered by relative distances between the mean response
+        force : (Optional) Boolean. Default = False
+            Whether or not to cluster even if the results of clustering with the same parameters
+            on this dataset already exist in the file
+        streaming : (Optional) Boolean. Default = None
+            Whether or not the estimator should be fit via partial_fit on one block of the dataset at a time instead
+            of loading the entire dataset. The labels are then predicted and written one block at a time as well.
+            By default, datasets that do not fit in memory are streamed if the estimator supports partial_fit
+        allow_in_memory : (Optional) Boolean. Default = False
+            Whether or not the entire dataset may be loaded even if the estimated memory needed exceeds the
+            available memory. Only relevant when not streaming
 
         Returns
         --------
         h5_group : HDF5 Group reference
             Reference to the group that contains the clustering results
         """
+        # The requested mode is hashed rather than the one chosen based on the free memory
+        self.parms_hash = calcParmsHash(self.h5_main, 'Cluster',
+                                        {'cluster_algorithm': self.method_name, 'components_used': self.num_comps,
+                                         'rearrange_clusters': rearrange_clusters, 'streaming': streaming,
+                                         'estimator': self.estimator.get_params()})
+        if not force:
+            h5_group = findIdenticalResult(self.h5_main, 'Cluster', self.parms_hash)
+            if h5_group is not None:
+                print('Returning existing clustering results in {}. Use force=True to recompute'.format(h5_group.name))
+                return h5_group
+
+        streaming = self._check_streaming(streaming, allow_in_memory)
+
+        if streaming:
+            return self._stream_cluster(rearrange_clusters)
+
         self._fit()
         new_mean_response = self._get_mean_response(self.results.labels_)
         new_labels = self.results.labels_
@@ -85,6 +116,58 @@ class Cluster(object):
             new_labels, new_mean_response = reorder_clusters(self.results.labels_, new_mean_response)
         return self._write_to_hdf5(new_labels, new_mean_response)
 
+    def _check_streaming(self, streaming, allow_in_memory):
+        """
+        Decides whether or not the dataset should be streamed and ensures that datasets which will be loaded entirely
+        are expected to fit in memory
+
+        Parameters
+        ----------
+        streaming : Boolean or None
+            Requested mode. None lets the size of the dataset decide
+        allow_in_memory : Boolean
+            Whether or not to load the dataset even if the estimated memory needed exceeds the available memory
+
+        Returns
+        -------
+        streaming : Boolean
+            Whether or not the dataset will be streamed
+        """
+        can_stream = hasattr(self.estimator, 'partial_fit')
+        if streaming and not can_stream:
+            raise TypeError('{} does not support partial_fit and cannot be used in streaming mode'.format(
+                self.method_name))
+
+        # The raw data, its real valued version and the copy made by the estimator
+        mem_needed = self.h5_main.shape[0] * self.num_comps * (self.h5_main.dtype.itemsize +
+                                                               2 * self.data_type_mult)
+        mem_available = 0.75 * getAvailableMem()
+        if streaming is None:
+            streaming = can_stream and mem_needed > mem_available
+
+        if not streaming and mem_needed > mem_available and not allow_in_memory:
+            raise MemoryError('Clustering {} in memory needs about {} MB but only {} MB are available. Use an '
+                              'estimator that supports partial_fit such as MiniBatchKMeans or Birch, or set '
+                              'allow_in_memory=True'.format(self.h5_main.name, int(mem_needed / 1024 ** 2),
+                                                            int(mem_available / 1024 ** 2)))
+        return streaming
+
+    def _read_blocks(self):
+        """
+        Reads the dataset one block of contiguous rows at a time
+
+        Returns
+        -------
+        generator of (start, stop, data_block)
+            Rows start to stop of the dataset converted to real values
+        """
+        rows_per_block = int(maxReadPixels(self.max_mem, self.h5_main.shape[0], self.num_comps,
+                                           bytes_per_bin=self.h5_main.dtype.itemsize + 2 * self.data_type_mult))
+        for start in range(0, self.h5_main.shape[0], rows_per_block):
+            stop = min(start + rows_per_block, self.h5_main.shape[0])
+            # transform to real from whatever type it was
+            yield start, stop, self.data_transform_func(self.h5_main[start:stop, self.data_slice[1]])
+
     def _fit(self):
         """
         Fits the provided dataset
@@ -97,9 +180,62 @@ class Cluster(object):
         # perform fit on the real dataset
         self.results = self.estimator.fit(self.data_transform_func(self.h5_main[self.data_slice]))
 
+    def _stream_cluster(self, rearrange_clusters):
+        """
+        Fits the estimator one block of the dataset at a time, then predicts the labels and accumulates the mean
+        response in a second pass while writing the labels to the file
+
+        Parameters
+        ----------
+        rearrange_clusters : Boolean
+            Whether or not the clusters should be re-ordered by relative distances between the mean response
+
+        Returns
+        --------
+        h5_group : HDF5 Group reference
+            Reference to the group that contains the clustering results
+        """
+        print('Performing clustering on {} one block at a time.'.format(self.h5_main.name))
+        for _, _, data_block in self._read_blocks():
+            self.estimator.partial_fit(data_block)
+        self.results = self.estimator
+
+        if hasattr(self.estimator, 'cluster_centers_'):
+            num_clusts = self.estimator.cluster_centers_.shape[0]
+        else:
+            # Birch
+            num_clusts = int(np.max(self.estimator.subcluster_labels_)) + 1
+
+        h5_labels, h5_centroids = self._create_results_group(num_clusts)
+
+        counts = np.zeros(shape=num_clusts, dtype=np.int64)
+        sums = None
+        for start, stop, data_block in self._read_blocks():
+            labels = self.estimator.predict(data_block)
+            h5_labels[0, start:stop] = labels
+            if sums is None:
+                sums = np.zeros(shape=(num_clusts, data_block.shape[1]), dtype=np.float64)
+            np.add.at(sums, labels, data_block)
+            counts += np.bincount(labels, minlength=num_clusts)
+        mean_resp = self._to_mean_response(sums, counts)
+
+        if rearrange_clusters:
+            label_lookup, mean_resp = reorder_clusters(np.arange(num_clusts), mean_resp)
+            rows_per_block = int(maxReadPixels(self.max_mem, h5_labels.shape[1], 1))
+            for start in range(0, h5_labels.shape[1], rows_per_block):
+                stop = min(start + rows_per_block, h5_labels.shape[1])
+                h5_labels[0, start:stop] = label_lookup[np.int64(h5_labels[0, start:stop])]
+
+        h5_centroids[:] = mean_resp
+        markModified(h5_labels)
+        markModified(h5_centroids)
+        h5_centroids.file.flush()
+
+        return h5_labels.parent
+
     def _get_mean_response(self, labels):
         """
-        Gets the mean response for each cluster
+        Gets the mean response for each cluster in a single sequential pass over the dataset
 
         Parameters
         -------------
@@ -111,18 +247,40 @@ class Cluster(object):
         mean_resp : 2D numpy array
             Array of the mean response for each cluster arranged as [cluster number, response]
         """
-        print('Calculated the Mean Response of each cluster.')
         num_clusts = len(np.unique(labels))
-        mean_resp = np.zeros(shape=(num_clusts, self.num_comps), dtype=self.h5_main.dtype)
-        for clust_ind in range(num_clusts):
-            # get all pixels with this label
-            targ_pos = np.where(labels == clust_ind)[0]
-            # slice to get the responses for all these pixels, ensure that it's 2d
-            data_chunk = np.atleast_2d(self.h5_main[targ_pos, self.data_slice[1]])
-            # transform to real from whatever type it was
-            avg_data = np.mean(self.data_transform_func(data_chunk), axis=0, keepdims=True)
-            # transform back to the source data type and insert into the mean response
-            mean_resp[clust_ind] = transformToTargetType(avg_data, self.h5_main.dtype)
+
+        # accumulate the sums of the real valued responses and the number of pixels for each label
+        counts = np.bincount(labels, minlength=num_clusts)[:num_clusts]
+        sums = None
+        for start, stop, data_block in self._read_blocks():
+            if sums is None:
+                sums = np.zeros(shape=(num_clusts, data_block.shape[1]), dtype=np.float64)
+            np.add.at(sums, labels[start:stop], data_block)
+
+        print('Calculated the Mean Response of each cluster.')
+        return self._to_mean_response(sums, counts)
+
+    def _to_mean_response(self, sums, counts):
+        """
+        Converts the accumulated sums of the real valued responses of each cluster to mean responses
+
+        Parameters
+        ----------
+        sums : 2D numpy array
+            Sum of the real valued responses arranged as [cluster number, real valued response]
+        counts : 1D numpy array
+            Number of pixels in each cluster
+
+        Returns
+        ---------
+        mean_resp : 2D numpy array
+            Array of the mean response for each cluster arranged as [cluster number, response]
+        """
+        avg_data = sums / np.maximum(counts, 1)[:, np.newaxis]
+
+        # transform back to the source data type
+        mean_resp = np.zeros(shape=(sums.shape[0], self.num_comps), dtype=self.h5_main.dtype)
+        mean_resp[:] = transformToTargetType(avg_data, self.h5_main.dtype, interleaved=True)
         return mean_resp
 
     def _write_to_hdf5(self, labels, mean_response):
@@ -141,14 +299,41 @@ class Cluster(object):
         h5_labels : HDF5 Group reference
             Reference to the group that contains the clustering results
         """
+        h5_labels, h5_centroids = self._create_results_group(mean_response.shape[0])
+        h5_labels[:] = np.float32(np.atleast_2d(labels))
+        h5_centroids[:] = mean_response
+        markModified(h5_labels)
+        markModified(h5_centroids)
+        h5_labels.file.flush()
+
+        # return the h5 group object
+        return h5_labels.parent
+
+    def _create_results_group(self, num_clusters):
+        """
+        Creates the group that will hold the clustering results with space allocated for the labels and mean
+        response, and links the ancillary datasets
+
+        Parameters
+        ------------
+        num_clusters : unsigned int
+            Number of clusters
+
+        Returns
+        ---------
+        h5_labels : HDF5 Dataset reference
+            Empty dataset for the labels arranged as [1, position]
+        h5_centroids : HDF5 Dataset reference
+            Empty dataset for the mean response arranged as [cluster number, response]
+        """
         print('Writing clustering results to file.')
-        num_clusters = mean_response.shape[0]
-        ds_label_mat = MicroDataset('Labels', np.float32(np.atleast_2d(labels)), dtype=np.float32)
+        ds_label_mat = MicroDataset('Labels', data=[], dtype=np.float32, maxshape=(1, self.h5_main.shape[0]))
         clust_ind_mat = np.transpose(np.atleast_2d(np.arange(num_clusters)))
 
         ds_cluster_inds = MicroDataset('Cluster_Indices', np.uint32(clust_ind_mat))
         ds_cluster_vals = MicroDataset('Cluster_Values', np.float32(clust_ind_mat))
-        ds_cluster_centroids = MicroDataset('Mean_Response', mean_response, dtype=mean_response.dtype)
+        ds_cluster_centroids = MicroDataset('Mean_Response', data=[], dtype=self.h5_main.dtype,
+                                            maxshape=(num_clusters, self.num_comps))
         ds_label_inds = MicroDataset('Label_Spectroscopic_Indices', np.atleast_2d([0]), dtype=np.uint32)
         ds_label_vals = MicroDataset('Label_Spectroscopic_Values', np.atleast_2d([0]), dtype=np.float32)
 
@@ -166,6 +351,8 @@ class Cluster(object):
         cluster_grp.attrs['num_clusters'] = num_clusters
         cluster_grp.attrs['num_samples'] = self.h5_main.shape[0]
         cluster_grp.attrs['cluster_algorithm'] = self.method_name
+        if self.parms_hash is not None:
+            cluster_grp.attrs['parms_hash'] = self.parms_hash
         if self.num_comps is not None:
             cluster_grp.attrs['components_used'] = self.num_comps
 
@@ -206,8 +393,7 @@ class Cluster(object):
                               ['Position_Indices', 'Position_Values'],
                               anc_refs=[h5_clust_inds, h5_clust_vals])
 
-        # return the h5 group object
-        return h5_labels.parent
+        return h5_labels, h5_centroids
 
 
 def reorder_clusters(labels, mean_response):
@@ -235,20 +421,14 @@ def reorder_clusters(labels, mean_response):
     # get hierarchical pairings of clusters
     linkage_pairing = linkage(distance_mat, 'weighted')
 
-    # get the new order - this has been checked to be OK
-    new_cluster_order = []
-    for row in range(linkage_pairing.shape[0]):
-        for col in range(2):
-            if linkage_pairing[row, col] < num_clusters:
-                new_cluster_order.append(int(linkage_pairing[row, col]))
-
-    # Now that we know the order, rearrange the clusters and labels:
-    new_labels = np.zeros(shape=labels.shape, dtype=labels.dtype)
-    new_mean_response = np.zeros(shape=mean_response.shape, dtype=mean_response.dtype)
-
-    # Reorder clusters
-    for old_clust_ind, new_clust_ind in enumerate(new_cluster_order):
-        new_labels[np.where(labels == new_clust_ind)[0]] = old_clust_ind
-        new_mean_response[old_clust_ind] = mean_response[new_clust_ind]
+    # get the new order - the leaves (original clusters) in the order in which they are paired
+    leaves = linkage_pairing[:, :2].ravel()
+    new_cluster_order = np.int64(leaves[leaves < num_clusters])
+
+    # Now that we know the order, rearrange the clusters and relabel via a lookup table:
+    label_lookup = np.zeros(shape=num_clusters, dtype=labels.dtype)
+    label_lookup[new_cluster_order] = np.arange(num_clusters)
+    new_labels = label_lookup[labels]
+    new_mean_response = mean_response[new_cluster_order]
 
     return new_labels, new_mean_response
@@ -4,14 +4,18 @@ Created on Tue Jan 05 07:55:56 2016
 
 @author: Suhas Somnath, Chris Smith
 """
+from warnings import warn
+
 import h5py
 import numpy as np
 import sklearn.decomposition as dec
+from sklearn.utils import check_random_state
 
+from ..io.be_hdf_utils import maxReadPixels
 from ..io.hdf_utils import checkIfMain
-from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary
+from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary, calcParmsHash, findIdenticalResult, markModified
 from ..io.io_hdf5 import ioHDF5
-from ..io.io_utils import check_dtype, transformToTargetType
+from ..io.io_utils import check_dtype, transformToTargetType, getAvailableMem
 from ..io.microdata import MicroDataGroup, MicroDataset
 
 
@@ -40,13 +44,13 @@ class Decomposition(object):
 
         allowed_methods = ['FactorAnalysis','FastICA','IncrementalPCA',
                            'MiniBatchSparsePCA','NMF','PCA','RandomizedPCA',
-                           'SparsePCA','TruncatedSVD']
+                           'SparsePCA','TruncatedSVD', 'MiniBatchNMF', 'MiniBatchDictionaryLearning']
 
         # check if h5_main is a valid object - is it a hub?
         if not checkIfMain(h5_main):
             raise TypeError('Supplied dataset is not a pycroscopy main dataset')
 
-        if method_name not in allowed_methods:
+        if method_name not in allowed_methods or method_name not in dec.__dict__:
             raise TypeError('Cannot work with {} just yet'.format(method_name))
 
         self.h5_main = h5_main
@@ -54,82 +58,212 @@ class Decomposition(object):
         # Instantiate the decomposition object
         self.estimator = dec.__dict__[method_name].__call__(*args, **kwargs)
         self.method_name = method_name
+        self.parms_hash = None
 
         # figure out the operation that needs need to be performed to convert to real scalar
-        retval = check_dtype(h5_main)
+        retval = check_dtype(h5_main, interleaved=True)
         self.data_transform_func, self.data_is_complex, self.data_is_compound, \
         self.data_n_features, self.data_n_samples, self.data_type_mult = retval
 
-    def doDecomposition(self):
+        # Maximum memory that blocks of data read from the file may occupy
+        self.max_mem = min(1024 ** 3, 0.75 * getAvailableMem())
+        self.projection = None
+
+    def doDecomposition(self, force=False, streaming=None, num_fit_samples=None, random_state=None):
         """
-        Decomposes the hdf5 dataset, and writes the ? back to the hdf5 file
+        Decomposes the hdf5 dataset, and writes the components and the projection back to the hdf5 file
+
+        The projection is computed and written one block of the dataset at a time. The estimator is fit either via
+        partial_fit on one block at a time, on a random subset of the rows or on the entire dataset.
+
+        Parameters
+        ----------
+        force : (Optional) Boolean. Default = False
+            Whether or not to decompose even if the results of the decomposition with the same parameters
+            on this dataset already exist in the file
+        streaming : (Optional) Boolean. Default = None
+            Whether or not to fit the estimator via partial_fit on one block of the dataset at a time.
+            By default, estimators that support partial_fit such as IncrementalPCA, MiniBatchNMF and
+            MiniBatchDictionaryLearning are streamed
+        num_fit_samples : (Optional) unsigned int. Default = None
+            Number of randomly chosen rows to fit the estimator to when not streaming. All rows are used by default
+        random_state : (Optional) int or numpy.random.RandomState. Default = None
+            Seed or random number generator for choosing the rows to fit to. A generator is hashed by its state
 
         Returns
         --------
         h5_group : HDF5 Group reference
             Reference to the group that contains the decomposition results
         """
-        self._fit()
-        self._transform()
-        return self._writeToHDF5(transformToTargetType(self.estimator.components_, self.h5_main.dtype),
-                                 self.projection)
+        can_stream = hasattr(self.estimator, 'partial_fit')
+        if streaming is None:
+            streaming = can_stream and num_fit_samples is None
+        elif streaming and not can_stream:
+            raise TypeError('{} does not support partial_fit and cannot be used in streaming mode'.format(
+                self.method_name))
+        if streaming or (num_fit_samples is not None and num_fit_samples >= self.h5_main.shape[0]):
+            num_fit_samples = None
+
+        self.parms_hash = calcParmsHash(self.h5_main, 'Decomposition',
+                                        {'decomposition_algorithm': self.method_name, 'streaming': streaming,
+                                         'num_fit_samples': num_fit_samples, 'random_state': random_state,
+                                         'estimator': self.estimator.get_params()})
+        if not force:
+            h5_group = findIdenticalResult(self.h5_main, 'Decomposition', self.parms_hash)
+            if h5_group is not None:
+                print('Returning existing decomposition results in {}. Use force=True to recompute'.format(
+                    h5_group.name))
+                return h5_group
+
+        self._fit(streaming=streaming, num_fit_samples=num_fit_samples, random_state=random_state)
+        h5_group = self._writeToHDF5(transformToTargetType(self.estimator.components_, self.h5_main.dtype,
+                                                           interleaved=True))
+        self._transform(h5_output=h5_group['Projection'])
+        return h5_group
+
+    def _toReal(self, data):
+        """
+        Converts data read from the file to real values. Magnitudes are used for NMF since it needs non-negative data
+
+        Parameters
+        ----------
+        data : 2D numpy array
+            Data arranged as [position, spectroscopic] in the datatype of the dataset
+
+        Returns
+        ------
+        data : 2D real numpy array
+            Data arranged as [position, real valued features]
+        """
+        if self.method_name in ['NMF', 'MiniBatchNMF']:
+            # cast back to the source datatype so that the features are laid out as for the other methods
+            data = np.abs(data).astype(data.dtype)
+        return self.data_transform_func(data)
+
+    def _readBlocks(self, h5_data=None, min_rows=1):
+        """
+        Reads the dataset one block of contiguous rows at a time
+
+        Parameters
+        ----------
+        h5_data : (Optional) HDF5 dataset
+            Dataset to read. Default = the main dataset
+        min_rows : (Optional) unsigned int. Default = 1
+            Minimum number of rows in each block
 
-    def _fit(self):
+        Returns
+        -------
+        generator of (start, stop, data_block)
+            Rows start to stop of the dataset converted to real values
+        """
+        if h5_data is None:
+            h5_data = self.h5_main
+        num_rows = h5_data.shape[0]
+        rows_per_block = int(maxReadPixels(self.max_mem, num_rows, h5_data.shape[1],
+                                           bytes_per_bin=h5_data.dtype.itemsize + 2 * self.data_type_mult))
+        rows_per_block = min(max(rows_per_block, min_rows), num_rows)
+        # blocks of nearly equal size so that the last block is not much smaller than the others.
+        # Fewer, larger blocks are used if necessary to ensure that every block has at least min_rows rows
+        num_blocks = max(1, min(int(np.ceil(num_rows / float(rows_per_block))), num_rows // max(min_rows, 1)))
+        bounds = np.linspace(0, num_rows, num_blocks + 1).astype(int)
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            yield start, stop, self._toReal(h5_data[start:stop])
+
+    def _fit(self, streaming=False, num_fit_samples=None, random_state=None):
         """
         Fits the provided dataset
 
+        Parameters
+        ----------
+        streaming : (Optional) Boolean. Default = False
+            Whether or not to fit via partial_fit on one block of the dataset at a time
+        num_fit_samples : (Optional) unsigned int. Default = None
+            Number of randomly chosen rows to fit to. All rows are used by default
+        random_state : (Optional) int or numpy.random.RandomState. Default = None
+            Seed or random number generator for choosing the rows to fit to. A generator is hashed by its state
+
         Returns
         ------
         None
         """
         # perform fit on the real dataset
-        if self.method_name=='NMF':
-            self.estimator.fit(self.data_transform_func(np.abs(self.h5_main)))
+        if streaming:
+            # some estimators such as IncrementalPCA need at least as many rows as components in each batch.
+            # Without n_components, IncrementalPCA keeps as many components as there are rows in the first batch,
+            # so each batch then needs as many rows as there are real valued features
+            min_rows = self.estimator.get_params().get('n_components') or self._toReal(self.h5_main[:1]).shape[1]
+            for _, _, data_block in self._readBlocks(min_rows=min_rows):
+                self.estimator.partial_fit(data_block)
+        elif num_fit_samples is not None:
+            fit_rows = np.sort(check_random_state(random_state).choice(self.h5_main.shape[0], num_fit_samples,
+                                                                     replace=False))
+            # the selected rows are picked out of sequentially read blocks rather than read via a scattered index
+            fit_data = []
+            for start, stop, data_block in self._readBlocks():
+                fit_data.append(data_block[fit_rows[np.logical_and(fit_rows >= start, fit_rows < stop)] - start])
+            self.estimator.fit(np.vstack(fit_data))
         else:
-            self.estimator.fit(self.data_transform_func(self.h5_main))
-        
-    def _transform(self, data=None):
+            self.estimator.fit(self._toReal(self.h5_main[()]))
+
+    def _transform(self, data=None, h5_output=None):
         """
-        Transforms the original OR provided dataset with previously computed fit
+        Transforms the original OR provided dataset with previously computed fit, one block of rows at a time
         
         Parameters
         --------
         data : (optional) HDF5 dataset
             Dataset to apply the transform to. 
             The number of elements in the first axis of this dataset should match that of the original dataset that was fitted
+        h5_output : (optional) HDF5 dataset
+            Dataset that the projection will be written to. If not provided, the projection is stored in
+            self.projection
 
         Returns
         ------
         None
         """
         if data is None:
-            if self.method_name=='NMF':
-                self.projection = self.estimator.transform(self.data_transform_func(np.abs(self.h5_main)))
+            data = self.h5_main
+        elif not isinstance(data, h5py.Dataset) or data.shape[0] != self.h5_main.shape[0]:
+            warn('data must be a HDF5 dataset with as many rows as the decomposed dataset')
+            return
+
+        if h5_output is None:
+            self.projection = np.zeros(shape=(data.shape[0], self.estimator.components_.shape[0]),
+                                       dtype=np.float32)
+        for start, stop, data_block in self._readBlocks(data):
+            projection = np.float32(self.estimator.transform(data_block))
+            if h5_output is None:
+                self.projection[start:stop] = projection
             else:
-                self.projection = self.estimator.transform(self.data_transform_func(self.h5_main))
-        else:
-            if isinstance(data, h5py.Dataset):
-                if data.shape[0] == self.h5_main.shape[0]:
-                    self.projection = self.estimator.transform(data)
+                h5_output[start:stop] = projection
+        if h5_output is not None:
+            markModified(h5_output)
+            h5_output.file.flush()
 
-    def _writeToHDF5(self, components, projection):
+    def _writeToHDF5(self, components, projection=None):
         """
-        Writes the labels and mean response to the h5 file
+        Writes the components and projection to the h5 file
 
         Parameters
         ------------
-        labels : 1D unsigned int array
-            Array of cluster labels as obtained from the fit
-        mean_response : 2D numpy array
-            Array of the mean response for each cluster arranged as [cluster number, response]
+        components : 2D numpy array
+            Components arranged as [component, spectroscopic] in the datatype of the dataset
+        projection : (Optional) 2D numpy array
+            Projection of the data onto the components arranged as [position, component].
+            If not provided, space is only allocated for the projection
 
         Returns
         ---------
-        h5_labels : HDF5 Group reference
-            Reference to the group that contains the clustering results
+        h5_group : HDF5 Group reference
+            Reference to the group that contains the decomposition results
         """
         ds_components = MicroDataset('Components', components)# equivalent to V         
-        ds_projections = MicroDataset('Projection', np.float32(projection)) # equivalent of U compound        
+        if projection is None:
+            ds_projections = MicroDataset('Projection', data=[], dtype=np.float32,
+                                          maxshape=(self.h5_main.shape[0], components.shape[0]))
+        else:
+            ds_projections = MicroDataset('Projection', np.float32(projection)) # equivalent of U compound
         
         decomp_ind_mat = np.transpose(np.atleast_2d(np.arange(components.shape[0])))
 
@@ -149,6 +283,8 @@ class Decomposition(object):
         decomp_grp.attrs['num_components'] = components.shape[0]
         decomp_grp.attrs['num_samples'] = self.h5_main.shape[0]
         decomp_grp.attrs['decomposition_algorithm'] = self.method_name
+        if self.parms_hash is not None:
+            decomp_grp.attrs['parms_hash'] = self.parms_hash
 
         '''
         Get the parameters of the estimator used and write them
@@ -161,7 +297,7 @@ class Decomposition(object):
         h5_decomp_refs = hdf.writeData(decomp_grp)
 
         h5_components = getH5DsetRefs(['Components'], h5_decomp_refs)[0]
-        h5_projections = getH5DsetRefs(['Mean_Response'], h5_decomp_refs)[0]
+        h5_projections = getH5DsetRefs(['Projection'], h5_decomp_refs)[0]
         h5_decomp_inds = getH5DsetRefs(['Decomposition_Indices'], h5_decomp_refs)[0]
         h5_decomp_vals = getH5DsetRefs(['Decomposition_Values'], h5_decomp_refs)[0]
 
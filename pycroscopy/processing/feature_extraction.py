@@ -11,6 +11,15 @@ import h5py
 import numpy as np
 import skimage.feature
 
+from ..io.hdf_utils import getH5DsetRefs, calcParmsHash, findIdenticalResult
+from ..io.io_hdf5 import ioHDF5
+from ..io.microdata import MicroDataGroup, MicroDataset
+
+try:
+    import multiprocess as mp
+except ImportError:
+    mp = None
+
 
 #TODO: Docstrings following numpy standard.
 
@@ -26,9 +35,102 @@ def pickle_keypoints(keypoints):
 
 
 
+def detectFeatures(image, detector, lib):
+    ''' Function that detects the keypoints in an image and extracts their descriptors.
+        Input:
+            image: (np.ndarray) 2D image.
+            detector: detector object. e.g. - skimage.feature.ORB()
+            lib: (string) computer vision library of the detector (opencv or skimage)
+        Output:
+            keypoints, descriptors
+    '''
+    if lib =='opencv':
+        image = (image - image.mean())/image.std()
+        image = image.astype('uint8')
+        k_obj, d_obj = detector.detectAndCompute(image, None)
+        keypts, descs = pickle_keypoints(k_obj), pickle_keypoints(d_obj)
+
+    elif lib == 'skimage':
+        imp = (image-image.mean())/np.std(image)
+        imp[imp < 0] = 0
+        imp.astype('float32')
+        detector.detect_and_extract(imp)
+        keypts, descs = detector.keypoints, detector.descriptors
+
+    return keypts, descs
+
+
+def _detectFrames(task):
+    ''' Function that reads a set of frames by index from an HDF5 file and detects their features.
+    Used by the FeatureExtractors so that each worker only ever reads the frames it processes.
+    '''
+    file_path, dset_name, indices, frame_shape, crop, detector, lib = task
+    results = []
+    with h5py.File(file_path, 'r') as h5_file:
+        dset = h5_file[dset_name]
+        for ind in indices:
+            image = dset[ind].reshape(frame_shape)
+            if crop is not None:
+                image = image[crop]
+            results.append(detectFeatures(image, detector, lib))
+    return results
+
+
+def _cropWindow(origin, winSize):
+    ''' Function that returns the slices of the square window of size winSize centered at origin.
+    '''
+    return (slice(origin[0] - winSize//2, origin[0] + winSize//2),
+            slice(origin[1] - winSize//2, origin[1] + winSize//2))
+
+
+def readFeatures(h5_features):
+    ''' Function that reads the keypoints and descriptors written by a FeatureExtractor.
+        Input:
+            h5_features: (h5py.Group) group containing the Keypoints, Descriptors and Offsets datasets.
+        Output:
+            keypoints, descriptors: lists with the keypoints and descriptors of each frame.
+    '''
+    offsets = h5_features['Offsets'][()]
+    keypts = h5_features['Keypoints'][()]
+    descs = h5_features['Descriptors'][()]
+
+    keypts = [keypts[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+    descs = [descs[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+    return keypts, descs
+
+
+def _writeFeatures(h5_main, keypts, desc, attrs):
+    ''' Function that writes the keypoints and descriptors of every frame to a new group next to h5_main.
+    Features of all frames are concatenated, Offsets[i]:Offsets[i+1] selects the features of frame i.
+    '''
+    counts = [len(itm) for itm in keypts]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+
+    desc_len = max([itm.shape[1] for itm in desc if np.ndim(itm) == 2] + [0])
+    desc_type = desc[0].dtype if len(desc) > 0 else np.float32
+    all_keypts = np.concatenate([np.reshape(itm, (-1, 2)) for itm in keypts] + [np.zeros((0, 2), dtype=np.int64)])
+    all_desc = np.concatenate([np.reshape(itm, (-1, desc_len)) for itm in desc] +
+                              [np.zeros((0, desc_len), dtype=desc_type)])
+
+    ds_keypts = MicroDataset('Keypoints', data=all_keypts.astype(np.int64))
+    ds_desc = MicroDataset('Descriptors', data=all_desc)
+    ds_offsets = MicroDataset('Offsets', data=offsets)
+
+    feat_grp = MicroDataGroup(h5_main.name.split('/')[-1] + '-Features_', h5_main.parent.name[1:])
+    feat_grp.addChildren([ds_keypts, ds_desc, ds_offsets])
+    feat_grp.attrs.update(attrs)
+    feat_grp.attrs['num_frames'] = len(keypts)
+
+    hdf = ioHDF5(h5_main.file)
+    h5_refs = hdf.writeData(feat_grp)
+    hdf.flush()
+
+    return getH5DsetRefs(['Keypoints'], h5_refs)[0].parent
+
+
 # Class to do feature extraction. This is a wrapper on scikit-image and openCV feature extraction detectors.
 #TODO: Add support for opencV or implement sift.
-#TODO: Add io operations for extracted features.
 #TODO: Memory checking, since some of the features are quite large.
 
 class FeatureExtractorParallel(object):
@@ -38,6 +140,7 @@ class FeatureExtractorParallel(object):
         Input:
             name: (string) name of detector.
             lib: (string) computer vision library to use (opencv or skimage)
+            **detector_args: keyword arguments used to create the detector. e.g. - n_keypoints = 500
             The following can be used for:
             lib = opencv:
                 SIFT
@@ -50,33 +153,41 @@ class FeatureExtractorParallel(object):
                 CENSURE
                 ...
     '''
-    def __init__(self, detector_name, lib):
+    def __init__(self, detector_name, lib, **detector_args):
         self.data = []
+        self.frame_shape = None
         self.lib = lib
+        self.detector_name = detector_name
+        self.detector_args = detector_args
 
         try:
             if self.lib == 'opencv':
                 pass
     #                detector = cv2.__getattribute__(detector_name)
             elif self.lib == 'skimage':
-                self.detector = skimage.feature.__getattribute__(detector_name)
+                self.detector = skimage.feature.__getattribute__(detector_name)(**detector_args)
         except AttributeError:
             print('Error: The Library does not contain the specified detector')
 
     def clearData(self):
         del self.data
         self.data = []
+        self.frame_shape = None
 
     def loadData(self, dataset):
         ''' This is a Method that loads h5 Dataset to be corrected.
+        Frames are only read from the dataset when their features are extracted.
             input: h5 dataset
         '''
         if not isinstance(dataset, h5py.Dataset):
             warnings.warn('Error: Data must be an h5 Dataset object')
         else:
             self.data = dataset
-            dim = int(np.sqrt(self.data.shape[-1]))
-            self.data = self.data.reshape(-1,dim,dim)
+            if len(dataset.shape) == 3:
+                self.frame_shape = dataset.shape[1:]
+            else:
+                dim = int(np.sqrt(self.data.shape[-1]))
+                self.frame_shape = (dim, dim)
 
     def getData(self):
         ''' This is a Method that returns the loaded h5 Dataset.
@@ -84,14 +195,31 @@ class FeatureExtractorParallel(object):
         '''
         return self.data
 
+    def _featureParms(self, mask, origin, winSize):
+        ''' Parameters that define the extracted features, used to find identical features in the file.
+        '''
+        return {'detector': self.detector_name, 'lib': self.lib, 'detector_parms': self.detector_args,
+                'mask': bool(mask), 'origin': list(origin), 'window_size': winSize}
+
     def getFeatures(self, **kwargs):
         ''' This is a Method that returns features (keypoints and descriptors)
             that are obtained by using the FeatureExtractor.Detector object.
+            Each worker reads the frames it processes directly from the file.
+            Features are written to a group next to the dataset and are read back,
+            instead of being detected again, when requested with the same parameters.
             input:
                 processors: int, optional
                             Number of processors to use, default = 1.
                 mask: boolean, optional, default False.
-                    Whether to use
+                    Whether to only use a window of each frame.
+                origin: [int, int], optional, default [0, 0].
+                    Center of the window.
+                window_size: int, optional, default 0.
+                    Size of the window.
+                save: boolean, optional, default True unless the file is read-only.
+                    Whether to write the features to the file.
+                force: boolean, optional, default False.
+                    Detect the features even if identical features are already in the file.
             output: keypoints, descriptors
         '''
         detector = self.detector
@@ -101,45 +229,44 @@ class FeatureExtractorParallel(object):
         mask = kwargs.get('mask', False)
         origin = kwargs.get('origin',[0,0])
         winSize= kwargs.get('window_size', 0)
+        save = kwargs.get('save', dset.file.mode != 'r')
+        force = kwargs.get('force', False)
+        if save and dset.file.mode == 'r':
+            warnings.warn('{} is opened read-only. Features will not be saved'.format(dset.file.filename))
+            save = False
+
+        parms = self._featureParms(mask, origin, winSize)
+        parms_hash = calcParmsHash(dset, 'Features', parms)
+        if not force:
+            h5_features = findIdenticalResult(dset, 'Features', parms_hash)
+            if h5_features is not None:
+                print('Reading existing features from {}. Use force=True to detect them again'.format(h5_features.name))
+                return readFeatures(h5_features)
+
+        crop = _cropWindow(origin, winSize) if mask else None
 
-        if mask:
-            def mask_func(x, winSize):
-                x[origin[0]- winSize/2: origin[0]+ winSize/2, origin[1]- winSize/2: origin[1]+ winSize/2] = 2
-                x = x - 1
-                return x
-            mask_ind = np.mask_indices(dset.shape[-1], mask_func, winSize)
-            self.data = np.array([ imp[mask_ind].reshape(winSize, winSize) for imp in dset])
-
-        # detect and compute keypoints
-        def detect(image):
-            if lib =='opencv':
-                image = (image - image.mean())/image.std()
-                image = image.astype('uint8')
-                k_obj, d_obj = detector.detectAndCompute(image, None)
-                keypts, descs = pickle_keypoints(k_obj), pickle_keypoints(d_obj)
-
-            elif lib == 'skimage':
-                imp = (image-image.mean())/np.std(image)
-                imp[imp < 0] = 0
-                imp.astype('float32')
-                detector.detect_and_extract(imp)
-                keypts, descs = detector.keypoints, detector.descriptors
-
-            return keypts, descs
+        # make sure the workers see everything written to the file so far
+        dset.file.flush()
 
         # start pool of workers
-        print('launching %i kernels...'%(processes))
-        pool = multiProcess.Pool(processes)
-        tasks = [(imp) for imp in self.data]
-        chunk = int(self.data.shape[0]/processes)
-        jobs = pool.imap(detect, tasks, chunksize = chunk)
+        num_frames = dset.shape[0]
+        chunk = int(max(1, np.ceil(float(num_frames) / (4 * processes))))
+        tasks = [(dset.file.filename, dset.name, range(start, min(start + chunk, num_frames)),
+                  self.frame_shape, crop, detector, lib) for start in range(0, num_frames, chunk)]
+        if processes > 1 and mp is not None:
+            print('launching %i kernels...'%(processes))
+            pool = mp.Pool(processes)
+            jobs = pool.imap(_detectFrames, tasks)
+        else:
+            pool = None
+            jobs = map(_detectFrames, tasks)
 
         # get keypoints and descriptors
         results =[]
         print('Extracting features...')
         try:
             for j in jobs:
-                results.append(j)
+                results.extend(j)
         except ValueError:
             warnings.warn('ValueError something about 2d-image. Probably some of the detector input params are wrong.')
 
@@ -147,8 +274,12 @@ class FeatureExtractorParallel(object):
         desc = [itm[1] for itm in results]
 
         # close the pool
-        print('Closing down the kernels... \n')
-        pool.close()
+        if pool is not None:
+            print('Closing down the kernels... \n')
+            pool.close()
+
+        if save and len(results) == num_frames:
+            _writeFeatures(dset, keypts, desc, {'detector': self.detector_name, 'lib': lib, 'parms_hash': parms_hash})
 
         return keypts, desc
 
@@ -159,6 +290,7 @@ class FeatureExtractorSerial(object):
         Input:
             name: (string) name of detector.
             lib: (string) computer vision library to use (opencv or skimage)
+            **detector_args: keyword arguments used to create the detector. e.g. - n_keypoints = 500
             The following can be used for:
             lib = opencv:
                 SIFT
@@ -171,33 +303,41 @@ class FeatureExtractorSerial(object):
                 CENSURE
                 ...
     '''
-    def __init__(self, detector_name, lib):
+    def __init__(self, detector_name, lib, **detector_args):
         self.data = []
+        self.frame_shape = None
         self.lib = lib
+        self.detector_name = detector_name
+        self.detector_args = detector_args
 
         try:
             if self.lib == 'opencv':
                 pass
     #                detector = cv2.__getattribute__(detector_name)
             elif self.lib == 'skimage':
-                self.detector = skimage.feature.__getattribute__(detector_name)
+                self.detector = skimage.feature.__getattribute__(detector_name)(**detector_args)
         except AttributeError:
             print('Error: The Library does not contain the specified detector')
 
     def clearData(self):
         del self.data
         self.data = []
+        self.frame_shape = None
 
     def loadData(self, dataset):
         ''' This is a Method that loads h5 Dataset to be corrected.
+        Frames are only read from the dataset when their features are extracted.
             input: h5 dataset
         '''
         if not isinstance(dataset, h5py.Dataset):
             warnings.warn('Error: Data must be an h5 Dataset object')
         else:
             self.data = dataset
-            dim = int(np.sqrt(self.data.shape[-1]))
-            self.data = self.data.reshape(-1,dim,dim)
+            if len(dataset.shape) == 3:
+                self.frame_shape = dataset.shape[1:]
+            else:
+                dim = int(np.sqrt(self.data.shape[-1]))
+                self.frame_shape = (dim, dim)
 
     def getData(self):
         ''' This is a Method that returns the loaded h5 Dataset.
@@ -205,12 +345,29 @@ class FeatureExtractorSerial(object):
         '''
         return self.data
 
+    def _featureParms(self, mask, origin, winSize):
+        ''' Parameters that define the extracted features, used to find identical features in the file.
+        '''
+        return {'detector': self.detector_name, 'lib': self.lib, 'detector_parms': self.detector_args,
+                'mask': bool(mask), 'origin': list(origin), 'window_size': winSize}
+
     def getFeatures(self, **kwargs):
         ''' This is a Method that returns features (keypoints and descriptors)
             that are obtained by using the FeatureExtractor.Detector object.
+            Frames are read from the file one at a time.
+            Features are written to a group next to the dataset and are read back,
+            instead of being detected again, when requested with the same parameters.
             input:
                 mask: boolean, optional, default False.
-                    Whether to use
+                    Whether to only use a window of each frame.
+                origin: [int, int], optional, default [0, 0].
+                    Center of the window.
+                window_size: int, optional, default 0.
+                    Size of the window.
+                save: boolean, optional, default True unless the file is read-only.
+                    Whether to write the features to the file.
+                force: boolean, optional, default False.
+                    Detect the features even if identical features are already in the file.
             output: keypoints, descriptors
         '''
         detector = self.detector
@@ -219,37 +376,31 @@ class FeatureExtractorSerial(object):
         mask = kwargs.get('mask', False)
         origin = kwargs.get('origin',[0,0])
         winSize= kwargs.get('window_size', 0)
-
-        if mask:
-            def mask_func(x, winSize):
-                x[origin[0]- winSize/2: origin[0]+ winSize/2, origin[1]- winSize/2: origin[1]+ winSize/2] = 2
-                x = x - 1
-                return x
-            mask_ind = np.mask_indices(dset.shape[-1], mask_func, winSize)
-            self.data = np.array([ imp[mask_ind].reshape(winSize, winSize) for imp in dset])
-
-        # detect and compute keypoints
-        def detect(image):
-            if lib =='opencv':
-                image = (image - image.mean())/image.std()
-                image = image.astype('uint8')
-                k_obj, d_obj = detector.detectAndCompute(image, None)
-                keypts, descs = pickle_keypoints(k_obj), pickle_keypoints(d_obj)
-
-            elif lib == 'skimage':
-                imp = (image-image.mean())/np.std(image)
-                imp[imp < 0] = 0
-                imp.astype('float32')
-                detector.detect_and_extract(imp)
-                keypts, descs = detector.keypoints, detector.descriptors
-
-            return keypts, descs
-
-        # start pool of workers
-        results = [detect(imp) for imp in self.data]
+        save = kwargs.get('save', dset.file.mode != 'r')
+        force = kwargs.get('force', False)
+        if save and dset.file.mode == 'r':
+            warnings.warn('{} is opened read-only. Features will not be saved'.format(dset.file.filename))
+            save = False
+
+        parms = self._featureParms(mask, origin, winSize)
+        parms_hash = calcParmsHash(dset, 'Features', parms)
+        if not force:
+            h5_features = findIdenticalResult(dset, 'Features', parms_hash)
+            if h5_features is not None:
+                print('Reading existing features from {}. Use force=True to detect them again'.format(h5_features.name))
+                return readFeatures(h5_features)
+
+        crop = _cropWindow(origin, winSize) if mask else (slice(None), slice(None))
+
+        # detect and compute keypoints one frame at a time
+        results = [detectFeatures(dset[ind].reshape(self.frame_shape)[crop], detector, lib)
+                   for ind in range(dset.shape[0])]
 
         # get keypoints and descriptors
         keypts = [itm[0].astype('int') for itm in results]
         desc = [itm[1] for itm in results]
 
-        return keypts, desc
\ No newline at end of file
+        if save:
+            _writeFeatures(dset, keypts, desc, {'detector': self.detector_name, 'lib': lib, 'parms_hash': parms_hash})
+
+        return keypts, desc
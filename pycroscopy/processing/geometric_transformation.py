@@ -8,10 +8,18 @@ import warnings
 
 import h5py
 import numpy as np
-from skimage.feature import match_descriptors, register_translation
+from scipy.spatial import cKDTree
+from skimage.feature import match_descriptors
 from skimage.measure import ransac
 from skimage.transform import warp, SimilarityTransform
 
+from ..io.io_utils import getAvailableMem
+
+try:
+    import multiprocess as mp
+except ImportError:
+    mp = None
+
 
 #TODO: Docstrings following numpy standard.
 
@@ -20,14 +28,411 @@ def euclidMatch(Matches, keypts1, keypts2, misalign):
     """ Function that thresholds the matches, found from a comparison of
     their descriptors, by the maximum expected misalignment.
     """
-    filteredMatches = np.array([])
-    deltaX =(keypts1[Matches[:,0],:][:,0]-keypts2[Matches[:,1],:][:,0])**2
-    deltaY =(keypts1[Matches[:,0],:][:,1]-keypts2[Matches[:,1],:][:,1])**2
-    dist = np.apply_along_axis(np.sqrt, 0, deltaX + deltaY)
-    filteredMatches = np.where(dist[:] < misalign, True, False)
+    delta = keypts1[Matches[:,0], :2] - keypts2[Matches[:,1], :2]
+    filteredMatches = np.hypot(delta[:,0], delta[:,1]) < misalign
     return filteredMatches
 
 
+def chainTransformations(transforms, origin, transformation='translation'):
+    ''' Function that chains the transformations between consecutive images into
+    transformations of every image relative to the origin image.
+    The chained parameters are differences of cumulative sums, so the cost is linear
+    in the number of images.
+        Input:
+            transforms: (list of skimage.GeometricTransform objects).
+                    Transformation between each image and the next one.
+            origin: int
+                    The position in the data to take as origin, i.e. don't transform.
+            transformation: string, optional.
+                    'translation' or 'rotation', default, translation.
+
+        Output:
+            List of transformations, one per image.
+    '''
+    YTrans = np.array([trans.translation[0] for trans in transforms])
+    XTrans = np.array([trans.translation[1] for trans in transforms])
+
+    # chain[i] = sum(steps[origin:i]) for i > origin and -sum(steps[i:origin]) for i < origin
+    def chain(steps):
+        cumSteps = np.concatenate([[0], np.cumsum(steps)])
+        return cumSteps - cumSteps[origin]
+
+    xchain = chain(XTrans)
+    ychain = chain(YTrans)
+
+    chainTransforms = []
+    if transformation == 'translation':
+        for params in zip(xchain, ychain):
+            chainTransforms.append(TranslationTransform(translation = params))
+
+    elif transformation == 'rotation':
+        rotchain = chain(np.array([trans.rotation for trans in transforms]))
+        for params in zip(rotchain, xchain, ychain):
+            T = SimilarityTransform(scale = 1.0, rotation = np.deg2rad(params[0]), translation = (params[1],params[2]))
+            chainTransforms.append(T)
+
+    return chainTransforms
+
+
+def _warpImages(task):
+    ''' Function that warps a block of images, each with its own transformation.
+    Used by warpImageStack.
+    '''
+    images, transforms, output_shape = task
+    return np.array([warp(imp, inverse_map = transform, output_shape = output_shape,
+                          cval = 0, preserve_range = True)
+                     for imp, transform in zip(images, transforms)])
+
+
+def warpImageStack(dset, transforms, processes=1, output=None):
+    ''' Function that applies a transformation to each image of a stack.
+    Images are read from dset one block at a time and warped by a pool of workers, so only
+    a few blocks are ever held in memory.
+        Input:
+            dset: (h5py.Dataset or np.ndarray) stack of images with shape (images, x, y).
+            transforms: (list of skimage.GeometricTransform objects), one per image.
+            processes: int, optional
+                    Number of processors to use, default = 1.
+            output: (h5py.Dataset or np.ndarray), optional
+                    Array with the same shape as dset to write the warped images to.
+                    default, a new np.ndarray is allocated.
+
+        Output:
+            Transformed images.
+    '''
+    num_images = dset.shape[0]
+    output_shape = dset.shape[1:]
+
+    if output is None:
+        output = np.zeros(dset.shape, dtype = dset.dtype)
+    elif output.shape != dset.shape:
+        raise ValueError('output must have the same shape as the image stack.')
+
+    if processes > 1 and mp is None:
+        warnings.warn('The multiprocess package is not available. Warping images with one processor.')
+        processes = 1
+
+    # warp returns float64 images. Read enough images at once to keep every processor busy
+    # while staying within the available memory.
+    image_bytes = 2 * np.prod(output_shape) * np.dtype(np.float64).itemsize
+    max_mem = min(1024 ** 3, 0.5 * getAvailableMem())
+    imagesPerTask = int(max(1, min(np.ceil(float(num_images) / processes), max_mem / (image_bytes * processes))))
+    imagesPerPass = imagesPerTask * processes
+
+    if processes > 1:
+        pool = mp.Pool(processes)
+        print('launching %i kernels...'%(processes))
+        mapper = pool.map
+    else:
+        pool = None
+        mapper = map
+
+    print('Transforming Images...')
+    for start in range(0, num_images, imagesPerPass):
+        stop = min(start + imagesPerPass, num_images)
+        images = dset[start:stop]
+        tasks = [(images[ind:ind + imagesPerTask], transforms[start + ind:start + ind + imagesPerTask], output_shape)
+                 for ind in range(0, stop - start, imagesPerTask)]
+        for ind, transImages in zip(range(start, stop, imagesPerTask), mapper(_warpImages, tasks)):
+            output[ind:ind + transImages.shape[0]] = transImages
+        print('Images #%i-%i'%(start, stop - 1))
+
+    if pool is not None:
+        print('Closing down the kernels... \n')
+        pool.close()
+        pool.join()
+
+    return output
+
+
+def _upsampledDFT(data, region_size, upsample_factor, offsets):
+    ''' Function that computes a batch of upsampled DFTs by matrix multiplication, each
+    over a small region around its own offset.  Batched version of the function of the same
+    purpose in skimage.feature.register_translation.
+        Input:
+            data: (np.ndarray) batch of 2D spectra with shape (batch, rows, cols).
+            region_size: int, size of the upsampled region.
+            upsample_factor: int, upsampling factor.
+            offsets: (np.ndarray) offset of each region with shape (batch, 2).
+
+        Output:
+            Upsampled DFTs with shape (batch, region_size, region_size).
+    '''
+    rows, cols = data.shape[-2:]
+    region = np.arange(region_size)
+
+    col_kernel = np.exp((-2j * np.pi / (cols * upsample_factor)) *
+                        np.fft.fftfreq(cols, 1. / cols)[None, :, None] *
+                        (region[None, None, :] - offsets[:, 1, None, None]))
+    row_kernel = np.exp((-2j * np.pi / (rows * upsample_factor)) *
+                        (region[None, :, None] - offsets[:, 0, None, None]) *
+                        np.fft.fftfreq(rows, 1. / rows)[None, None, :])
+
+    return np.matmul(np.matmul(row_kernel, data), col_kernel)
+
+
+def _fullSpectrum(half_spectrum, cols):
+    ''' Function that rebuilds the full spectra of real images from the half spectra
+    returned by np.fft.rfft2 using their Hermitian symmetry.
+    '''
+    rows, half_cols = half_spectrum.shape[-2:]
+    full = np.zeros(half_spectrum.shape[:-1] + (cols,), dtype = half_spectrum.dtype)
+    full[..., :half_cols] = half_spectrum
+    mirror_rows = (-np.arange(rows)) % rows
+    mirror_cols = cols - np.arange(half_cols, cols)
+    full[..., half_cols:] = np.conj(half_spectrum[..., mirror_rows[:, None], mirror_cols[None, :]])
+    return full
+
+
+def _correlationPeaks(src_freq, target_freq, shape, upsample_factor=1, rfft=False):
+    ''' Function that finds the translations registering a batch of target images with a batch of
+    source images from their spectra. The integer peaks of all the cross-correlations are found at
+    once and only a small region around each peak is upsampled to refine it.
+    Results match skimage.feature.register_translation(src, target, upsample_factor).
+        Input:
+            src_freq: (np.ndarray) spectra of the source images with shape (batch, rows, cols).
+            target_freq: (np.ndarray) spectra of the target images with the same shape as src_freq.
+            shape: (tuple) shape of the images.
+            upsample_factor: int, optional
+                    Images will be registered to within 1 / upsample_factor of a pixel, default = 1.
+            rfft: bool, optional
+                    Whether the spectra are half spectra from np.fft.rfft2, default = False.
+
+        Output:
+            Shifts with shape (batch, 2).
+    '''
+    image_product = src_freq * target_freq.conj()
+    if rfft:
+        cross_correlation = np.abs(np.fft.irfft2(image_product, s = shape))
+    else:
+        cross_correlation = np.abs(np.fft.ifft2(image_product))
+
+    maxima = np.argmax(cross_correlation.reshape(cross_correlation.shape[0], -1), axis = 1)
+    shifts = np.array(np.unravel_index(maxima, shape), dtype = np.float64).T
+
+    shape = np.array(shape)
+    midpoints = np.fix(shape / 2.)
+    shifts = np.where(shifts > midpoints, shifts - shape, shifts)
+
+    if upsample_factor > 1:
+        if rfft:
+            image_product = _fullSpectrum(image_product, shape[1])
+        shifts = np.round(shifts * upsample_factor) / upsample_factor
+        region_size = int(np.ceil(upsample_factor * 1.5))
+        dftshift = np.fix(region_size / 2.0)
+
+        cross_correlation = _upsampledDFT(image_product.conj(), region_size, upsample_factor,
+                                          dftshift - shifts * upsample_factor).conj()
+        maxima = np.argmax(np.abs(cross_correlation).reshape(cross_correlation.shape[0], -1), axis = 1)
+        maxima = np.array(np.unravel_index(maxima, (region_size, region_size)), dtype = np.float64).T
+        shifts = shifts + (maxima - dftshift) / upsample_factor
+
+    shifts[:, shape == 1] = 0
+
+    return shifts
+
+
+def registerTranslations(dset, upsample_factor=1, reference='previous', batch_size=None,
+                         single_precision=False, ref_weight=None):
+    ''' Function that registers the images in a stack by phase correlation. The 2D FFT of each
+    image is computed exactly once and the cross-correlations are evaluated in batches.
+        Input:
+            dset: (h5py.Dataset or np.ndarray) stack of images with shape (images, x, y).
+            upsample_factor: int, optional
+                    Images will be registered to within 1 / upsample_factor of a pixel, default = 1.
+            reference: string, optional
+                    'previous' registers each image with the one before it, as register_translation
+                    does on consecutive pairs.
+                    'running' registers each image with a reference built from all of the images
+                    before it after they have been aligned. Better suited to long, noisy movies.
+                    default, previous.
+            batch_size: int, optional
+                    Number of images read and transformed at once, default = as many as fit in memory.
+            single_precision: bool, optional
+                    Read the images as float32 and keep the half spectra (np.fft.rfft2) in complex64,
+                    default = False.
+            ref_weight: float, optional
+                    Weight of each new image in the running reference. default, an equal weight for
+                    every image, i.e. the running reference is the mean of the aligned images.
+
+        Output:
+            Shifts. For 'previous', shifts[i] registers image i + 1 with image i and has shape
+            (images - 1, 2). For 'running', shifts[i] registers image i with the reference and has
+            shape (images, 2).
+    '''
+    if reference not in ['previous', 'running']:
+        raise ValueError('reference must be either "previous" or "running".')
+
+    num_images = dset.shape[0]
+    shape = tuple(dset.shape[1:])
+
+    if single_precision:
+        real_type, spec_type = np.float32, np.complex64
+    else:
+        real_type, spec_type = np.float64, np.complex128
+
+    def spectra(images):
+        images = np.asarray(images, dtype = real_type)
+        if single_precision:
+            return np.fft.rfft2(images).astype(spec_type)
+        return np.fft.fft2(images)
+
+    if batch_size is None:
+        # each image needs its spectrum, the cross-power spectrum and the cross-correlation
+        image_bytes = 4 * np.prod(shape) * np.dtype(spec_type).itemsize
+        batch_size = int(max(2, min(1024 ** 3, 0.5 * getAvailableMem()) / image_bytes))
+    batch_size = int(max(1, batch_size))
+
+    if reference == 'previous':
+        shifts = np.zeros((max(0, num_images - 1), 2))
+        last_freq = None
+        for start in range(0, num_images, batch_size):
+            stop = min(start + batch_size, num_images)
+            batch_freq = spectra(dset[start:stop])
+            if last_freq is not None:
+                batch_freq = np.concatenate([last_freq[None], batch_freq])
+            if batch_freq.shape[0] > 1:
+                first = start - 1 if last_freq is not None else start
+                shifts[first:stop - 1] = _correlationPeaks(batch_freq[:-1], batch_freq[1:], shape,
+                                                           upsample_factor, single_precision)
+            last_freq = batch_freq[-1]
+            print('Registered Images #%i-%i'%(start, stop - 1))
+        return shifts
+
+    '''
+    Running reference: the reference spectrum is updated with each image after it has been
+    shifted into alignment, which is a phase ramp in Fourier space.
+    '''
+    freq_rows = np.fft.fftfreq(shape[0])[:, None]
+    if single_precision:
+        freq_cols = np.fft.rfftfreq(shape[1])[None, :]
+    else:
+        freq_cols = np.fft.fftfreq(shape[1])[None, :]
+
+    shifts = np.zeros((num_images, 2))
+    ref_freq = None
+    num_ref = 0
+    for start in range(0, num_images, batch_size):
+        stop = min(start + batch_size, num_images)
+        batch_freq = spectra(dset[start:stop])
+        for ind, image_freq in enumerate(batch_freq):
+            if ref_freq is None:
+                ref_freq = image_freq.astype(np.complex128)
+                num_ref = 1
+                continue
+            shift = _correlationPeaks(ref_freq[None], image_freq[None], shape,
+                                      upsample_factor, single_precision)[0]
+            shifts[start + ind] = shift
+            aligned_freq = image_freq * np.exp(-2j * np.pi * (freq_rows * shift[0] + freq_cols * shift[1]))
+            num_ref += 1
+            weight = 1. / num_ref if ref_weight is None else ref_weight
+            ref_freq = (1 - weight) * ref_freq + weight * aligned_freq
+        print('Registered Images #%i-%i'%(start, stop - 1))
+
+    return shifts
+
+
+def _hammingNeighbors(bits1, bits2, max_mem=64 * 1024 ** 2):
+    ''' Function that finds the two nearest neighbors in bits2 of every binary descriptor in bits1,
+    and the nearest neighbor in bits1 of every descriptor in bits2, by Hamming distance.
+    The number of differing bits is counted as |a| + |b| - 2 a.b so that a block of rows is compared
+    at once with a single matrix multiplication.
+    '''
+    num1, num2 = bits1.shape[0], bits2.shape[0]
+    rows_per_block = int(max(1, max_mem / (num2 * 8)))
+
+    bits2 = bits2.astype(np.float32)
+    count2 = bits2.sum(axis=1)
+
+    best = np.zeros(num1, dtype=np.intp)
+    best_dist = np.zeros(num1, dtype=np.int64)
+    second_dist = np.full(num1, np.iinfo(np.int64).max, dtype=np.int64)
+    back = np.zeros(num2, dtype=np.intp)
+    back_dist = np.full(num2, np.iinfo(np.int64).max, dtype=np.int64)
+
+    for start in range(0, num1, rows_per_block):
+        stop = min(start + rows_per_block, num1)
+        block = bits1[start:stop].astype(np.float32)
+        dist = np.rint(block.sum(axis=1)[:, None] + count2[None, :] - 2 * np.dot(block, bits2.T)).astype(np.int64)
+
+        best[start:stop] = np.argmin(dist, axis=1)
+        best_dist[start:stop] = dist[np.arange(stop - start), best[start:stop]]
+        if num2 > 1:
+            second_dist[start:stop] = np.partition(dist, 1, axis=1)[:, 1]
+
+        block_back = np.argmin(dist, axis=0)
+        block_dist = dist[block_back, np.arange(num2)]
+        closer = block_dist < back_dist
+        back[closer] = block_back[closer] + start
+        back_dist[closer] = block_dist[closer]
+
+    return best, best_dist, second_dist, back
+
+
+def matchDescriptors(desc1, desc2, method='auto', cross_check=True, max_ratio=1.0):
+    ''' Function that finds the nearest neighbor in desc2 of every descriptor in desc1.
+        Input:
+            desc1, desc2: (np.ndarray) descriptors with shape (keypoints, descriptor length).
+            method: string, optional
+                    'brute': skimage.feature.match_descriptors.
+                    'kdtree': KD-tree search by euclidean distance, for float descriptors such as SIFT or DAISY.
+                    'hamming': Hamming distance, for binary descriptors such as ORB or BRIEF.
+                    uint8 descriptors are taken as bit-packed (np.packbits) binary descriptors.
+                    'auto': 'hamming' for boolean descriptors and 'kdtree' otherwise.
+                    default, auto.
+            cross_check: bool, optional
+                    Only keep the matches that are also the nearest neighbor the other way, default = True.
+            max_ratio: float, optional
+                    Maximum ratio between the distance to the nearest and to the second nearest neighbor,
+                    default = 1.0, i.e. no ratio test.
+
+        Output:
+            Matches: (np.ndarray) indices of the matching descriptors in desc1 and desc2 with shape (matches, 2).
+    '''
+    if method == 'auto':
+        method = 'hamming' if desc1.dtype == np.bool_ else 'kdtree'
+
+    if method == 'brute':
+        return match_descriptors(desc1, desc2, cross_check=cross_check)
+
+    if desc1.shape[0] == 0 or desc2.shape[0] == 0:
+        return np.zeros((0, 2), dtype=np.intp)
+
+    if method == 'kdtree':
+        k = 2 if desc2.shape[0] > 1 else 1
+        dist, ind = cKDTree(desc2).query(desc1, k=k)
+        if k == 2:
+            best, best_dist, second_dist = ind[:, 0], dist[:, 0], dist[:, 1]
+        else:
+            best, best_dist, second_dist = ind, dist, np.full(dist.shape, np.inf)
+        if cross_check:
+            _, back = cKDTree(desc1).query(desc2, k=1)
+    elif method == 'hamming':
+        if desc1.dtype == np.uint8:
+            desc1 = np.unpackbits(desc1, axis=1)
+            desc2 = np.unpackbits(desc2, axis=1)
+        best, best_dist, second_dist, back = _hammingNeighbors(desc1, desc2)
+    else:
+        raise ValueError('method must be one of "auto", "brute", "kdtree" or "hamming".')
+
+    indices1 = np.arange(desc1.shape[0])
+    keep = np.ones(indices1.shape, dtype=bool)
+    if cross_check:
+        keep = back[best] == indices1
+    if max_ratio < 1.0:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            keep = np.logical_and(keep, best_dist < max_ratio * second_dist)
+
+    return np.column_stack((indices1[keep], best[keep]))
+
+
+def _matchPair(task):
+    ''' Function that matches the descriptors of a pair of images. Used by matchFeatures.
+    '''
+    desc1, desc2, method, max_ratio = task
+    return matchDescriptors(desc1, desc2, method=method, cross_check=True, max_ratio=max_ratio)
+
+
 # function is taken as is from scikit-image.
 def _center_and_normalize_points(points):
     """Center and normalize image points.
@@ -129,23 +534,20 @@ class TranslationTransform(object):
     def estimate(self, src, dst):
      #evaluate transformation matrix from src, dst
      # coordinates
-        try:
-            xs = src[:, 0][0]
-            ys = src[:, 1][1]
-            xd = dst[:, 0][0]
-            yd = dst[:, 1][1]
-            S = np.array([[1., 0., xd-xs],
-                          [0., 1., yd-ys],
-                          [0., 0., 1.]
-                          ],dtype = 'float32')
-            self.params = S
-            return True
-        except IndexError:
+        # least squares translation is the mean displacement
+        if len(src) == 0:
             return False
+        xd, yd = np.mean(np.asarray(dst, dtype=np.float64)[:, :2] - np.asarray(src, dtype=np.float64)[:, :2], axis=0)
+        S = np.array([[1., 0., xd],
+                      [0., 1., yd],
+                      [0., 0., 1.]
+                      ],dtype = 'float32')
+        self.params = S
+        return True
 
     @property
     def _inv_matrix(self):
-        inv_matrix = self.params
+        inv_matrix = self.params.copy()
         inv_matrix[0:2,2] = - inv_matrix[0:2,2]
         return inv_matrix
 
@@ -333,7 +735,8 @@ class RigidTransform(object):
         A[:rows, 4] = xd
         A[rows:, 4] = yd
 
-        _, _, V = np.linalg.svd(A)
+        # only the right singular vectors are needed, skip computing the full U for many points
+        _, _, V = np.linalg.svd(A, full_matrices=A.shape[0] < A.shape[1])
 
         # solution is right singular vector that corresponds to smallest
         # singular value
@@ -419,6 +822,130 @@ class RigidTransform(object):
 
 
 
+def _estimateModels(src, dst, transform):
+    ''' Function that estimates a batch of translation or rigid (rotation, translation and uniform scale)
+    models by least squares, one for each set of sampled points.
+        Input:
+            src, dst: (np.ndarray) sampled coordinates with shape (models, samples, 2).
+            transform: TranslationTransform or RigidTransform class.
+
+        Output:
+            Homogeneous transformation matrices with shape (models, 3, 3). Degenerate samples give NaNs.
+    '''
+    num_models = src.shape[0]
+    matrices = np.zeros((num_models, 3, 3))
+    matrices[:, 0, 0] = matrices[:, 1, 1] = matrices[:, 2, 2] = 1
+
+    if transform is TranslationTransform:
+        matrices[:, 0:2, 2] = np.mean(dst - src, axis=1)
+        return matrices
+
+    # Points as complex numbers so that dst = a * src + b, with a = scale * exp(1j * rotation)
+    src_c = src[..., 0] + 1j * src[..., 1]
+    dst_c = dst[..., 0] + 1j * dst[..., 1]
+    src_mean = src_c.mean(axis=1, keepdims=True)
+    dst_mean = dst_c.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        a = np.sum((dst_c - dst_mean) * np.conj(src_c - src_mean), axis=1) / np.sum(np.abs(src_c - src_mean) ** 2, axis=1)
+    b = dst_mean[:, 0] - a * src_mean[:, 0]
+
+    matrices[:, 0, 0] = matrices[:, 1, 1] = a.real
+    matrices[:, 0, 1] = - a.imag
+    matrices[:, 1, 0] = a.imag
+    matrices[:, 0, 2] = b.real
+    matrices[:, 1, 2] = b.imag
+
+    return matrices
+
+
+def ransacTransform(src, dst, transform, min_samples=2, residual_threshold=1., max_trials=100, random_state=None):
+    ''' Function that robustly estimates a TranslationTransform or RigidTransform between matching points
+    with a random sample consensus. All of the random minimal samples are drawn up front, all of the
+    candidate models are estimated at once and their residuals are computed in batches.
+        Input:
+            src, dst: (np.ndarray) coordinates of the matching points with shape (points, 2).
+            transform: TranslationTransform or RigidTransform class.
+            min_samples: int, optional
+                    Number of points used to estimate each candidate model, default = 2.
+            residual_threshold: float, optional
+                    Maximum distance for a point to be an inlier, default = 1.
+            max_trials: int, optional
+                    Number of candidate models, default = 100.
+            random_state: int or np.random.RandomState, optional
+                    Seed of the random samples, default = None.
+
+        Output:
+            model: the transformation estimated from all the inliers of the best candidate, None if
+                    there are not enough points.
+            inliers: (np.ndarray) boolean mask of the inliers.
+    '''
+    if transform not in [TranslationTransform, RigidTransform]:
+        raise ValueError('ransacTransform only supports TranslationTransform and RigidTransform.')
+
+    src = np.asarray(src, dtype=np.float64)
+    dst = np.asarray(dst, dtype=np.float64)
+    num_points = src.shape[0]
+    if num_points < min_samples or min_samples < 1:
+        return None, np.zeros(num_points, dtype=bool)
+
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+
+    # Draw every minimal sample, redrawing the few samples that picked the same point twice
+    samples = random_state.randint(0, num_points, size=(max_trials, min_samples))
+    repeated = np.any(np.diff(np.sort(samples, axis=1), axis=1) == 0, axis=1)
+    while np.any(repeated):
+        samples[repeated] = random_state.randint(0, num_points, size=(np.sum(repeated), min_samples))
+        repeated = np.any(np.diff(np.sort(samples, axis=1), axis=1) == 0, axis=1)
+
+    # Evaluate the candidates in batches so that the residuals of a batch stay small
+    trials_per_batch = int(max(1, 2 ** 22 / num_points))
+
+    best_count, best_sum, best_inliers = 0, np.inf, np.zeros(num_points, dtype=bool)
+    for start in range(0, max_trials, trials_per_batch):
+        batch = samples[start:start + trials_per_batch]
+        matrices = _estimateModels(src[batch], dst[batch], transform)
+
+        delta_x = matrices[:, 0, 0, None] * src[None, :, 0] + matrices[:, 0, 1, None] * src[None, :, 1] + \
+            matrices[:, 0, 2, None] - dst[None, :, 0]
+        delta_y = matrices[:, 1, 0, None] * src[None, :, 0] + matrices[:, 1, 1, None] * src[None, :, 1] + \
+            matrices[:, 1, 2, None] - dst[None, :, 1]
+        residuals = np.hypot(delta_x, delta_y)
+        valid = np.all(np.isfinite(residuals), axis=1)
+        residuals[~valid] = np.inf
+
+        inliers = residuals < residual_threshold
+        counts = inliers.sum(axis=1)
+        residual_sums = np.sum(residuals ** 2, axis=1)
+
+        # most inliers first, then the smallest sum of squared residuals
+        order = np.lexsort((residual_sums, -counts))
+        ind = order[0]
+        if valid[ind] and (counts[ind] > best_count or (counts[ind] == best_count and residual_sums[ind] < best_sum)):
+            best_count, best_sum, best_inliers = counts[ind], residual_sums[ind], inliers[ind]
+
+    if best_count == 0:
+        return None, best_inliers
+
+    model = transform()
+    model.estimate(src[best_inliers], dst[best_inliers])
+
+    return model, best_inliers
+
+
+def _ransacPair(task):
+    ''' Function that estimates the transformation between the matching keypoints of a pair of images.
+    Used by findTransformation.
+    '''
+    src, dst, transform, kwargs = task
+    try:
+        if transform in [TranslationTransform, RigidTransform]:
+            return ransacTransform(src, dst, transform, **kwargs)
+        return ransac((src, dst), transform, **kwargs)
+    except np.linalg.LinAlgError:
+        return None, np.zeros(src.shape[0], dtype=bool)
+
+
 # Class to do geometric transformations. This is a wrapper on scikit-image functionality.
 # TODO: io operations for features and optical geometric transformations.
 
@@ -465,14 +992,19 @@ class geoTransformerParallel(object):
 
     def matchFeatures(self, **kwargs):
         ''' This is a Method that computes similarity between keypoints based on their
-        descriptors. Currently only skimage.feature.match_descriptors is implemented.
-        In the future will need to add opencv2.matchers.
+        descriptors.
         Input:
             processors: int, optional
                     Number of processors to use, default = 1.
             maximum_distance: int, optional
                     maximum_distance (int) of misalignment, default = infinity.
                     Used to filter the matches before optimizing the transformation.
+            method: string, optional
+                    'auto', 'brute', 'kdtree' or 'hamming', default = auto.
+                    See matchDescriptors.
+            max_ratio: float, optional
+                    Maximum ratio between the distances to the nearest and second nearest
+                    descriptors, default = 1.0, i.e. no ratio test.
         Output:
             Matches.
         '''
@@ -480,20 +1012,20 @@ class geoTransformerParallel(object):
         keypts = self.features[0]
         processes = kwargs.get('processors', 1)
         maxDis = kwargs.get('maximum_distance', np.infty)
+        method = kwargs.get('method', 'auto')
+        maxRatio = kwargs.get('max_ratio', 1.0)
 
-
-        def match(desc):
-            desc1, desc2 = desc[0], desc[1]
-            matches = match_descriptors(desc1, desc2, cross_check=True)
-            return matches
+        tasks = [ (desc1, desc2, method, maxRatio) for desc1, desc2 in zip(desc[:],desc[1:]) ]
 
         # start pool of workers
-        pool = multiprocess.Pool(processes)
-        print('launching %i kernels...'%(processes))
-
-        tasks = [ (desc1, desc2) for desc1, desc2 in zip(desc[:],desc[1:]) ]
-        chunk = int(len(desc)/processes)
-        jobs = pool.imap(match, tasks, chunksize = chunk)
+        if processes > 1 and mp is not None:
+            pool = mp.Pool(processes)
+            print('launching %i kernels...'%(processes))
+            chunk = max(1, int(len(tasks)/processes))
+            jobs = pool.imap(_matchPair, tasks, chunksize = chunk)
+        else:
+            pool = None
+            jobs = map(_matchPair, tasks)
 
         # get matches
         print('Extracting Matches From the Descriptors...')
@@ -503,8 +1035,9 @@ class geoTransformerParallel(object):
             matches.append(j)
 
         # close the pool
-        print('Closing down the kernels...\n')
-        pool.close()
+        if pool is not None:
+            print('Closing down the kernels...\n')
+            pool.close()
 
         # impose maximum_distance misalignment constraints on matches
         filt_matches = []
@@ -519,49 +1052,61 @@ class geoTransformerParallel(object):
     def findTransformation(self, transform, matches, processes, **kwargs):
         ''' This is a Method that finds the optimal transformation between two images
         given matching features using a random sample consensus.
+        TranslationTransform and RigidTransform use the vectorized ransacTransform,
+        other transforms use skimage.measure.ransac.
             Input:
-                transform: skimage.transform object
+                transform: TranslationTransform, RigidTransform or skimage.transform object
                 matches (list): matches found through match_features method.
                 processors: Number of processors to use.
-                **kwargs are passed to skimage.transform.ransac
+                **kwargs are passed to ransacTransform or skimage.transform.ransac.
+                    An integer random_state seeds every pair of images deterministically.
 
             Output:
                 Transformations.
         '''
-
-        keypts = self.features[0]
-
-        def optimization(Pts):
-            robustTrans, inliers = ransac((Pts[0], Pts[1]), transform, **kwargs)
-            output = [robustTrans, inliers]
-            return output
+        tasks = self._ransacTasks(transform, matches, kwargs)
 
          # start pool of workers
-        print('launching %i kernels...'%(processes))
-        pool = mp.Pool(processes)
-        tasks = [ (key1[match[:, 0]], key2[match[:, 1]])
-                    for match, key1, key2 in zip(matches,keypts[:],keypts[1:]) ]
-        chunk = int(len(keypts)/processes)
-        jobs = pool.imap(optimization, tasks, chunksize = chunk)
+        if processes > 1 and mp is not None:
+            print('launching %i kernels...'%(processes))
+            pool = mp.Pool(processes)
+            chunk = max(1, int(len(tasks)/processes))
+            jobs = pool.imap(_ransacPair, tasks, chunksize = chunk)
+        else:
+            pool = None
+            jobs = map(_ransacPair, tasks)
 
         # get Transforms and inlier matches
         transforms, trueMatches =[], []
         print('Extracting Inlier Matches with RANSAC...')
-        try:
-            for j in jobs:
-                transforms.append(j[0])
-                trueMatches.append(j[1])
-        except np.linalg.LinAlgError:
-            pass
+        for j in jobs:
+            transforms.append(j[0])
+            trueMatches.append(j[1])
 
         # close the pool
-        pool.close()
-        print('Closing down the kernels...\n')
+        if pool is not None:
+            pool.close()
+            print('Closing down the kernels...\n')
 
         return transforms, trueMatches
 
+    def _ransacTasks(self, transform, matches, kwargs):
+        ''' Builds the RANSAC task of each pair of images. An integer random_state is
+        turned into one seed per pair so the results do not depend on how the pairs are processed.
+        '''
+        keypts = self.features[0]
+        kwargs = dict(kwargs)
+        seed = kwargs.pop('random_state', None)
+        if seed is not None and not isinstance(seed, np.random.RandomState):
+            seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(matches))
+        else:
+            seeds = [seed] * len(matches)
+
+        return [ (key1[match[:, 0]], key2[match[:, 1]], transform,
+                  kwargs if pair_seed is None else dict(kwargs, random_state = pair_seed))
+                    for match, key1, key2, pair_seed in zip(matches, keypts[:], keypts[1:], seeds) ]
+
 
-    #TODO: Need parallel version for transforming stack of images.
     def applyTransformation(self, transforms, **kwargs):
         ''' This is the method that takes the list of transformation found by findTransformation
          and applies them to the data set.
@@ -578,13 +1123,15 @@ class geoTransformerParallel(object):
                      default, center image in the stack.
              processors: int, optional
                     Number of processors to use, default = 1.
-                    Currently,only one processor is used.
+             output: (h5py.Dataset or np.ndarray), optional
+                    Array with the same shape as the data to write the transformed images to.
+                    default, a new np.ndarray is allocated.
 
         Output:
             Transformed images, transformations
 
         '''
-        dic = ['processors','origin','transformation']
+        dic = ['processors','origin','transformation','output']
         for key in kwargs.keys():
             if key not in dic:
                 print('%s is not a parameter of this function' %(str(key)))
@@ -592,135 +1139,45 @@ class geoTransformerParallel(object):
         processes = kwargs.get('processors', 1)
         origin = kwargs.get('origin', int(self.data.shape[0]/2))
         transformation = kwargs.get('transformation','translation')
+        output = kwargs.get('output', None)
 
-        dset = self.data
-        # For now restricting this to just translation... Straightforward to generalize to other transform objects.
-        if transformation == 'translation':
-
-            YTrans = np.array([trans.translation[0] for trans in transforms])
-            XTrans = np.array([trans.translation[1] for trans in transforms])
-            chainL = []
-            for y, x in zip(range(0,YTrans.size+1), range(0,XTrans.size+1)):
-                if y < origin:
-                    ychain = -np.sum(YTrans[y:origin])
-                    xchain = -np.sum(XTrans[x:origin])
-
-                elif y > origin:
-                    ychain = np.sum(YTrans[origin:y])
-                    xchain = np.sum(XTrans[origin:x])
-                else:
-                    ychain = 0
-                    xchain = 0
-
-                chainL.append([xchain, ychain])
-
-            chainTransforms = []
-            for params in  chainL:
-                T = TranslationTransform(translation = params)
-                chainTransforms.append(T)
-
-        # Just need a single function that does boths
-        if transformation == 'rotation':
-
-            rotTrans = np.array([trans.rotation for trans in transforms])
-            YTrans = np.array([trans.translation[0] for trans in transforms])
-            XTrans = np.array([trans.translation[1] for trans in transforms])
-            chainL = []
-            for x in range(0,rotTrans.size+1):
-                if x < origin:
-                    rotchain = -np.sum(rotTrans[x:origin])
-                    ychain = -np.sum(YTrans[x:origin])
-                    xchain = -np.sum(XTrans[x:origin])
-
-                elif x > origin:
-                    rotchain = np.sum(rotTrans[origin:x])
-                    ychain = np.sum(YTrans[origin:x])
-                    xchain = np.sum(XTrans[origin:x])
-                else:
-                    rotchain = 0
-                    ychain = 0
-                    xchain = 0
-
-                chainL.append([rotchain, xchain, ychain])
-
-            chainTransforms = []
-            for params in  chainL:
-                T = SimilarityTransform(scale = 1.0, rotation = np.deg2rad(params[0]), translation = (params[1],params[2]))
-#                T = SimilarityTransform(rotation = params, translation = (0,0))
-                chainTransforms.append(T)
+        chainTransforms = chainTransformations(transforms, origin, transformation)
 
         # Use the chain transformations to transform the dataset
-        output_shape = dset[0].shape
-#        output_shape = (2048, 2048)
-        def warping(datum):
-            imp, transform  = datum[0], datum[1]
-            transimp = warp(imp, inverse_map= transform, output_shape = output_shape,
-                            cval = 0, preserve_range = True)
-            return transimp
-
-#          #start pool of workers
-#         #somehow wrap function crashes when run in parallel! run sequentially for now.
-#        pool = mp.Pool(processes)
-#        print('launching %i kernels...'%(processes))
-#        tasks = [ (imp, transform) for imp, transform in zip(dset, chainTransforms) ]
-#        chunk = int(dset.shape[0]/processes)
-#        jobs = pool.imap(warping, tasks, chunksize = 1)
-#        #close the pool
-#        pool.close()
-#        print('Closing down the kernels... \n')
-#
-        # get transformed images and pack into 3d np.ndarray
-        print('Transforming Images...')
-        transImages = np.copy(dset[:])
-
-        for imp, transform, itm in zip( transImages, chainTransforms, range(0,transImages.shape[0])):
-            transimp = warping([imp, transform])
-            transImages[itm] = transimp
-            print('Image #%i'%(itm))
-
+        transImages = warpImageStack(self.data, chainTransforms, processes = processes, output = output)
 
         return transImages, chainTransforms
 
     def correlationTransformation(self, **kwargs):
-        ''' Uses Cross-correlation to find a translation between 2 images.
+        ''' Uses phase correlation to find the translation between consecutive images, or between
+        each image and a running reference. The FFT of each image is computed only once.
             Input:
-                Processors: int, optional
-                    Number of processors to use, default = 1.
+                upsample_factor: int, optional
+                    Images will be registered to within 1 / upsample_factor of a pixel, default = 1.
+                reference: string, optional
+                    'previous' or 'running', default = previous.
+                    See registerTranslations.
+                batch_size: int, optional
+                    Number of images transformed at once, default = as many as fit in memory.
+                single_precision: bool, optional
+                    Compute the spectra in single precision, default = False.
 
             Output:
                 Transformations.
         '''
+        dic = ['processors','upsample_factor','reference','batch_size','single_precision']
+        for key in kwargs.keys():
+            if key not in dic:
+                print('%s is not a parameter of this function' %(str(key)))
 
-        processes = kwargs.get('processors', 1)
-
-        pool = mp.Pool(processes)
-        print('launching %i kernels...'%(processes))
-
-        def register(images):
-            imp1, imp2 = images[0], images[1]
-            shifts, _, _ = register_translation(imp1,imp2)
-            return shifts
-
-        dim = int(np.sqrt(self.data.shape[-1]))
-        tasks = [ (imp1, imp2)
-                    for imp1, imp2 in zip(self.data[:], self.data[1:]) ]
-
-        chunk = int((self.data.shape[0] - 1)/processes)
-        jobs = pool.imap(register, tasks, chunksize = chunk)
-
-        # get Transforms and inlier matches
-        results = []
         print('Extracting Translations')
-        try:
-            for j in jobs:
-                results.append(j)
-        except:
-            warnings.warn('Skipped Some Entry... dunno why!!')
-
-        # close the pool
-        pool.close()
+        shifts = registerTranslations(self.data,
+                                      upsample_factor = kwargs.get('upsample_factor', 1),
+                                      reference = kwargs.get('reference', 'previous'),
+                                      batch_size = kwargs.get('batch_size', None),
+                                      single_precision = kwargs.get('single_precision', False))
 
-        return results
+        return [shift for shift in shifts]
 
 class geoTransformerSerial(object):
     """ This object contains methods to perform geometric transformations on
@@ -765,43 +1222,28 @@ class geoTransformerSerial(object):
 
     def matchFeatures(self, **kwargs):
         """ This is a Method that computes similarity between keypoints based on their
-        descriptors. Currently only skimage.feature.match_descriptors is implemented.
-        In the future will need to add opencv2.matchers.
+        descriptors.
         Input:
             maximum_distance: int, optional
                     maximum_distance (int) of misalignment, default = infinity.
                     Used to filter the matches before optimizing the transformation.
+            method: string, optional
+                    'auto', 'brute', 'kdtree' or 'hamming', default = auto.
+                    See matchDescriptors.
+            max_ratio: float, optional
+                    Maximum ratio between the distances to the nearest and second nearest
+                    descriptors, default = 1.0, i.e. no ratio test.
         Output:
             Matches.
         """
         desc = self.features[-1]
         keypts = self.features[0]
         maxDis = kwargs.get('maximum_distance', np.infty)
+        method = kwargs.get('method', 'auto')
+        maxRatio = kwargs.get('max_ratio', 1.0)
 
-
-        def match(desc):
-            desc1, desc2 = desc[0], desc[1]
-            matches = match_descriptors(desc1, desc2, cross_check=True)
-            return matches
-
-        # start pool of workers
-        pool = mp.Pool(processes)
-        print('launching %i kernels...'%(processes))
-
-        tasks = [ (desc1, desc2) for desc1, desc2 in zip(desc[:],desc[1:]) ]
-        chunk = int(len(desc)/processes)
-        jobs = pool.imap(match, tasks, chunksize = chunk)
-
-        # get matches
         print('Extracting Matches From the Descriptors...')
-
-        matches =[]
-        for j in jobs:
-            matches.append(j)
-
-        # close the pool
-        print('Closing down the kernels...\n')
-        pool.close()
+        matches = [_matchPair((desc1, desc2, method, maxRatio)) for desc1, desc2 in zip(desc[:],desc[1:])]
 
         # impose maximum_distance misalignment constraints on matches
         filt_matches = []
@@ -813,41 +1255,50 @@ class geoTransformerSerial(object):
         return matches, filt_matches
 
     #TODO: Need Better Error Handling.
-    def findTransformation(self, transform, matches, processes, **kwargs):
+    def findTransformation(self, transform, matches, processes=1, **kwargs):
         """ This is a Method that finds the optimal transformation between two images
         given matching features using a random sample consensus.
+        TranslationTransform and RigidTransform use the vectorized ransacTransform,
+        other transforms use skimage.measure.ransac.
             Input:
-                transform: skimage.transform object
+                transform: TranslationTransform, RigidTransform or skimage.transform object
                 matches (list): matches found through match_features method.
-                processors: Number of processors to use.
-                **kwargs are passed to skimage.transform.ransac
+                processors: Not used, the images are processed serially.
+                **kwargs are passed to ransacTransform or skimage.transform.ransac.
+                    An integer random_state seeds every pair of images deterministically.
 
             Output:
                 Transformations.
         """
-
-        keypts = self.features[0]
-
-        def optimization(Pts):
-            robustTrans, inliers = ransac((Pts[0], Pts[1]), transform, **kwargs)
-            output = [robustTrans, inliers]
-            return output
-
-        results = [optimization(key1[match[:, 0]], key2[match[:, 1]])
-                    for match, key1, key2 in zip(matches,keypts[:],keypts[1:])]
+        results = [_ransacPair(task) for task in self._ransacTasks(transform, matches, kwargs)]
 
         # get Transforms and inlier matches
         transforms, trueMatches =[], []
         print('Extracting Inlier Matches with RANSAC...')
-        try:
-            for res in results:
-                transforms.append(res[0])
-                trueMatches.append(res[1])
-        except np.linalg.LinAlgError:
-            print('Error: Inverse of the transformation failed!!!')
+        for res in results:
+            if res[0] is None:
+                print('Error: Could not find a transformation for a pair of images!!!')
+            transforms.append(res[0])
+            trueMatches.append(res[1])
 
         return transforms, trueMatches
 
+    def _ransacTasks(self, transform, matches, kwargs):
+        """ Builds the RANSAC task of each pair of images. An integer random_state is
+        turned into one seed per pair so the results do not depend on how the pairs are processed.
+        """
+        keypts = self.features[0]
+        kwargs = dict(kwargs)
+        seed = kwargs.pop('random_state', None)
+        if seed is not None and not isinstance(seed, np.random.RandomState):
+            seeds = np.random.RandomState(seed).randint(0, 2 ** 31 - 1, size=len(matches))
+        else:
+            seeds = [seed] * len(matches)
+
+        return [ (key1[match[:, 0]], key2[match[:, 1]], transform,
+                  kwargs if pair_seed is None else dict(kwargs, random_state = pair_seed))
+                    for match, key1, key2, pair_seed in zip(matches, keypts[:], keypts[1:], seeds) ]
+
 
     def applyTransformation(self, transforms, **kwargs):
         """ This is the method that takes the list of transformation found by findTransformation
@@ -863,119 +1314,59 @@ class geoTransformerSerial(object):
              origin: int, optional
                      The position in the data to take as origin, i.e. don't transform.
                      default, center image in the stack.
+             output: (h5py.Dataset or np.ndarray), optional
+                    Array with the same shape as the data to write the transformed images to.
+                    default, a new np.ndarray is allocated.
 
         Output:
             Transformed images, transformations
 
         """
-        dic = ['processors','origin','transformation']
+        dic = ['processors','origin','transformation','output']
         for key in kwargs.keys():
             if key not in dic:
                 print('%s is not a parameter of this function' %(str(key)))
 
-        processes = kwargs.get('processors', 1)
         origin = kwargs.get('origin', int(self.data.shape[0]/2))
         transformation = kwargs.get('transformation','translation')
+        output = kwargs.get('output', None)
 
-        dset = self.data
-        # For now restricting this to just translation... Straightforward to generalize to other transform objects.
-        if transformation == 'translation':
-
-            YTrans = np.array([trans.translation[0] for trans in transforms])
-            XTrans = np.array([trans.translation[1] for trans in transforms])
-            chainL = []
-            for y, x in zip(range(0,YTrans.size+1), range(0,XTrans.size+1)):
-                if y < origin:
-                    ychain = -np.sum(YTrans[y:origin])
-                    xchain = -np.sum(XTrans[x:origin])
-
-                elif y > origin:
-                    ychain = np.sum(YTrans[origin:y])
-                    xchain = np.sum(XTrans[origin:x])
-                else:
-                    ychain = 0
-                    xchain = 0
-
-                chainL.append([xchain, ychain])
-
-            chainTransforms = []
-            for params in  chainL:
-                T = TranslationTransform(translation = params)
-                chainTransforms.append(T)
-
-        # Just need a single function that does boths
-        if transformation == 'rotation':
-
-            rotTrans = np.array([trans.rotation for trans in transforms])
-            YTrans = np.array([trans.translation[0] for trans in transforms])
-            XTrans = np.array([trans.translation[1] for trans in transforms])
-            chainL = []
-            for x in range(0,rotTrans.size+1):
-                if x < origin:
-                    rotchain = -np.sum(rotTrans[x:origin])
-                    ychain = -np.sum(YTrans[x:origin])
-                    xchain = -np.sum(XTrans[x:origin])
-
-                elif x > origin:
-                    rotchain = np.sum(rotTrans[origin:x])
-                    ychain = np.sum(YTrans[origin:x])
-                    xchain = np.sum(XTrans[origin:x])
-                else:
-                    rotchain = 0
-                    ychain = 0
-                    xchain = 0
-
-                chainL.append([rotchain, xchain, ychain])
-
-            chainTransforms = []
-            for params in  chainL:
-                T = SimilarityTransform(scale = 1.0, rotation = np.deg2rad(params[0]), translation = (params[1],params[2]))
-#                T = SimilarityTransform(rotation = params, translation = (0,0))
-                chainTransforms.append(T)
+        chainTransforms = chainTransformations(transforms, origin, transformation)
 
         # Use the chain transformations to transform the dataset
-        output_shape = dset[0].shape
-        def warping(datum):
-            imp, transform  = datum[0], datum[1]
-            transimp = warp(imp, inverse_map= transform, output_shape = output_shape,
-                            cval = 0, preserve_range = True)
-            return transimp
-
-        # get transformed images and pack into 3d np.ndarray
-        print('Transforming Images...')
-        transImages = np.copy(dset[:])
-
-        for imp, transform, itm in zip( transImages, chainTransforms, range(0,transImages.shape[0])):
-            transimp = warping([imp, transform])
-            transImages[itm] = transimp
-            print('Image #%i'%(itm))
-
+        transImages = warpImageStack(self.data, chainTransforms, output = output)
 
         return transImages, chainTransforms
 
     def correlationTransformation(self, **kwargs):
-        """ Uses Cross-correlation to find a translation between 2 images.
+        """ Uses phase correlation to find the translation between consecutive images, or between
+        each image and a running reference. The FFT of each image is computed only once.
             Input:
-                Processors: int, optional
-                    Number of processors to use, default = 1.
+                upsample_factor: int, optional
+                    Images will be registered to within 1 / upsample_factor of a pixel, default = 1.
+                reference: string, optional
+                    'previous' or 'running', default = previous.
+                    See registerTranslations.
+                batch_size: int, optional
+                    Number of images transformed at once, default = as many as fit in memory.
+                single_precision: bool, optional
+                    Compute the spectra in single precision, default = False.
 
             Output:
                 Transformations.
         """
+        dic = ['processors','upsample_factor','reference','batch_size','single_precision']
+        for key in kwargs.keys():
+            if key not in dic:
+                print('%s is not a parameter of this function' %(str(key)))
 
-        processes = kwargs.get('processors', 1)
-
-        pool = mp.Pool(processes)
-        print('launching %i kernels...'%(processes))
-
-        def register(images):
-            imp1, imp2 = images[0], images[1]
-            shifts, _, _ = register_translation(imp1,imp2)
-            return shifts
-
-        results = [register((imp1, imp2))
-                    for imp1, imp2 in zip(self.data[:], self.data[1:])]
+        print('Extracting Translations')
+        shifts = registerTranslations(self.data,
+                                      upsample_factor = kwargs.get('upsample_factor', 1),
+                                      reference = kwargs.get('reference', 'previous'),
+                                      batch_size = kwargs.get('batch_size', None),
+                                      single_precision = kwargs.get('single_precision', False))
 
-        return results
+        return [shift for shift in shifts]
 
 
@@ -15,7 +15,7 @@ import matplotlib.pyplot as plt
 import numpy as np
 
 from .fft import getNoiseFloor, noiseBandFilter, makeLPF, harmonicsPassFilter
-from ..io.hdf_utils import getH5DsetRefs, getH5GroupRef, linkRefs
+from ..io.hdf_utils import getH5DsetRefs, getH5GroupRef, linkRefs, calcParmsHash, findIdenticalResult, markModified
 from ..io.io_utils import getTimeStamp
 from ..io.microdata import MicroDataGroup, MicroDataset
 from ..viz.plot_utils import rainbowPlot
@@ -139,7 +139,7 @@ def testFilter(resp_wfm, filter_parms, samp_rate, show_plots=True, rainbow_plot=
 ###############################################################################        
 
 def fftFilterRawData(hdf, h5_main, filter_parms, write_filtered=True, 
-                     write_condensed=False, num_cores=None):
+                     write_condensed=False, num_cores=None, force=False):
     """
     Filters G-mode data using specified filter parameters and writes results to file.
         
@@ -157,6 +157,8 @@ def fftFilterRawData(hdf, h5_main, filter_parms, write_filtered=True,
         Whether or not to write condensed filtered data to file
     num_cores : unsigned int
         Number of cores to use for processing data in parallel
+    force (optional) : Boolean - default False
+        Whether or not to filter even if the data was already filtered with the same parameters
         
     Returns
     -------
@@ -264,6 +266,17 @@ def fftFilterRawData(hdf, h5_main, filter_parms, write_filtered=True,
     low_pass_filter = makeLPF(num_pts, filter_parms['samp_rate_[Hz]'], filter_parms['LPF_cutOff_[Hz]'])
     composite_filter = noise_band_filter * low_pass_filter    
     
+    # The timestamp and algorithm are added to the parameters below and should not affect the hash
+    parms_hash = calcParmsHash(h5_main, 'FFT_Filtering',
+                               {'filter_parms': {key: val for key, val in filter_parms.items()
+                                                 if key not in ['timestamp', 'algorithm', 'parms_hash']},
+                                'write_filtered': write_filtered, 'write_condensed': write_condensed})
+    if not force:
+        h5_filtr_grp = findIdenticalResult(h5_main, 'FFT_Filtering', parms_hash)
+        if h5_filtr_grp is not None:
+            print('Returning existing filtered data in {}. Use force=True to recompute'.format(h5_filtr_grp.name))
+            return h5_filtr_grp
+
     # ioHDF now handles automatic indexing
     grp_name = h5_main.name.split('/')[-1] + '-FFT_Filtering_' 
         
@@ -274,6 +287,7 @@ def fftFilterRawData(hdf, h5_main, filter_parms, write_filtered=True,
     grp_filt = MicroDataGroup(grp_name, h5_main.parent.name)
     filter_parms['timestamp'] = getTimeStamp()
     filter_parms['algorithm'] = 'GmodeUtils-Parallel'
+    filter_parms['parms_hash'] = parms_hash
     grp_filt.attrs = filter_parms
     grp_filt.addChildren([ds_comp_filt, ds_noise_floors])
      
@@ -346,6 +360,12 @@ def fftFilterRawData(hdf, h5_main, filter_parms, write_filtered=True,
             h5_filt_data[st_pix:en_pix, :] = filt_data
         hdf.flush()
         st_pix = en_pix
+
+    markModified(h5_noise_floors)
+    if write_condensed:
+        markModified(h5_cond_data)
+    if write_filtered:
+        markModified(h5_filt_data)
     
     return h5_filtr_grp
               
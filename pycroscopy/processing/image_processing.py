@@ -4,14 +4,14 @@ Created on Jun 16, 2016
 @author: Chris Smith -- csmith55@utk.edu
 """
 import os
-from multiprocessing import cpu_count
+from multiprocessing import cpu_count, Pool
 from warnings import warn
 import matplotlib.pyplot as plt
 import numpy as np
 from scipy.optimize import leastsq
 from sklearn.utils import gen_batches
 from ..io.io_image import read_image, read_dm3
-from ..io.hdf_utils import getH5DsetRefs, copyAttributes, linkRefs, findH5group, calc_chunks, linkformain
+from ..io.hdf_utils import getH5DsetRefs, copyAttributes, linkRefs, findH5group, calc_chunks, markModified
 from ..io.io_hdf5 import ioHDF5
 from ..io.io_utils import getAvailableMem
 from ..io.microdata import MicroDataGroup, MicroDataset
@@ -208,8 +208,8 @@ class ImageWindow(object):
         '''
         Step size must be less than 1/4th the image size
         '''
-        win_step_x = min(x_pix/4, win_step_x)
-        win_step_y = min(y_pix/4, win_step_y)
+        win_step_x = int(min(x_pix/4, win_step_x))
+        win_step_y = int(min(y_pix/4, win_step_y))
 
         '''
         Prevent windows from being less that twice the step size and more than half the image size
@@ -299,44 +299,30 @@ class ImageWindow(object):
         self.hdf.flush()
 
         '''
-        Create slice object from the positions
+        View the image as a 4D array of windows arranged as [x step, y step, window x, window y].
+        No data is copied until a block of windows is written to the file
         '''
-        win_slices = [[slice(x, x+win_x), slice(y, y+win_y)] for x, y in win_pos_mat]
+        win_view = image_windows_view(image, win_x, win_y, win_step_x, win_step_y)
 
         '''
-        Calculate the size of a given batch that will fit in the available memory
+        Calculate the size of a given batch that will fit in the available memory.
+        Batches are made of whole rows of windows (all windows with the same x origin)
         '''
         mem_per_win = win_x*win_y*h5_wins.dtype.itemsize
         if self.cores is None:
             free_mem = self.max_memory-image.size*image.itemsize
         else:
             free_mem = self.max_memory*2-image.size*image.itemsize
-        batch_size = free_mem/mem_per_win
-        batch_slices = gen_batches(n_wins, batch_size)
+        rows_per_batch = int(max(1, free_mem/(mem_per_win*ny)))
 
-        for ibatch, batch in enumerate(batch_slices):
-            batch_wins = np.zeros([batch.stop-batch.start, win_pix], dtype=np.float32)
-            '''
-            Read each slice and write it to the dataset
-            '''
-            for islice, this_slice in enumerate(win_slices[batch]):
-                iwin = ibatch*batch_size+islice
-                selected = iwin % np.rint(n_wins/10) == 0
-
-                if selected:
-                    per_done = np.rint(100*iwin/n_wins)
-                    print('Windowing Image...{}% --pixels {}-{}, step # {}'.format(per_done,
-                                                                                   (this_slice[0].start,
-                                                                                    this_slice[1].start),
-                                                                                   (this_slice[0].stop,
-                                                                                    this_slice[1].stop),
-                                                                                   islice))
-
-                batch_wins[islice] = image[this_slice].flatten()
-
-            h5_wins[batch] = batch_wins
+        for x_start in range(0, nx, rows_per_batch):
+            x_stop = min(x_start+rows_per_batch, nx)
+            print('Windowing Image...{}% --window rows {}-{} of {}'.format(np.rint(100.0*x_start/nx),
+                                                                          x_start, x_stop, nx))
+            h5_wins[x_start*ny:x_stop*ny] = np.reshape(win_view[x_start:x_stop], (-1, win_pix))
             self.hdf.flush()
-        
+
+        markModified(h5_wins)
         self.h5_wins = h5_wins
         
         return h5_wins
@@ -379,7 +365,7 @@ class ImageWindow(object):
             win_svd = h5_win.parent[svd_name]
         
             S = win_svd['S'][comp_slice]
-            U = win_svd['U'][:,comp_slice]
+            U = win_svd['U']
             V = win_svd['V'][comp_slice,:]
         
         except KeyError:
@@ -411,14 +397,14 @@ class ImageWindow(object):
         '''
         Generate a cleaned set of windows
         '''
-        if win_svd.attrs['svd_method'] == 'sklearn-incremental':
+        if win_svd.attrs['svd_method'] in ['incremental', 'streaming-randomized']:
             batch_size = win_svd.attrs['batch_size']
             V = np.dot(np.diag(S), V)
             batches = gen_batches(U.shape[0], batch_size)
             for batch in batches:
-                new_wins[batch, :] = np.dot(U[batch, :], V)
+                new_wins[batch, :] = np.dot(U[batch, comp_slice], V)
         else:
-            new_wins[:, :] = np.dot(U, np.dot(np.diag(S), V))
+            new_wins[:, :] = np.dot(U[:, comp_slice], np.dot(np.diag(S), V))
         del U, S, V
         
         self.clean_wins = new_wins
@@ -446,56 +432,7 @@ class ImageWindow(object):
                 return
             h5_win = self.clean_wins
         
-        '''
-        Get basic windowing information from attributes of 
-        h5_win
-        '''
-        im_x = h5_win.parent.attrs['image_x']
-        im_y = h5_win.parent.attrs['image_y']
-        win_x = h5_win.parent.attrs['win_x']
-        win_y = h5_win.parent.attrs['win_y']
-        win_step_x = h5_win.parent.attrs['win_step_x']
-        win_step_y = h5_win.parent.attrs['win_step_x']             
-        
-        '''
-        Calculate the steps taken to create original windows
-        '''
-        x_steps = np.arange(0, im_x-win_x+1, win_step_x)
-        y_steps = np.arange(0, im_y-win_y+1, win_step_y)
-        
-        '''
-        Initialize arrays to hold summed windows and counts for each position
-        '''
-        counts = np.zeros([im_x, im_y], np.uint8)
-        accum = np.zeros([im_x, im_y], np.float32)
-        
-        nx = len(x_steps)
-        ny = len(y_steps)
-        n_wins = nx*ny
-        
-        '''
-        Create slice object from the positions
-        '''
-        win_slices = [[slice(x, x+win_x), slice(y, y+win_y)] for x, y in np.array([np.tile(x_steps, nx),
-                                                                                   np.repeat(y_steps, ny)]).T]
-        
-        '''
-        Loop over all windows.  Increment counts for window positions and 
-        add current window to total.
-        '''
-        ones = np.ones([win_x, win_y], dtype=counts.dtype)
-        for islice, this_slice in enumerate(win_slices):
-            selected = islice%np.rint(n_wins/10) == 0
-            if selected:
-                per_done = np.rint(100*(islice)/(n_wins))
-                print('Reconstructing Image...{}% -- step # {}'.format(per_done,islice))
-            counts[this_slice]+= ones
-    
-            accum[this_slice]+= h5_win[islice].reshape(win_x,win_y)
-
-        clean_image = accum/counts
-        
-        clean_image[np.isnan(clean_image)] = 0
+        clean_image = self.__build_from_windows(h5_win)
         
         clean_grp = MicroDataGroup('Cleaned_Image', h5_win.parent.name[1:])
 
@@ -567,59 +504,11 @@ class ImageWindow(object):
             raise
 
         '''
-        Get basic windowing information from attributes of
-        h5_win
-        '''
-        im_x = h5_win.parent.attrs['image_x']
-        im_y = h5_win.parent.attrs['image_y']
-        win_x = h5_win.parent.attrs['win_x']
-        win_y = h5_win.parent.attrs['win_y']
-        win_step_x = h5_win.parent.attrs['win_step_x']
-        win_step_y = h5_win.parent.attrs['win_step_x']
-
-        '''
-        Calculate the steps taken to create original windows
-        '''
-        x_steps = np.arange(0, im_x - win_x, win_step_x)
-        y_steps = np.arange(0, im_y - win_y, win_step_y)
-
-        '''
-        Initialize arrays to hold summed windows and counts for each position
-        '''
-        counts = np.zeros([im_x, im_y], np.uint32)
-        clean_image = np.zeros([im_x, im_y], np.float32)
-
-        nx = len(x_steps)
-        ny = len(y_steps)
-        n_wins = nx * ny
-
-        '''
-        Create slice object from the positions
-        '''
-        h5_win_pos = h5_win.file[h5_win.attrs['Position_Indices']]
-        win_slices = [[slice(x, x+win_x), slice(y, y+win_y)] for x, y in h5_win_pos]
-
-        '''
-        Loop over all windows.  Increment counts for window positions and
-        add current window to total.
+        h5_V is usually small so go ahead and take S.V
         '''
-        ones = np.ones([win_x, win_y], dtype=counts.dtype)
         ds_V = np.dot(np.diag(h5_S[comp_slice]), h5_V[comp_slice, :])
 
-        for islice, this_slice in enumerate(win_slices):
-            if islice % np.rint(n_wins / 10) == 0:
-                per_done = np.rint(100 * (islice) / (n_wins))
-                print('Reconstructing Image...{}% -- step # {}'.format(per_done, islice))
-
-            counts[this_slice] += ones
-
-            this_win = np.dot(h5_U[islice, comp_slice], ds_V)
-
-            clean_image[this_slice] += this_win.reshape(win_x, win_y)
-
-        clean_image = np.divide(clean_image, counts)
-
-        clean_image[np.isnan(clean_image)] = 0
+        clean_image = self.__build_from_windows(h5_win, h5_U, ds_V, comp_slice)
 
         '''
         Calculate the removed noise and FFTs
@@ -712,67 +601,11 @@ class ImageWindow(object):
             raise
 
         '''
-        Get basic windowing information from attributes of
-        h5_win
-        '''
-        im_x = h5_win.parent.attrs['image_x']
-        im_y = h5_win.parent.attrs['image_y']
-        win_x = h5_win.parent.attrs['win_x']
-        win_y = h5_win.parent.attrs['win_y']
-
-        '''
-        Initialize arrays to hold summed windows and counts for each position
-        '''
-        counts = np.zeros([im_x, im_y], np.uint32)
-        accum = np.zeros([im_x, im_y], np.float32)
-
-        '''
-        Create slice object from the positions
-        '''
-        ds_win_pos = h5_win.file[h5_win.attrs['Position_Indices']][()]
-        win_slices = [[slice(x, x+win_x), slice(y, y+win_y)] for x, y in ds_win_pos]
-        n_wins = ds_win_pos.shape[0]
-        '''
-        Create a matrix to add when counting.
         h5_V is usually small so go ahead and take S.V
         '''
-        ones = np.ones([win_x, win_y], dtype=counts.dtype)
         ds_V = np.dot(np.diag(h5_S[comp_slice]), h5_V[comp_slice, :])
 
-        '''
-        Calculate the size of a given batch that will fit in the available memory
-        '''
-        mem_per_win = ds_V.itemsize*ds_V.shape[1]
-        if self.cores is None:
-            free_mem = self.max_memory-ds_V.size*ds_V.itemsize
-        else:
-            free_mem = self.max_memory*2-ds_V.size*ds_V.itemsize
-        batch_size = free_mem/mem_per_win
-        batch_slices = gen_batches(n_wins, batch_size)
-
-        print('Reconstructing in batches of {} windows.'.format(batch_size))
-
-        '''
-        Loop over all batches.  Increment counts for window positions and
-        add current window to total.
-        '''
-        for ibatch, batch in enumerate(batch_slices):
-            ds_U = h5_U[batch, comp_slice]
-            batch_wins = np.dot(ds_U, ds_V).reshape([-1, win_x, win_y])
-            del ds_U
-            for islice, this_slice in enumerate(win_slices[batch]):
-                iwin = ibatch*batch_size+islice
-                if iwin % np.rint(n_wins / 10) == 0:
-                    per_done = np.rint(100 * iwin / n_wins)
-                    print('Reconstructing Image...{}% -- step # {}'.format(per_done, islice))
-
-                counts[this_slice] += ones
-
-                accum[this_slice] += batch_wins[islice]
-
-        clean_image = np.divide(accum, counts)
-
-        clean_image[np.isnan(clean_image)] = 0
+        clean_image = self.__build_from_windows(h5_win, h5_U, ds_V, comp_slice)
 
         '''
         Calculate the removed noise and FFTs
@@ -813,8 +646,8 @@ class ImageWindow(object):
 
     def clean_and_build_separate_components(self, h5_win=None, components=None):
         """
-        Rebuild the Image from the SVD results on the windows
-        Optionally, only use components less than n_comp.
+        Rebuild the Image from the SVD results on the windows separately for each component.
+        The image is split into tiles which are reconstructed in parallel.
 
         Parameters
         ----------
@@ -831,8 +664,8 @@ class ImageWindow(object):
 
         Returns
         -------
-        clean_wins : HDF5 Dataset
-            the cleaned windows
+        h5_clean : HDF5 Dataset
+            the image rebuilt from each component separately, arranged as [component, x, y]
         """
 
         if h5_win is None:
@@ -872,74 +705,50 @@ class ImageWindow(object):
         im_y = h5_win.parent.attrs['image_y']
         win_x = h5_win.parent.attrs['win_x']
         win_y = h5_win.parent.attrs['win_y']
+        win_step_x = int(h5_win.parent.attrs['win_step_x'])
+        win_step_y = int(h5_win.parent.attrs['win_step_y'])
 
-        '''
-        Create slice object from the positions
-        '''
-        ds_win_pos = h5_win.file[h5_win.attrs['Position_Indices']][()]
-        win_slices = [[slice(x, x+win_x), slice(y, y+win_y), slice(None)] for x, y in ds_win_pos]
-        n_wins = len(ds_win_pos)
+        nx = (im_x - win_x) // win_step_x + 1
+        ny = (im_y - win_y) // win_step_y + 1
+
+        if nx*ny != h5_win.shape[0]:
+            raise ValueError('The number of windows in {} does not match the windowing parameters.'.format(h5_win.name))
 
         '''
         Go ahead and take the dot product of S and V.  Get the number of components
         from the length of S
         '''
-        ds_V = np.dot(np.diag(h5_S[comp_slice]), h5_V[comp_slice, :]).T
-        num_comps = ds_V.shape[1]
+        ds_V = np.dot(np.diag(h5_S[comp_slice]), h5_V[comp_slice, :]).reshape([-1, win_x, win_y])
+        num_comps = ds_V.shape[0]
 
-        '''
-        Initialize arrays to hold summed windows and counts for each position
-        '''
-        ones = np.ones([win_x, win_y, num_comps], dtype=np.uint32)
-        counts = np.zeros([im_x, im_y, num_comps], dtype=np.uint32)
-        clean_image = np.zeros([im_x, im_y, num_comps], dtype=np.float32)
+        counts = window_coverage_counts(im_x, im_y, win_x, win_y, win_step_x, win_step_y)
 
         '''
-        Calculate the size of a given batch that will fit in the available memory
+        Calculate the size of the tiles that will fit in the available memory.
+        Each worker holds the windows of every component overlapping its tile.
         '''
-        mem_per_win = ds_V.itemsize*(num_comps+ds_V.size)
-        if self.cores is None:
-            free_mem = self.max_memory-ds_V.size*ds_V.itemsize
-        else:
-            free_mem = self.max_memory*2-ds_V.size*ds_V.itemsize
-        batch_size = free_mem/mem_per_win
-        if batch_size < 1:
+        mem_per_win = ds_V.itemsize*num_comps*(win_x*win_y+1)
+        free_mem = self.max_memory-ds_V.size*ds_V.itemsize-counts.size*counts.itemsize
+        wins_per_tile = free_mem/(mem_per_win*self.cores)
+        if wins_per_tile < 1:
             raise MemoryError('Not enough memory to perform Image Cleaning.')
-        batch_slices = gen_batches(n_wins, batch_size)
+        tile_size = int(np.sqrt(wins_per_tile*win_step_x*win_step_y))-max(win_x, win_y)
+        tile_x = int(min(im_x, max(win_step_x, tile_size)))
+        tile_y = int(min(im_y, max(win_step_y, tile_size)))
 
-        print('Reconstructing in batches of {} windows.'.format(batch_size))
         '''
-        Loop over all batches.  Increment counts for window positions and
-        add current window to total.
-        '''
-        for ibatch, batch in enumerate(batch_slices):
-            ds_U = h5_U[batch, comp_slice]
-            batch_wins = ds_U[:, None, :]*ds_V[None, :, :]
-            for islice, this_slice in enumerate(win_slices[batch]):
-                iwin = ibatch * batch_size + islice
-                if iwin % np.rint(n_wins / 10) == 0:
-                    per_done = np.rint(100 * iwin / n_wins)
-                    print('Reconstructing Image...{}% -- step # {}'.format(per_done, iwin))
-
-                counts[this_slice] += ones
-
-                clean_image[this_slice] += batch_wins[islice].reshape(win_x, win_y, num_comps)
-
-        del ds_U, ds_V
-
-        clean_image /= counts
-        del counts
-        clean_image[np.isnan(clean_image)] = 0
-
-        '''
-        Create datasets for results, link them properly, and write them to file
+        Create the dataset for the results, link them properly, and write them to file
         '''
         clean_grp = MicroDataGroup('Cleaned_Image_', win_svd.name[1:])
+        clean_grp.attrs['components_used'] = '{}-{}'.format(comp_slice.start, comp_slice.stop) \
+            if isinstance(comp_slice, slice) else str(list(comp_slice))
 
-        clean_chunking = calc_chunks([im_x*im_y, num_comps],
-                                     clean_image.dtype.itemsize)
+        clean_chunking = calc_chunks([num_comps, im_x, im_y], np.dtype(np.float32).itemsize,
+                                     unit_chunks=[1, 1, 1])
         ds_clean = MicroDataset('Cleaned_Image',
-                                data=clean_image.reshape(im_x*im_y, num_comps),
+                                data=[],
+                                maxshape=[num_comps, im_x, im_y],
+                                dtype=np.float32,
                                 chunking=clean_chunking,
                                 compression='gzip')
 
@@ -949,11 +758,52 @@ class ImageWindow(object):
         self.hdf.flush()
 
         h5_clean = getH5DsetRefs(['Cleaned_Image'], image_refs)[0]
-        h5_comp_inds = h5_clean.file[h5_V.attrs['Position_Indices']]
-        h5_spec_inds = self.h5_file[self.h5_raw.attrs['Spectroscopic_Indices']]
-        h5_spec_vals = self.h5_file[self.h5_raw.attrs['Spectroscopic_Values']]
 
-        linkformain(h5_clean, h5_comp_inds, h5_S, h5_spec_inds, h5_spec_vals)
+        '''
+        Process the image one strip of tiles at a time.  The U rows for all windows
+        overlapping the strip are read at once and split between the tiles.
+        '''
+        if self.cores > 1:
+            pool = Pool(processes=self.cores)
+            tile_map = pool.imap
+        else:
+            pool = None
+            tile_map = map
+
+        print('Reconstructing {} components in tiles of {}x{} pixels.'.format(num_comps, tile_x, tile_y))
+
+        geometry = (win_x, win_y, win_step_x, win_step_y, nx, ny)
+        for x_0 in range(0, im_x, tile_x):
+            x_1 = min(x_0+tile_x, im_x)
+            print('Reconstructing Image...{}% --rows {}-{} of {}'.format(np.rint(100.0*x_0/im_x), x_0, x_1, im_x))
+
+            ix_0, ix_1 = _windows_overlapping(x_0, x_1, win_x, win_step_x, nx)
+            if ix_0 >= ix_1:
+                continue
+            strip_U = h5_U[ix_0*ny:ix_1*ny, comp_slice].reshape([ix_1-ix_0, ny, num_comps])
+
+            tiles = list()
+            for y_0 in range(0, im_y, tile_y):
+                y_1 = min(y_0+tile_y, im_y)
+                iy_0, iy_1 = _windows_overlapping(y_0, y_1, win_y, win_step_y, ny)
+                if iy_0 >= iy_1:
+                    continue
+                tiles.append((strip_U[:, iy_0:iy_1], ds_V, geometry, (x_0, x_1, y_0, y_1), (ix_0, iy_0)))
+
+            for (y_0, y_1), tile_sum in zip([tile[3][2:] for tile in tiles], tile_map(_reconstruct_tile, tiles)):
+                tile_counts = counts[x_0:x_1, y_0:y_1]
+                tile_clean = np.zeros(tile_sum.shape, dtype=np.float32)
+                np.divide(tile_sum, tile_counts, out=tile_clean, where=tile_counts > 0, casting='unsafe')
+                h5_clean[:, x_0:x_1, y_0:y_1] = tile_clean
+
+            self.hdf.flush()
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        markModified(h5_clean)
+        linkRefs(h5_clean, [h5_S])
 
         self.h5_clean = h5_clean
 
@@ -1127,12 +977,8 @@ class ImageWindow(object):
         
         fimabs = np.abs(fim)
         fimabs_max = np.zeros(r_n)
-        
-        for k in xrange(r_n-1):
-            r1 = r_vec[k]
-            r2 = r_vec[k+1]
-            r_ind = np.where((r_mat >= r1) & (r_mat <= r2) == True)
-            fimabs_max[k] = np.max(fimabs[r_ind])
+
+        _, fimabs_max[:r_n-1], _, _ = radial_statistics(fimabs, r_mat, r_vec[:r_n])
 
         r_vec = r_vec[:-1] + (r_max-r_min)/(r_n-1)/2.0
         
@@ -1283,6 +1129,75 @@ class ImageWindow(object):
         plt.close(fig)
 
 
+    def __build_from_windows(self, h5_win, h5_U=None, ds_V=None, comp_slice=slice(None)):
+        """
+        Reconstructs an image from a set of windows by overlap-adding blocks of whole window rows.
+        The windows are either read directly from h5_win or rebuilt from the SVD results as U.(S.V)
+
+        Parameters
+        ----------
+        h5_win : hdf5 Dataset
+            dataset containing the windowed image
+        h5_U : hdf5 Dataset, optional
+            U matrix from the SVD of h5_win.  If None, the windows are read from h5_win
+        ds_V : numpy array, optional
+            Product of S and V for the selected components.  Required if h5_U is given.
+        comp_slice : slice or numpy array of uints, optional
+            Components of h5_U to use
+
+        Returns
+        -------
+        clean_image : 2D numpy array
+            The reconstructed image
+        """
+        im_x = h5_win.parent.attrs['image_x']
+        im_y = h5_win.parent.attrs['image_y']
+        win_x = h5_win.parent.attrs['win_x']
+        win_y = h5_win.parent.attrs['win_y']
+        win_step_x = int(h5_win.parent.attrs['win_step_x'])
+        win_step_y = int(h5_win.parent.attrs['win_step_y'])
+
+        nx = (im_x - win_x) // win_step_x + 1
+        ny = (im_y - win_y) // win_step_y + 1
+
+        if nx*ny != h5_win.shape[0]:
+            raise ValueError('The number of windows in {} does not match the windowing parameters.'.format(h5_win.name))
+
+        accum = np.zeros([im_x, im_y], np.float64)
+
+        '''
+        Calculate the number of window rows that will fit in the available memory.
+        Each row needs its windows and, when rebuilding from the SVD, the matching rows of U
+        '''
+        mem_per_row = ny*win_x*win_y*accum.itemsize
+        free_mem = self.max_memory-accum.size*accum.itemsize
+        if ds_V is not None:
+            mem_per_row += ny*ds_V.shape[0]*accum.itemsize
+            free_mem -= ds_V.size*ds_V.itemsize
+        rows_per_batch = int(max(1, free_mem/mem_per_row))
+
+        print('Reconstructing in batches of {} windows.'.format(rows_per_batch*ny))
+
+        for x_start in range(0, nx, rows_per_batch):
+            x_stop = min(x_start+rows_per_batch, nx)
+            print('Reconstructing Image...{}% --window rows {}-{} of {}'.format(np.rint(100.0*x_start/nx),
+                                                                               x_start, x_stop, nx))
+            win_rows = slice(x_start*ny, x_stop*ny)
+            if h5_U is None:
+                batch_wins = h5_win[win_rows]
+            else:
+                batch_wins = np.dot(h5_U[win_rows, comp_slice], ds_V)
+
+            overlap_add_windows(accum, batch_wins.reshape([-1, ny, win_x, win_y]),
+                                x_start, win_step_x, win_step_y)
+
+        counts = window_coverage_counts(im_x, im_y, win_x, win_y, win_step_x, win_step_y)
+
+        clean_image = np.zeros([im_x, im_y], np.float32)
+        np.divide(accum, counts, out=clean_image, where=counts > 0, casting='unsafe')
+
+        return clean_image
+
     @staticmethod
     def __get_component_slice(components):
         """
@@ -1324,6 +1239,71 @@ class ImageWindow(object):
         return comp_slice
 
 
+def radial_statistics(data_mat, r_mat, bin_edges):
+    """
+    Calculates the mean, maximum, minimum and standard deviation of a 2D array within radial bins.
+    Each value is assigned to its bin once so the cost scales with the number of values rather than
+    with the number of values times the number of bins.
+
+    Parameters
+    ----------
+    data_mat : real numpy array
+        Values to be binned
+    r_mat : real numpy array
+        Radius of each value in data_mat.  Must have the same size as data_mat
+    bin_edges : 1D real numpy array
+        Monotonically increasing edges of the radial bins.  Bin k contains the values with
+        bin_edges[k] <= r < bin_edges[k+1].  Values outside of the edges are ignored.
+
+    Returns
+    -------
+    rad_avg_vec : 1D real numpy array
+        Average value within each bin
+    rad_max_vec : 1D real numpy array
+        Maximum value within each bin
+    rad_min_vec : 1D real numpy array
+        Minimum value within each bin
+    rad_std_vec : 1D real numpy array
+        Standard deviation of the values within each bin
+
+    Notes
+    -----
+    Bins which contain no values are set to NaN
+    """
+    data_vec = np.ravel(data_mat)
+    r_vec = np.ravel(r_mat)
+    num_bins = len(bin_edges) - 1
+
+    bin_inds = np.searchsorted(bin_edges, r_vec, side='right') - 1
+    valid = np.logical_and(bin_inds >= 0, bin_inds < num_bins)
+    bin_inds = bin_inds[valid]
+    data_vec = data_vec[valid]
+
+    counts = np.bincount(bin_inds, minlength=num_bins)
+    filled = counts > 0
+
+    rad_avg_vec = np.full(num_bins, np.nan)
+    rad_max_vec = np.full(num_bins, np.nan)
+    rad_min_vec = np.full(num_bins, np.nan)
+    rad_std_vec = np.full(num_bins, np.nan)
+
+    rad_avg_vec[filled] = np.bincount(bin_inds, weights=data_vec, minlength=num_bins)[filled] / counts[filled]
+
+    sq_dev = (data_vec - rad_avg_vec[bin_inds]) ** 2
+    rad_std_vec[filled] = np.sqrt(np.bincount(bin_inds, weights=sq_dev, minlength=num_bins)[filled] / counts[filled])
+
+    '''
+    Sort the values by bin so that each bin is a contiguous segment that can be reduced at once
+    '''
+    data_sorted = data_vec[np.argsort(bin_inds, kind='mergesort')]
+    seg_starts = (np.cumsum(counts) - counts)[filled]
+    if seg_starts.size > 0:
+        rad_max_vec[filled] = np.maximum.reduceat(data_sorted, seg_starts)
+        rad_min_vec[filled] = np.minimum.reduceat(data_sorted, seg_starts)
+
+    return rad_avg_vec, rad_max_vec, rad_min_vec, rad_std_vec
+
+
 def radially_average_correlation(data_mat, num_r_bin):
     """
     Calculates the radially average correlation functions for a given 2D image
@@ -1363,30 +1343,203 @@ def radially_average_correlation(data_mat, num_r_bin):
     max_a = np.max(a_mat)
     a_mat = a_mat / max_a
 
-    a_vec = a_mat.flatten()
+    # bin results based on r.  Values lying exactly on the edge of a bin are excluded
+    r_bin_vec = np.linspace(0, 1, num_r_bin)
+    step = 1 / (num_r_bin * 1.0 - 1)
+    bin_edges = np.append(r_bin_vec, 1 + step)
 
-    # bin results based on r
-    a_rad_avg_vec = np.zeros(num_r_bin)
-    a_rad_max_vec = np.zeros(a_rad_avg_vec.shape)
-    a_rad_min_vec = np.zeros(a_rad_avg_vec.shape)
-    a_rad_std_vec = np.zeros(a_rad_avg_vec.shape)
-    r_bin_vec = np.zeros(a_rad_avg_vec.shape)
+    edge_inds = np.minimum(np.searchsorted(bin_edges, r_vec), bin_edges.size - 1)
+    off_edge = bin_edges[edge_inds] != r_vec
 
-    step = 1 / (num_r_bin * 1.0 - 1)
-    for k, r_bin in enumerate(np.linspace(0, 1, num_r_bin)):
-        b = np.where((r_vec < r_bin + step) * (r_vec > r_bin) == True)[0]
-
-        if b.size == 0:
-            a_rad_avg_vec[k] = np.nan
-            a_rad_min_vec[k] = np.nan
-            a_rad_max_vec[k] = np.nan
-            a_rad_std_vec[k] = np.nan
-        else:
-            a_bin = a_vec[b]
-            a_rad_avg_vec[k] = np.mean(a_bin)
-            a_rad_min_vec[k] = np.min(a_bin)
-            a_rad_max_vec[k] = np.max(a_bin)
-            a_rad_std_vec[k] = np.std(a_bin)
-        r_bin_vec[k] = r_bin + 0.5 * step
-
-    return a_mat, a_rad_avg_vec, a_rad_max_vec, a_rad_min_vec, a_rad_std_vec
\ No newline at end of file
+    a_rad_avg_vec, a_rad_max_vec, a_rad_min_vec, a_rad_std_vec = radial_statistics(a_mat.flatten()[off_edge],
+                                                                                   r_vec[off_edge], bin_edges)
+
+    return a_mat, a_rad_avg_vec, a_rad_max_vec, a_rad_min_vec, a_rad_std_vec
+
+def image_windows_view(image, win_x, win_y, win_step_x=1, win_step_y=1):
+    """
+    Returns a read-only view of all the windows in an image without copying any data
+
+    Parameters
+    ----------
+    image : 2D numpy array
+        Image to be windowed
+    win_x : unsigned int
+        Size of the window, in pixels, in the first dimension
+    win_y : unsigned int
+        Size of the window, in pixels, in the second dimension
+    win_step_x : unsigned int, optional
+        Step size, in pixels, between windows in the first dimension. Default 1
+    win_step_y : unsigned int, optional
+        Step size, in pixels, between windows in the second dimension. Default 1
+
+    Returns
+    -------
+    win_view : 4D numpy array
+        Windows arranged as [x step, y step, window x, window y].
+        Window [i, j] is image[i*win_step_x:i*win_step_x+win_x, j*win_step_y:j*win_step_y+win_y]
+    """
+    image = np.ascontiguousarray(image)
+    nx = (image.shape[0] - win_x) // win_step_x + 1
+    ny = (image.shape[1] - win_y) // win_step_y + 1
+    stride_x, stride_y = image.strides
+    win_view = np.lib.stride_tricks.as_strided(image, shape=(nx, ny, win_x, win_y),
+                                               strides=(stride_x * win_step_x, stride_y * win_step_y,
+                                                        stride_x, stride_y))
+    win_view.flags.writeable = False
+    return win_view
+
+
+def window_coverage_counts(im_x, im_y, win_x, win_y, win_step_x=1, win_step_y=1):
+    """
+    Calculates the number of windows that cover each pixel of an image directly from the window geometry
+
+    Parameters
+    ----------
+    im_x : unsigned int
+        Size of the image, in pixels, in the first dimension
+    im_y : unsigned int
+        Size of the image, in pixels, in the second dimension
+    win_x : unsigned int
+        Size of the window, in pixels, in the first dimension
+    win_y : unsigned int
+        Size of the window, in pixels, in the second dimension
+    win_step_x : unsigned int, optional
+        Step size, in pixels, between windows in the first dimension. Default 1
+    win_step_y : unsigned int, optional
+        Step size, in pixels, between windows in the second dimension. Default 1
+
+    Returns
+    -------
+    counts : 2D numpy array of uints
+        Number of windows containing each pixel of the image
+    """
+    def _axis_counts(im_size, win_size, win_step):
+        steps = np.arange(0, im_size-win_size+1, win_step)
+        edges = np.zeros(im_size+1, dtype=np.int64)
+        np.add.at(edges, steps, 1)
+        np.add.at(edges, steps+win_size, -1)
+        return np.cumsum(edges[:-1])
+
+    counts_x = _axis_counts(im_x, win_x, win_step_x)
+    counts_y = _axis_counts(im_y, win_y, win_step_y)
+
+    return np.outer(counts_x, counts_y).astype(np.uint32)
+
+
+def overlap_add_windows(accum, windows, x_start=0, win_step_x=1, win_step_y=1):
+    """
+    Adds a block of windows into an image in place.  Rather than looping over the windows, each pixel offset
+    within the window is added to a strided view of the image, so the number of numpy operations scales with
+    the window size and not with the number of windows.
+
+    Parameters
+    ----------
+    accum : numpy array
+        Image to which the windows will be added.  Modified in place.
+    windows : numpy array
+        Windows arranged as [x step, y step, window x, window y], as returned by image_windows_view.
+        Any leading dimensions, such as components, must also be present in accum.
+    x_start : unsigned int, optional
+        Index of the first window step in the first dimension contained in windows. Default 0
+    win_step_x : unsigned int, optional
+        Step size, in pixels, between windows in the first dimension. Default 1
+    win_step_y : unsigned int, optional
+        Step size, in pixels, between windows in the second dimension. Default 1
+
+    Returns
+    -------
+    accum : numpy array
+        The image with the windows added
+    """
+    n_rows, ny, win_x, win_y = windows.shape[-4:]
+    x_0 = x_start*win_step_x
+    x_span = (n_rows-1)*win_step_x+1
+    y_span = (ny-1)*win_step_y+1
+
+    for dx in range(win_x):
+        x_slice = slice(x_0+dx, x_0+dx+x_span, win_step_x)
+        for dy in range(win_y):
+            accum[..., x_slice, dy:dy+y_span:win_step_y] += windows[..., dx, dy]
+
+    return accum
+
+
+def _windows_overlapping(pix_start, pix_stop, win_size, win_step, num_steps):
+    """
+    Finds the range of window steps, along one dimension, whose windows overlap the pixels [pix_start, pix_stop)
+
+    Parameters
+    ----------
+    pix_start : unsigned int
+        First pixel of the range
+    pix_stop : unsigned int
+        Pixel after the last pixel of the range
+    win_size : unsigned int
+        Size of the window, in pixels
+    win_step : unsigned int
+        Step size, in pixels, between windows
+    num_steps : unsigned int
+        Number of windows along this dimension
+
+    Returns
+    -------
+    step_start : int
+        First window step overlapping the range
+    step_stop : int
+        Window step after the last one overlapping the range
+    """
+    step_start = max(0, -(-(pix_start - win_size + 1) // win_step))
+    step_stop = min(num_steps, (pix_stop - 1) // win_step + 1)
+
+    return step_start, step_stop
+
+
+def _reconstruct_tile(tile_parms):
+    """
+    Reconstructs one tile of the image separately for each component.  Used by
+    ImageWindow.clean_and_build_separate_components
+
+    Parameters
+    ----------
+    tile_parms : tuple
+        tile_U : 3D numpy array
+            U for the windows overlapping the tile arranged as [x step, y step, component]
+        ds_V : 3D numpy array
+            S.V for the selected components arranged as [component, window x, window y]
+        geometry : tuple of int
+            win_x, win_y, win_step_x, win_step_y, nx, ny
+        bounds : tuple of int
+            x_start, x_stop, y_start, y_stop of the tile in pixels
+        first_steps : tuple of int
+            Window steps in x and y of the first window in tile_U
+
+    Returns
+    -------
+    tile_sum : 3D numpy array
+        Sum of the overlapping windows of each component within the tile arranged as [component, x, y]
+    """
+    tile_U, ds_V, geometry, bounds, first_steps = tile_parms
+    win_x, win_y, win_step_x, win_step_y, _, _ = geometry
+    x_0, x_1, y_0, y_1 = bounds
+    ix_0, iy_0 = first_steps
+    n_wx, n_wy = tile_U.shape[:2]
+
+    '''
+    Build the windows of every component at once and add them into an array
+    covering all of the windows before cropping it to the tile
+    '''
+    tile_wins = np.einsum('xyk,kab->kxyab', tile_U, ds_V)
+
+    ext_x0 = ix_0 * win_step_x
+    ext_y0 = iy_0 * win_step_y
+    accum = np.zeros([ds_V.shape[0], (n_wx - 1) * win_step_x + win_x, (n_wy - 1) * win_step_y + win_y])
+    overlap_add_windows(accum, tile_wins, 0, win_step_x, win_step_y)
+
+    tile_sum = np.zeros([ds_V.shape[0], x_1 - x_0, y_1 - y_0])
+    crop_x = accum[:, max(0, x_0 - ext_x0):x_1 - ext_x0]
+    crop = crop_x[:, :, max(0, y_0 - ext_y0):y_1 - ext_y0]
+    tile_sum[:, max(0, ext_x0 - x_0):max(0, ext_x0 - x_0) + crop.shape[1],
+             max(0, ext_y0 - y_0):max(0, ext_y0 - y_0) + crop.shape[2]] = crop
+
+    return tile_sum
@@ -154,13 +154,11 @@ if __name__ == '__main__':
     cistats.sort_stats('cumulative')
     cistats.print_stats(25)
 
-    im_x = h5_wins.parent.attrs['image_x']
-    im_y = h5_wins.parent.attrs['image_y']
     clean_name = '_'.join([basename, h5_clean_image.name.split('/')[-1]])
 
-    plot_comps = min(plot_comps, h5_clean_image.shape[1])
+    plot_comps = min(plot_comps, h5_clean_image.shape[0])
 
-    fig202, axes202 = plot_map_stack(np.reshape(h5_clean_image[:, :plot_comps], [im_x, im_y, plot_comps]),
+    fig202, axes202 = plot_map_stack(np.transpose(h5_clean_image[:plot_comps], [1, 2, 0]),
                                      num_comps=plot_comps, stdevs=2, show_colorbar=True)
     fig202.savefig(os.path.join(folder, clean_name+'_Components.png'), format='png', dpi=300)
     plt.close('all')
@@ -11,31 +11,56 @@ from warnings import warn
 import numpy as np
 from sklearn.utils.extmath import randomized_svd
 
+from ..io.be_hdf_utils import maxReadPixels
+from ..io.hdf_catalog import updateCatalog
 from ..io.hdf_utils import getH5DsetRefs, checkAndLinkAncillary, \
-    getH5RegRefIndices, createRefFromIndices, checkIfMain, calc_chunks
+    getH5RegRefIndices, createRefFromIndices, checkIfMain, calc_chunks, calcParmsHash, findIdenticalResult, \
+    markModified
 from ..io.io_hdf5 import ioHDF5
-from ..io.io_utils import check_dtype
+from ..io.io_utils import check_dtype, getAvailableMem, transformToTargetType
 from ..io.microdata import MicroDataset, MicroDataGroup
 
 
 ###############################################################################
 
-def doSVD(h5_main, num_comps=None):
+def doSVD(h5_main, num_comps=None, force=False, max_mem_mb=1024, n_iter=3, method='randomized', batch_size=None):
     """
     Does SVD on the provided dataset and writes the result. File is not closed
 
+    Datasets that do not fit within the memory limit are decomposed out-of-core by a randomized SVD that streams
+    over the dataset in blocks of rows. This requires n_iter + 3 passes over the dataset.
+
+    The incremental method instead folds one batch of rows at a time into the decomposition and needs only two
+    passes over the dataset. Its results can later be extended with new rows via update_svd()
+
+    The number of passes made is recorded in the 'num_passes' attribute of the results group. Checking for existing
+    results does not read the dataset
+
     Parameters
     ----------
     h5_main : h5py.Dataset reference
         Reference to the dataset on which SVD will be performed
     num_comps : Unsigned integer (Optional)
         Number of principal components of interest
+    force : Boolean (Optional. Default = False)
+        Whether or not to perform SVD even if the results of SVD with the same parameters
+        on this dataset already exist in the file
+    max_mem_mb : unsigned int (Optional. Default = 1024)
+        Maximum memory in megabytes that the data read from the file may occupy
+    n_iter : unsigned int (Optional. Default = 3)
+        Number of power iterations of the randomized SVD
+    method : str (Optional. Default = 'randomized')
+        'randomized' or 'incremental'
+    batch_size : unsigned int (Optional)
+        Number of rows folded in at a time by the incremental method. Calculated from max_mem_mb if not provided
 
     Returns
     -------
     h5_pca : h5py.Datagroup reference
         Reference to the group containing the PCA results
     """
+    if method not in ['randomized', 'incremental']:
+        raise ValueError('method must be either "randomized" or "incremental"')
 
     if not checkIfMain(h5_main):
         warn('Dataset does not meet requirements for performing PCA.')
@@ -50,13 +75,43 @@ def doSVD(h5_main, num_comps=None):
     We use the minimum of the actual dtype's itemsize and float32 since we
     don't want to read it in yet and do the proper type conversions.
     '''
-    func, is_complex, is_compound, n_features, n_samples, type_mult = check_dtype(h5_main)
+    # complex and compound values are viewed as interleaved real values to avoid copies
+    func, is_complex, is_compound, n_features, n_samples, type_mult = check_dtype(h5_main, interleaved=True)
 
     if num_comps is None:
         num_comps = min(n_samples, n_features)
     else:
         num_comps = min(n_samples, n_features, num_comps)
 
+    max_mem = min(max_mem_mb * 1024 ** 2, 0.75 * getAvailableMem())
+    # The raw data as well as the converted copy need to fit in memory
+    data_mem = n_samples * (h5_main.dtype.itemsize * h5_main.shape[1] + type_mult * h5_main.shape[1])
+    in_memory = data_mem <= max_mem
+
+    # converted rows are held in double precision alongside the raw rows
+    rows_per_block = int(maxReadPixels(max_mem, n_samples, h5_main.shape[1],
+                                       bytes_per_bin=h5_main.dtype.itemsize + 2 * type_mult))
+
+    # Only the parameters that were requested are hashed. The choice between the in-memory and streaming
+    # randomized SVD and the default batch size depend on the free memory and must not prevent reuse of results
+    svd_parms = {'num_components': num_comps, 'method': method}
+    if method == 'incremental':
+        svd_parms['batch_size'] = batch_size
+        svd_type = 'incremental'
+        if batch_size is None:
+            batch_size = rows_per_block
+        rows_per_block = batch_size = int(batch_size)
+    else:
+        svd_parms['n_iter'] = n_iter
+        svd_type = 'sklearn-randomized' if in_memory else 'streaming-randomized'
+
+    parms_hash = calcParmsHash(h5_main, 'SVD', svd_parms)
+    if not force:
+        h5_svd_grp = findIdenticalResult(h5_main, 'SVD', parms_hash)
+        if h5_svd_grp is not None:
+            print('Returning existing SVD results in {}. Use force=True to recompute'.format(h5_svd_grp.name))
+            return h5_svd_grp
+
     '''
     Check if a number of compnents has been set and ensure that the number is less than
     the minimum axis length of the data.  If both conditions are met, use fsvd.  If not
@@ -65,14 +120,23 @@ def doSVD(h5_main, num_comps=None):
     C.Smith -- We might need to put a lower limit on num_comps in the future.  I don't
                know enough about svd to be sure.
     '''
-    print 'Performing SVD decomposition'
-
-
-    U, S, V = randomized_svd(func(h5_main), num_comps, n_iter=3)
-
-    svd_type = 'sklearn-randomized'
-
-    print 'SVD took {} seconds.  Writing results to file.'.format((time.time() - t1))
+    print('Performing SVD decomposition')
+
+    if svd_type == 'sklearn-randomized':
+        U, S, V = randomized_svd(func(h5_main), num_comps, n_iter=n_iter)
+        u_transform = None
+        num_passes = 1
+    elif svd_type == 'incremental':
+        print('Folding in the dataset in batches of {} rows'.format(batch_size))
+        S, V = _incrementalSVD(h5_main, func, num_comps, batch_size)
+        u_transform = V.T / np.where(S > 0, S, 1)[np.newaxis, :]
+        num_passes = 1
+        U = None
+    else:
+        print('Streaming over the dataset in blocks of {} rows'.format(rows_per_block))
+        S, V, u_transform, num_passes = _streamingRandomizedSVD(h5_main, func, num_comps, rows_per_block,
+                                                                n_iter=n_iter)
+        U = None
 
     '''
     Create datasets for V and S, deleting original arrays afterward to save
@@ -86,24 +150,27 @@ def doSVD(h5_main, num_comps=None):
     ds_inds.attrs['units'] = ''
     del S
 
-    u_chunks = calc_chunks(U.shape, np.float32(0).itemsize)
-    ds_U = MicroDataset('U', data=np.float32(U), chunking=u_chunks)
+    u_chunks = calc_chunks((n_samples, num_comps), np.float32(0).itemsize)
+    if svd_type == 'incremental':
+        # U needs to grow as rows are added via update_svd
+        ds_U = MicroDataset('U', data=np.zeros((0, num_comps), dtype=np.float32), chunking=u_chunks,
+                            resizable=True)
+    elif U is None:
+        # U is written one block of rows at a time once the group has been created
+        ds_U = MicroDataset('U', data=[], dtype=np.float32, chunking=u_chunks, maxshape=(n_samples, num_comps))
+    else:
+        ds_U = MicroDataset('U', data=np.float32(U), chunking=u_chunks)
     del U
 
     if is_complex:
-        # Put the real and imaginary sections together to make complex V
-        V = V[:, :int(0.5 * V.shape[1])] + 1j * V[:, int(0.5 * V.shape[1]):]
+        # Put the interleaved real and imaginary components together to make complex V
+        V = np.complex64(transformToTargetType(V, h5_main.dtype, interleaved=True))
         v_chunks = calc_chunks(V.shape, h5_main.dtype.itemsize)
-        ds_V = MicroDataset('V', data=np.complex64(V), chunking=v_chunks)
+        ds_V = MicroDataset('V', data=V, chunking=v_chunks)
     elif is_compound:
-        V2 = np.empty([V.shape[0], h5_main.shape[1]], dtype=h5_main.dtype)
-        for iname, name in enumerate(h5_main.dtype.names):
-            istart = iname * V2.shape[1]
-            iend = (iname + 1) * V2.shape[1]
-            V2[name] = V[:, istart:iend]
-        v_chunks = calc_chunks(V2.shape, h5_main.dtype.itemsize)
-        ds_V = MicroDataset('V', data=V2, chunking=v_chunks)
-        del V2
+        V = transformToTargetType(V, h5_main.dtype, interleaved=True)
+        v_chunks = calc_chunks(V.shape, h5_main.dtype.itemsize)
+        ds_V = MicroDataset('V', data=V, chunking=v_chunks)
     else:
         v_chunks = calc_chunks(V.shape, h5_main.dtype.itemsize)
         ds_V = MicroDataset('V', data=np.float32(V), chunking=v_chunks)
@@ -122,6 +189,13 @@ def doSVD(h5_main, num_comps=None):
     '''
     svd_grp.attrs['num_components'] = num_comps
     svd_grp.attrs['svd_method'] = svd_type
+    svd_grp.attrs['parms_hash'] = parms_hash
+    if svd_type == 'incremental':
+        svd_grp.attrs['batch_size'] = batch_size
+    else:
+        svd_grp.attrs['n_iter'] = n_iter
+        if svd_type == 'streaming-randomized':
+            svd_grp.attrs['batch_size'] = rows_per_block
 
     '''
     Write the data and retrieve the HDF5 objects then delete the Microdatasets
@@ -137,6 +211,19 @@ def doSVD(h5_main, num_comps=None):
 
     del ds_S, ds_V, ds_U, svd_grp
 
+    if u_transform is not None:
+        if h5_U.shape[0] != n_samples:
+            h5_U.resize(n_samples, axis=0)
+        for start, stop, data_block in _readRowBlocks(h5_main, func, rows_per_block):
+            h5_U[start:stop] = np.float32(np.dot(data_block, u_transform))
+        num_passes += 1
+        markModified(h5_U)
+        hdf.flush()
+
+    h5_svd_grp.attrs['num_passes'] = num_passes
+    h5_svd_grp.attrs['time_taken'] = time.time() - t1
+    print('SVD took {} seconds and {} pass(es) over the data.'.format(round(time.time() - t1, 2), num_passes))
+
     # Will attempt to see if there is anything linked to this dataset.
     # Since I was meticulous about the translators that I wrote, I know I will find something here
     checkAndLinkAncillary(h5_U,
@@ -174,6 +261,259 @@ def doSVD(h5_main, num_comps=None):
     return h5_svd_grp
 
 
+###############################################################################
+
+def _readRowBlocks(h5_main, func, rows_per_block):
+    """
+    Reads the dataset one block of rows at a time and converts each block to real values
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset reference
+        Dataset to be read
+    func : function
+        Converts a block of the dataset to real values. See io_utils.check_dtype
+    rows_per_block : unsigned int
+        Number of rows to read at a time
+
+    Returns
+    -------
+    generator of (start, stop, data_block)
+        Rows start to stop of the dataset as a 2D float64 numpy array
+    """
+    n_samples = h5_main.shape[0]
+    for start in range(0, n_samples, rows_per_block):
+        stop = min(start + rows_per_block, n_samples)
+        yield start, stop, np.asarray(func(h5_main[start:stop]), dtype=np.float64)
+
+
+def _getSigns(V):
+    """
+    Signs that make the largest element of each right singular vector positive.
+    This is the same convention as sklearn's svd_flip (based on V) and makes the results deterministic
+
+    Parameters
+    ----------
+    V : 2D numpy array
+        Right singular vectors arranged as [component, features]
+
+    Returns
+    -------
+    signs : 1D numpy array
+        +1 or -1 for each component
+    """
+    signs = np.sign(V[np.arange(V.shape[0]), np.argmax(np.abs(V), axis=1)])
+    signs[signs == 0] = 1
+    return signs
+
+
+def _streamingRandomizedSVD(h5_main, func, num_comps, rows_per_block, n_iter=3, n_oversamples=10,
+                            random_state=0):
+    """
+    Randomized SVD that only holds a block of rows of the dataset in memory at any time.
+
+    An orthonormal basis for the row space of the data is found by power iterations of the form
+    P = orth(A.T * A * P), each of which needs a single pass over the dataset. A final pass
+    accumulates the R factor of the QR decomposition of A * P, whose SVD yields the singular values
+    and right singular vectors. The left singular vectors are not computed here since they are as
+    large as the dataset. Instead, the matrix that transforms rows of the data into rows of U is returned.
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset reference
+        Dataset to decompose, arranged as [samples, features]
+    func : function
+        Converts a block of the dataset to real values. See io_utils.check_dtype
+    num_comps : unsigned int
+        Number of components to compute
+    rows_per_block : unsigned int
+        Number of rows to read at a time
+    n_iter : unsigned int (Optional. Default = 3)
+        Number of power iterations. Same meaning as in sklearn's randomized_svd
+    n_oversamples : unsigned int (Optional. Default = 10)
+        Number of additional random vectors used to improve the accuracy of the leading components
+    random_state : int (Optional. Default = 0)
+        Seed for the random projection
+
+    Returns
+    -------
+    S : 1D numpy array
+        Singular values
+    V : 2D numpy array
+        Right singular vectors arranged as [component, features]
+    u_transform : 2D numpy array
+        Matrix that converts a row of real valued data into the corresponding row of U, arranged as
+        [features, component]
+    num_passes : unsigned int
+        Number of passes made over the dataset
+    """
+    n_features = func(h5_main[:1]).shape[1]
+    n_random = min(num_comps + n_oversamples, n_features)
+
+    basis = np.random.RandomState(random_state).normal(size=(n_features, n_random))
+    basis, _ = np.linalg.qr(basis)
+
+    num_passes = 0
+    for _ in range(n_iter + 1):
+        gram_proj = np.zeros((n_features, n_random))
+        for _, _, data_block in _readRowBlocks(h5_main, func, rows_per_block):
+            gram_proj += np.dot(data_block.T, np.dot(data_block, basis))
+        basis, _ = np.linalg.qr(gram_proj)
+        num_passes += 1
+
+    # R factor of A * basis, accumulated over the blocks
+    r_mat = np.zeros((0, n_random))
+    for _, _, data_block in _readRowBlocks(h5_main, func, rows_per_block):
+        r_mat = np.linalg.qr(np.vstack((r_mat, np.dot(data_block, basis))), mode='r')
+    num_passes += 1
+
+    _, S, Wt = np.linalg.svd(r_mat, full_matrices=False)
+    S = S[:num_comps]
+    V = np.dot(Wt[:num_comps], basis.T)
+
+    V *= _getSigns(V)[:, np.newaxis]
+
+    u_transform = V.T / np.where(S > 0, S, 1)[np.newaxis, :]
+
+    return S, V, u_transform, num_passes
+
+
+def _foldInRows(S, V, new_rows, num_comps):
+    """
+    Updates a truncated SVD with additional rows of data.
+
+    The SVD of [diag(S) * V; new_rows] is computed. Since its size only depends on the number of components
+    and new rows, the update needs constant memory regardless of how many rows were already folded in.
+
+    Parameters
+    ----------
+    S : 1D numpy array
+        Current singular values
+    V : 2D numpy array
+        Current right singular vectors arranged as [component, features]
+    new_rows : 2D real numpy array
+        Rows to fold in arranged as [rows, features]
+    num_comps : unsigned int
+        Number of components to retain
+
+    Returns
+    -------
+    rotation : 2D numpy array
+        Left singular vectors of the update. The first len(S) rows rotate the existing rows of U.
+        The remaining rows are the rows of U for the new data.
+    S : 1D numpy array
+        Updated singular values
+    V : 2D numpy array
+        Updated right singular vectors
+    """
+    rotation, S, V = np.linalg.svd(np.vstack((S[:, np.newaxis] * V, new_rows)), full_matrices=False)
+    return rotation[:, :num_comps], S[:num_comps], V[:num_comps]
+
+
+def _incrementalSVD(h5_main, func, num_comps, batch_size):
+    """
+    Truncated SVD computed by folding in one batch of rows at a time (Brand's incremental SVD)
+
+    Parameters
+    ----------
+    h5_main : h5py.Dataset reference
+        Dataset to decompose, arranged as [samples, features]
+    func : function
+        Converts a block of the dataset to real values. See io_utils.check_dtype
+    num_comps : unsigned int
+        Number of components to compute
+    batch_size : unsigned int
+        Number of rows folded in at a time
+
+    Returns
+    -------
+    S : 1D numpy array
+        Singular values
+    V : 2D numpy array
+        Right singular vectors arranged as [component, features]
+    """
+    S = np.zeros(0)
+    V = None
+    for _, _, data_block in _readRowBlocks(h5_main, func, batch_size):
+        if V is None:
+            V = np.zeros((0, data_block.shape[1]))
+        _, S, V = _foldInRows(S, V, data_block, num_comps)
+
+    return S, V * _getSigns(V)[:, np.newaxis]
+
+
+def update_svd(h5_svd_grp, new_rows, max_mem_mb=1024):
+    """
+    Folds new rows of data, such as those appended to a dataset during an ongoing acquisition, into existing
+    SVD results and extends U accordingly. The SVD must have been computed via doSVD(..., method='incremental')
+
+    Parameters
+    ----------
+    h5_svd_grp : h5py.Group reference
+        Group containing the results of the incremental SVD
+    new_rows : 2D numpy array or h5py.Dataset reference
+        New rows of data arranged as [rows, spectroscopic] with the same datatype as the original dataset
+    max_mem_mb : unsigned int (Optional. Default = 1024)
+        Maximum memory in megabytes that portions of U read from the file may occupy
+
+    Returns
+    -------
+    h5_svd_grp : h5py.Group reference
+        Group containing the updated results
+    """
+    if h5_svd_grp.attrs.get('svd_method') != 'incremental':
+        raise ValueError('Only results from doSVD(..., method="incremental") can be updated')
+
+    t1 = time.time()
+
+    h5_U = h5_svd_grp['U']
+    h5_S = h5_svd_grp['S']
+    h5_V = h5_svd_grp['V']
+
+    func = check_dtype(h5_V, interleaved=True)[0]
+    new_rows = np.asarray(func(np.atleast_2d(new_rows[()])), dtype=np.float64)
+    V = np.asarray(func(h5_V[()]), dtype=np.float64)
+    if new_rows.shape[1] != V.shape[1]:
+        raise ValueError('New rows have {} real valued features while the SVD has {}'.format(new_rows.shape[1],
+                                                                                           V.shape[1]))
+
+    num_comps = h5_S.shape[0]
+    num_old_rows = h5_U.shape[0]
+
+    rotation, S, V = _foldInRows(np.float64(h5_S[()]), V, new_rows, num_comps)
+
+    signs = _getSigns(V)
+    V *= signs[:, np.newaxis]
+    rotation *= signs[np.newaxis, :]
+
+    # Rotate the existing rows of U, a block at a time, and append the new rows
+    max_mem = min(max_mem_mb * 1024 ** 2, 0.75 * getAvailableMem())
+    rows_per_block = int(maxReadPixels(max_mem, num_old_rows, num_comps, bytes_per_bin=16))
+    for start in range(0, num_old_rows, rows_per_block):
+        stop = min(start + rows_per_block, num_old_rows)
+        h5_U[start:stop] = np.float32(np.dot(h5_U[start:stop], rotation[:num_comps]))
+    h5_U.resize(num_old_rows + new_rows.shape[0], axis=0)
+    h5_U[num_old_rows:] = np.float32(rotation[num_comps:])
+
+    h5_S[:] = np.float32(S)
+    h5_V[:] = transformToTargetType(V, h5_V.dtype, interleaved=True)
+    for h5_dset in [h5_U, h5_S, h5_V]:
+        markModified(h5_dset)
+
+    # The results no longer correspond to a single run of doSVD with the recorded parameters
+    if 'parms_hash' in h5_svd_grp.attrs:
+        del h5_svd_grp.attrs['parms_hash']
+    h5_svd_grp.attrs['num_updates'] = h5_svd_grp.attrs.get('num_updates', 0) + 1
+    h5_svd_grp.attrs['time_taken'] = h5_svd_grp.attrs.get('time_taken', 0) + time.time() - t1
+    updateCatalog(h5_svd_grp)
+    h5_svd_grp.file.flush()
+
+    print('Folded {} new rows into {} in {} seconds'.format(new_rows.shape[0], h5_svd_grp.name,
+                                                         round(time.time() - t1, 2)))
+
+    return h5_svd_grp
+
+
 ###############################################################################
 
 def simplifiedKPCA(kpca, source_data):
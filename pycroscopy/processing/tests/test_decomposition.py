@@ -0,0 +1,45 @@
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+import h5py
+import numpy as np
+
+from pycroscopy.processing.decomposition import Decomposition
+from pycroscopy.processing.tests.test_svd_utils import _writeMainDataset
+
+
+class TestStreamingDecomposition(TestCase):
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.h5_file = h5py.File(path.join(self.folder, 'test.h5'), 'w')
+        self.data = np.float32(np.random.RandomState(0).rand(300, 32))
+        self.h5_main = _writeMainDataset(self.h5_file, self.data)
+
+    def tearDown(self):
+        self.h5_file.close()
+        rmtree(self.folder)
+
+    def test_all_components_regardless_of_memory(self):
+        for max_mem in [300 * 32 * 12, 8 * 32 * 12]:
+            decomp = Decomposition(self.h5_main, 'IncrementalPCA')
+            decomp.max_mem = max_mem
+            decomp.doDecomposition(streaming=True, force=True)
+            self.assertEqual(decomp.estimator.n_components_, self.data.shape[1])
+
+    def test_matches_in_memory_fit(self):
+        # keeping all the components makes the incremental fit exact
+        decomp = Decomposition(self.h5_main, 'IncrementalPCA')
+        decomp.max_mem = 8 * 32 * 12
+        decomp.doDecomposition(streaming=True)
+        data = np.float64(self.data) - np.mean(self.data, axis=0)
+        S = np.linalg.svd(data, compute_uv=False)
+        self.assertTrue(np.allclose(decomp.estimator.singular_values_, S, rtol=1e-4))
+
+    def test_reused_with_equal_random_state(self):
+        h5_groups = [Decomposition(self.h5_main, 'PCA', n_components=4).doDecomposition(
+            num_fit_samples=100, random_state=np.random.RandomState(seed)) for seed in [0, 0, 1]]
+        self.assertEqual(h5_groups[0], h5_groups[1])
+        self.assertNotEqual(h5_groups[0], h5_groups[2])
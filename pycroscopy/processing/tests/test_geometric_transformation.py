@@ -0,0 +1,129 @@
+from unittest import TestCase
+
+import numpy as np
+from scipy.ndimage import fourier_shift, gaussian_filter
+from skimage.feature import match_descriptors
+from skimage.measure import ransac
+
+from pycroscopy.processing.geometric_transformation import registerTranslations, matchDescriptors, ransacTransform, \
+    RigidTransform, TranslationTransform
+
+try:
+    from skimage.registration import phase_cross_correlation
+
+    def _registerPair(src_image, target_image, upsample_factor):
+        # register_translation did not normalize the cross-power spectrum
+        return phase_cross_correlation(src_image, target_image, upsample_factor=upsample_factor,
+                                       normalization=None)[0]
+except ImportError:
+    from skimage.feature import register_translation
+
+    def _registerPair(src_image, target_image, upsample_factor):
+        return register_translation(src_image, target_image, upsample_factor=upsample_factor)[0]
+
+
+class TestRegisterTranslations(TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        num_images = 8
+        image = gaussian_filter(rand.rand(64, 64), 2)
+        self.shifts = np.cumsum(rand.uniform(-3, 3, (num_images, 2)), axis=0)
+        self.shifts[0] = 0
+        self.stack = np.array([np.real(np.fft.ifft2(fourier_shift(np.fft.fft2(image), shift)))
+                               for shift in self.shifts])
+        self.stack += 0.01 * rand.randn(*self.stack.shape)
+
+    def test_previous_matches_skimage(self):
+        for upsample_factor in [1, 10]:
+            expected = np.array([_registerPair(self.stack[ind], self.stack[ind + 1], upsample_factor)
+                                 for ind in range(self.stack.shape[0] - 1)])
+            for kwargs in [{}, {'batch_size': 3}, {'batch_size': 2, 'single_precision': True}]:
+                shifts = registerTranslations(self.stack, upsample_factor=upsample_factor, **kwargs)
+                self.assertTrue(np.allclose(shifts, expected))
+
+    def test_running_reference(self):
+        shifts = registerTranslations(self.stack, upsample_factor=10, reference='running', batch_size=3)
+        self.assertTrue(np.allclose(shifts, -self.shifts, atol=0.1))
+
+
+class TestMatchDescriptors(TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        # 150 of the descriptors in the first image reappear with some noise next to 60 new ones
+        self.desc1 = rand.rand(200, 16)
+        self.desc2 = np.vstack([self.desc1[rand.permutation(200)[:150]] + 0.05 * rand.randn(150, 16),
+                                rand.rand(60, 16)])
+        self.bits1 = rand.rand(200, 256) > 0.5
+        self.bits2 = np.vstack([self.bits1[rand.permutation(200)[:150]] ^ (rand.rand(150, 256) < 0.1),
+                                rand.rand(60, 256) > 0.5])
+
+    def __check_matches(self, matches, expected):
+        self.assertEqual(sorted(map(tuple, matches)), sorted(map(tuple, expected)))
+
+    def test_brute(self):
+        for cross_check in [True, False]:
+            self.__check_matches(matchDescriptors(self.desc1, self.desc2, method='brute', cross_check=cross_check),
+                                 match_descriptors(self.desc1, self.desc2, cross_check=cross_check))
+
+    def test_kdtree_matches_skimage(self):
+        for cross_check in [True, False]:
+            for max_ratio in [1.0, 0.8]:
+                expected = match_descriptors(self.desc1, self.desc2, cross_check=cross_check, max_ratio=max_ratio)
+                for method in ['kdtree', 'auto']:
+                    self.__check_matches(matchDescriptors(self.desc1, self.desc2, method=method,
+                                                          cross_check=cross_check, max_ratio=max_ratio), expected)
+
+    def test_hamming_matches_skimage(self):
+        packed1 = np.packbits(self.bits1, axis=1)
+        packed2 = np.packbits(self.bits2, axis=1)
+        for cross_check in [True, False]:
+            for max_ratio in [1.0, 0.8]:
+                expected = match_descriptors(self.bits1, self.bits2, cross_check=cross_check, max_ratio=max_ratio)
+                for method in ['hamming', 'auto']:
+                    self.__check_matches(matchDescriptors(self.bits1, self.bits2, method=method,
+                                                          cross_check=cross_check, max_ratio=max_ratio), expected)
+                self.__check_matches(matchDescriptors(packed1, packed2, method='hamming', cross_check=cross_check,
+                                                      max_ratio=max_ratio), expected)
+
+    def test_no_descriptors(self):
+        self.assertEqual(matchDescriptors(self.desc1[:0], self.desc2).shape, (0, 2))
+
+
+class TestRansacTransform(TestCase):
+
+    def setUp(self):
+        rand = np.random.RandomState(0)
+        num_points = 80
+        self.src = rand.uniform(0, 100, (num_points, 2))
+        self.noise = 0.1 * rand.randn(num_points, 2)
+        outliers = rand.permutation(num_points)[:20]
+        self.offsets = np.zeros((num_points, 2))
+        self.offsets[outliers] = rand.uniform(10, 30, (outliers.size, 2))
+        self.inliers = np.ones(num_points, dtype=bool)
+        self.inliers[outliers] = False
+
+    def __check_model(self, transform, dst, min_samples, expected):
+        model, inliers = ransacTransform(self.src, dst, transform, min_samples=min_samples, residual_threshold=1,
+                                         max_trials=200, random_state=1)
+        self.assertTrue(np.array_equal(inliers, self.inliers))
+        self.assertTrue(np.allclose(model.params, expected.params, atol=0.1))
+
+        model_exp, inliers_exp = ransac((self.src, dst), transform, min_samples=min_samples, residual_threshold=1,
+                                        max_trials=200)
+        self.assertTrue(np.array_equal(inliers, inliers_exp))
+        self.assertTrue(np.allclose(model.params, model_exp.params))
+
+    def test_translation_matches_skimage(self):
+        expected = TranslationTransform(translation=(4, -7))
+        self.__check_model(TranslationTransform, expected(self.src) + self.noise + self.offsets, 1, expected)
+
+    def test_rigid_matches_skimage(self):
+        expected = RigidTransform(rotation=0.3, translation=(5, -3))
+        self.__check_model(RigidTransform, expected(self.src) + self.noise + self.offsets, 2, expected)
+
+    def test_too_few_points(self):
+        model, inliers = ransacTransform(self.src[:1], self.src[:1], RigidTransform)
+        self.assertIsNone(model)
+        self.assertFalse(np.any(inliers))
@@ -0,0 +1,125 @@
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase
+
+import h5py
+import numpy as np
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from pycroscopy.io.hdf_utils import getH5DsetRefs, linkRefs, markModified
+from pycroscopy.io.io_hdf5 import ioHDF5
+from pycroscopy.io.microdata import MicroDataGroup, MicroDataset
+from pycroscopy.processing.svd_utils import doSVD, update_svd
+
+
+def _writeMainDataset(h5_file, data):
+    """
+    Writes the data as a Main dataset along with its ancillary datasets
+    """
+    num_pos, num_spec = data.shape
+    ds_pos_inds = MicroDataset('Position_Indices', np.arange(num_pos, dtype=np.uint32)[:, np.newaxis])
+    ds_pos_vals = MicroDataset('Position_Values', np.arange(num_pos, dtype=np.float32)[:, np.newaxis])
+    ds_spec_inds = MicroDataset('Spectroscopic_Indices', np.arange(num_spec, dtype=np.uint32)[np.newaxis])
+    ds_spec_vals = MicroDataset('Spectroscopic_Values', np.arange(num_spec, dtype=np.float32)[np.newaxis])
+    ds_main = MicroDataset('Raw_Data', data)
+
+    chan_grp = MicroDataGroup('Channel_000')
+    chan_grp.addChildren([ds_pos_inds, ds_pos_vals, ds_spec_inds, ds_spec_vals, ds_main])
+    meas_grp = MicroDataGroup('Measurement_000')
+    meas_grp.addChildren([chan_grp])
+    root_grp = MicroDataGroup('')
+    root_grp.addChildren([meas_grp])
+
+    h5_refs = ioHDF5(h5_file).writeData(root_grp)
+    h5_main = getH5DsetRefs(['Raw_Data'], h5_refs)[0]
+    linkRefs(h5_main, getH5DsetRefs(['Position_Indices', 'Position_Values', 'Spectroscopic_Indices',
+                                     'Spectroscopic_Values'], h5_refs))
+    return h5_main
+
+
+class TestSVD(TestCase):
+
+    num_comps = 4
+
+    def setUp(self):
+        self.folder = mkdtemp()
+        self.h5_file = h5py.File(path.join(self.folder, 'test.h5'), 'w')
+        rand = np.random.RandomState(0)
+        # low rank data so that the leading components are well separated
+        self.data = np.dot(rand.randn(120, self.num_comps) * [20, 10, 5, 2], rand.randn(self.num_comps, 24))
+        self.data = np.float32(self.data)
+
+    def tearDown(self):
+        self.h5_file.close()
+        rmtree(self.folder)
+
+    def __check_results(self, h5_svd_grp, data):
+        U = np.float64(h5_svd_grp['U'][()])
+        S = np.float64(h5_svd_grp['S'][()])
+        V = np.float64(h5_svd_grp['V'][()])
+        S_exact = np.linalg.svd(np.float64(data), compute_uv=False)[:self.num_comps]
+        self.assertTrue(np.allclose(S, S_exact, rtol=1e-4))
+        self.assertTrue(np.allclose(np.dot(V, V.T), np.eye(self.num_comps), atol=1e-4))
+        self.assertTrue(np.allclose(np.dot(U * S, V), data, atol=1e-3 * np.abs(data).max()))
+
+    def test_in_memory(self):
+        h5_main = _writeMainDataset(self.h5_file, self.data)
+        h5_svd_grp = doSVD(h5_main, num_comps=self.num_comps)
+        self.assertEqual(h5_svd_grp.attrs['svd_method'], 'sklearn-randomized')
+        self.__check_results(h5_svd_grp, self.data)
+
+    def test_streaming(self):
+        h5_main = _writeMainDataset(self.h5_file, self.data)
+        h5_svd_grp = doSVD(h5_main, num_comps=self.num_comps, max_mem_mb=0.01)
+        self.assertEqual(h5_svd_grp.attrs['svd_method'], 'streaming-randomized')
+        self.assertGreater(h5_svd_grp.attrs['num_passes'], 1)
+        self.__check_results(h5_svd_grp, self.data)
+
+    def test_recorded_passes(self):
+        h5_main = _writeMainDataset(self.h5_file, self.data)
+        read_rows = []
+        getitem = h5py.Dataset.__getitem__
+
+        def counting_getitem(dset, args):
+            data = getitem(dset, args)
+            if dset.name == h5_main.name:
+                read_rows.append(data.shape[0] if data.ndim > 0 else 1)
+            return data
+
+        with mock.patch.object(h5py.Dataset, '__getitem__', counting_getitem):
+            h5_svd_grp = doSVD(h5_main, num_comps=self.num_comps, max_mem_mb=0.01)
+        # Only a single row is read besides the recorded passes. Hashing the parameters does not read the data
+        self.assertEqual(sum(read_rows) // self.data.shape[0], h5_svd_grp.attrs['num_passes'])
+
+    def test_incremental(self):
+        h5_main = _writeMainDataset(self.h5_file, self.data)
+        h5_svd_grp = doSVD(h5_main, num_comps=self.num_comps, method='incremental', batch_size=16)
+        self.assertEqual(h5_svd_grp.attrs['svd_method'], 'incremental')
+        self.__check_results(h5_svd_grp, self.data)
+
+    def test_update_incremental(self):
+        h5_main = _writeMainDataset(self.h5_file, self.data[:80])
+        h5_svd_grp = doSVD(h5_main, num_comps=self.num_comps, method='incremental', batch_size=16)
+        update_svd(h5_svd_grp, self.data[80:])
+        self.assertEqual(h5_svd_grp['U'].shape, (self.data.shape[0], self.num_comps))
+        self.__check_results(h5_svd_grp, self.data)
+
+    def test_reuse_does_not_depend_on_memory(self):
+        h5_main = _writeMainDataset(self.h5_file, self.data)
+        h5_svd_grp = doSVD(h5_main, num_comps=self.num_comps)
+        self.assertEqual(doSVD(h5_main, num_comps=self.num_comps, max_mem_mb=0.01), h5_svd_grp)
+        self.assertNotEqual(doSVD(h5_main, num_comps=self.num_comps - 1), h5_svd_grp)
+
+    def test_in_place_edit_recomputes(self):
+        h5_main = _writeMainDataset(self.h5_file, self.data)
+        h5_svd_grp = doSVD(h5_main, num_comps=self.num_comps)
+        h5_main[3] = np.zeros(self.data.shape[1], dtype=np.float32)
+        markModified(h5_main)
+        h5_new_grp = doSVD(h5_main, num_comps=self.num_comps)
+        self.assertNotEqual(h5_new_grp, h5_svd_grp)
+        self.assertEqual(doSVD(h5_main, num_comps=self.num_comps), h5_new_grp)
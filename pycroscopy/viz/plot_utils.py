@@ -13,7 +13,7 @@ import matplotlib.pyplot as plt
 from matplotlib.colors import LinearSegmentedColormap
 import numpy as np
 from ..analysis.utils.be_loop import loopFitFunction
-from ..io.hdf_utils import reshape_to_Ndims, get_formatted_labels
+from ..io.hdf_utils import reshape_to_Ndims, get_formatted_labels, getCachedAuxData, readCachedAuxData
 
 
 def set_tick_font_size(axes, font_size):
@@ -1294,19 +1294,19 @@ def visualizeSHOResults(h5_main, save_plots=True, show_plots=True):
     grp_name = '_'.join([grp_name, sho_grp.name.split('/')[-1].split('-')[0], h5_main.name.split('/')[-1]])
 
     try:
-        h5_pos = h5_file[h5_main.attrs['Position_Indices']]
+        pos_inds = readCachedAuxData(h5_main, 'Position_Indices')
     except KeyError:
         print('No Position_Indices found as attribute of {}'.format(h5_main.name))
         print('Rows and columns will be calculated from dataset shape.')
         num_rows = int(np.floor((np.sqrt(h5_main.shape[0]))))
         num_cols = int(np.reshape(h5_main, [num_rows, -1, h5_main.shape[1]]).shape[1])
     else:
-        num_rows = len(np.unique(h5_pos[:,0]))
-        num_cols = len(np.unique(h5_pos[:,1]))
+        num_rows = len(np.unique(pos_inds[:,0]))
+        num_cols = len(np.unique(pos_inds[:,1]))
 
     try:
-        h5_spec_inds = h5_file[h5_main.attrs['Spectroscopic_Indices']]
-        h5_spec_vals = h5_file[h5_main.attrs['Spectroscopic_Values']]
+        h5_spec_inds = getCachedAuxData(h5_main, 'Spectroscopic_Indices')
+        h5_spec_vals = getCachedAuxData(h5_main, 'Spectroscopic_Values')
     # except KeyError:
     #     warn('No Spectrosocpic Datasets found as attribute of {}'.format(h5_main.name))
     #     raise